@@ -0,0 +1,145 @@
+"""Cost-based admission control of the tasks of the web app worker pool.
+
+Every task is given an estimated peak memory and run time from the number of cells or
+pixels it processes (AppSettings.TASK_COSTS). A task starts when a worker is free and
+its memory fits in the budget left by the running tasks, in arrival order. Tasks that
+could never fit are refused, tasks that would wait longer than the request timeout are
+turned away so the client can retry later.
+"""
+
+import asyncio
+import math
+from collections import deque
+
+from config import AppSettings
+
+
+def task_cost(kind, cells, work=None):
+    """Return the estimated (bytes, seconds) of a task.
+
+    Args:
+        kind (str): Task kind in AppSettings.TASK_COSTS.
+        cells (int): Cells or pixels held by the task.
+        work (int): Cell or pixel updates of the task, cells by default.
+
+    Returns:
+        tuple: Peak memory in bytes and run time in seconds.
+
+    """
+    model = AppSettings.TASK_COSTS[kind]
+    memory = AppSettings.TASK_BASE_MEMORY + cells * model["bytes_per_cell"]
+    return int(memory), (cells if work is None else work) / model["work_per_second"]
+
+
+class AdmissionError(Exception):
+    """A task that is not admitted.
+
+    Attributes:
+        status_code (int): 413 when the task can never run, 429 when the pool is too busy.
+        detail (str): Reason.
+        retry_after (int): Seconds before retrying for 429, else None.
+
+    """
+
+    def __init__(self, status_code, detail, retry_after=None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """FIFO queue of tasks limited by free workers, a memory budget and the queue wait."""
+
+    def __init__(self, workers, memory_budget, max_queued, timeout):
+        """Initialize the controller.
+
+        Args:
+            workers (int): Tasks running at once, one per worker process.
+            memory_budget (int): Bytes the running tasks may use together.
+            max_queued (int): Tasks that may wait for a worker.
+            timeout (float): Seconds a request may take, including the wait.
+
+        """
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.running = 0
+        self.memory = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._running_seconds = 0.0
+        self._queue = deque()
+
+    def stats(self):
+        """Return the running and queued tasks, memory in use and admitted and rejected tasks."""
+        return {
+            "running": self.running,
+            "queued": len(self._queue),
+            "memory": self.memory,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+    def estimated_wait(self):
+        """Return the seconds a new task would wait, assuming estimated run times."""
+        queued = sum(seconds for _, _, seconds in self._queue)
+        return (self._running_seconds + queued) / self.workers
+
+    async def acquire(self, memory, seconds):
+        """Wait until the task may start.
+
+        Raises:
+            AdmissionError: When the task can never run or would wait too long.
+
+        """
+        if memory > self.memory_budget:
+            self.rejected += 1
+            raise AdmissionError(413, "The request needs more memory than the server has")
+        if seconds > self.timeout:
+            self.rejected += 1
+            raise AdmissionError(413, "The request would take longer than the time limit")
+        wait = self.estimated_wait()
+        if self._queue or not self._fits(memory):
+            if len(self._queue) >= self.max_queued or wait + seconds > self.timeout:
+                self.rejected += 1
+                raise AdmissionError(429, "The server is busy", max(1, math.ceil(wait)))
+            future = asyncio.get_running_loop().create_future()
+            entry = (future, memory, seconds)
+            self._queue.append(entry)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Started just as it was cancelled
+                    self.release(memory, seconds)
+                else:
+                    self._queue.remove(entry)
+                    self._start_queued()
+                raise
+        else:
+            self._start(memory, seconds)
+        self.admitted += 1
+
+    def release(self, memory, seconds):
+        """Free the worker and memory of a finished task and start the queued tasks."""
+        self.running -= 1
+        self.memory -= memory
+        self._running_seconds -= seconds
+        self._start_queued()
+
+    def _fits(self, memory):
+        return self.running < self.workers and self.memory + memory <= self.memory_budget
+
+    def _start(self, memory, seconds):
+        self.running += 1
+        self.memory += memory
+        self._running_seconds += seconds
+
+    def _start_queued(self):
+        # In arrival order, a large task is not overtaken by the smaller ones behind it
+        while self._queue and self._fits(self._queue[0][1]):
+            future, memory, seconds = self._queue.popleft()
+            self._start(memory, seconds)
+            future.set_result(None)
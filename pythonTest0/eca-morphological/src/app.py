@@ -2,8 +2,12 @@
 ECA evolutions.
 """
 
+import logging
+
 import ca_class
 
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
 eca = ca_class.Eca(rule_number=22)
 eca.define_evolution_config(
     size=50, evolutions=50, print_method="pyplot", init_method="single_cell"
@@ -1,5 +1,9 @@
+import logging
+
 import fra_count_tr_class
 
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
 
 fra_count_obj = fra_count_tr_class.FractalCountTriangle()
 fra_count_obj.image_path = "dilated_image.png"
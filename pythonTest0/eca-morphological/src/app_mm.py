@@ -1,8 +1,13 @@
 """Example script for creating an ECA_MM object and applying all morphological operations."""
 
-import ca_mm_class
+import logging
+
 import numpy as np
 
+import ca_mm_class
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
 kernel_custom = np.array(
     [[0, 0, 0, 1, 0, 0, 0], [0, 0, 1, 1, 1, 0, 0], [0, 1, 0, 0, 0, 1, 0], [1, 1, 1, 0, 1, 1, 1]],
     np.uint8,
@@ -24,8 +29,5 @@ eca.evolution()
 
 eca.print_history()
 
-eca.dilation()
-eca.erosion()
-eca.gradation()
-eca.black_hat()
+eca.apply_all(save_file=True)
 eca.print_history()
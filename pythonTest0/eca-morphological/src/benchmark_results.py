@@ -0,0 +1,71 @@
+"""Plumbing shared by the benchmark scripts (morphology_benchmark and bilevel_png).
+
+Both time their candidates on rule 30 histories, keep the best of several runs and
+write the records as JSON next to the sources. The modules read the records back into
+their own lookup tables to pick the fastest candidate at run time.
+"""
+
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from ca_class import Eca
+
+logger = logging.getLogger(__name__)
+
+
+def results_file(path):
+    """Return the path of a results file, relative paths are in the src directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+
+def rule_30_history(rows, cols, seed=30):
+    """Return an Eca evolved with rule 30 from a random state of density 0.5."""
+    np.random.seed(seed)
+    eca = Eca(rule_number=30)
+    eca.define_evolution_config(size=cols, evolutions=rows, init_method="random")
+    eca.init_state = eca.init_random(rdensity=0.5)
+    eca.evolution()
+    return eca
+
+
+def best_time(function, repeats):
+    """Call function repeats times.
+
+    Returns:
+        tuple: Best time in seconds and the result of the last call.
+
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def save_records(records, path):
+    """Write benchmark records as JSON."""
+    with open(path, "w") as file:
+        json.dump(records, file, indent=1)
+
+
+def load_records(path):
+    """Read benchmark records, an empty list when the file is missing or invalid."""
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return []
+
+
+def run_script(run_benchmark, save_results, path):
+    """Run a benchmark with the default settings and save its records, for __main__."""
+    logging.basicConfig(level=logging.INFO, format="%(name)s - %(levelname)s - %(message)s")
+    save_results(run_benchmark(), path)
+    logger.info(f"Benchmark written to {path}")
@@ -0,0 +1,148 @@
+"""1-bit PNG encoding of bit-packed images, with PIL or OpenCV.
+
+ECA images are strictly black and white, so they are encoded as 1-bit grayscale PNGs
+straight from their packed rows (binary_morphology.pack_rows), which deflates 8 times
+less data than 8-bit images and makes smaller files. PIL encodes the packed rows as a
+mode "1" image; OpenCV unpacks them and writes them with IMWRITE_PNG_BILEVEL.
+
+Run it as a script to time both encoders for each image size of
+AppSettings.PNG_BENCHMARK_SIZES on rule 30 histories. The results are written to
+AppSettings.PNG_BENCHMARK_FILE, which the "auto" encoder reads to pick the fastest
+encoder for an image size:
+
+    python3 src/bilevel_png.py
+"""
+
+import io
+import logging
+from functools import lru_cache, partial
+
+import cv2 as cv
+import numpy as np
+from PIL import Image
+
+import benchmark_results
+import binary_morphology
+from config import AppSettings
+
+logger = logging.getLogger(__name__)
+
+
+def encode(packed, cols, compress_level=None, encoder=None):
+    """Encode packed rows as a 1-bit grayscale PNG.
+
+    Args:
+        packed (np.ndarray): uint8 array of packed rows (binary_morphology.pack_rows), 1
+            bits are white pixels. Bits past cols in the last byte of a row are ignored.
+        cols (int): Number of pixels in each row.
+        compress_level (int): zlib level from 0 to 9, AppSettings.PNG_COMPRESS_LEVEL by
+            default.
+        encoder (str): "pil", "opencv" or "auto", AppSettings.PNG_ENCODER by default.
+
+    Returns:
+        bytes: PNG image.
+
+    """
+    if compress_level is None:
+        compress_level = AppSettings.PNG_COMPRESS_LEVEL
+    encoder = encoder or AppSettings.PNG_ENCODER
+    if encoder == "auto":
+        encoder = fastest_encoder(packed.shape[0] * cols)
+    if encoder == "opencv":
+        image = binary_morphology.unpack_rows(packed, cols)
+        params = [cv.IMWRITE_PNG_BILEVEL, 1, cv.IMWRITE_PNG_COMPRESSION, compress_level]
+        _, buffer = cv.imencode(".png", image, params)
+        return buffer.tobytes()
+    if encoder != "pil":
+        raise ValueError(f"Unknown PNG encoder: {encoder}")
+    image = Image.frombytes("1", (cols, packed.shape[0]), np.ascontiguousarray(packed))
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG", compress_level=compress_level)
+    return buffered.getvalue()
+
+
+def benchmark_file():
+    """Return the path of the benchmark results, relative paths are in the src directory."""
+    return benchmark_results.results_file(AppSettings.PNG_BENCHMARK_FILE)
+
+
+def _history(rows, cols, seed=30):
+    """Rule 30 history from a random state, packed with active cells black."""
+    return benchmark_results.rule_30_history(rows, cols, seed).packed_history()
+
+
+def run_benchmark(sizes=None, encoders=None, compress_level=None, repeats=3):
+    """Time the PNG encoders.
+
+    Args:
+        sizes (list): (rows, cols) image sizes, AppSettings.PNG_BENCHMARK_SIZES by default.
+        encoders (list): Encoders to time, every encoder except "auto" by default.
+        compress_level (int): zlib level, AppSettings.PNG_COMPRESS_LEVEL by default.
+        repeats (int): Runs of each measure, the best time is kept.
+
+    Returns:
+        list: Records with rows, cols, encoder, seconds and bytes of the PNG.
+
+    """
+    sizes = sizes or AppSettings.PNG_BENCHMARK_SIZES
+    encoders = encoders or [e for e in AppSettings.PNG_ENCODERS if e != "auto"]
+    records = []
+    for rows, cols in sizes:
+        packed = _history(rows, cols)
+        expected = binary_morphology.unpack_rows(packed, cols)
+        for encoder in encoders:
+            best, png = benchmark_results.best_time(
+                partial(encode, packed, cols, compress_level, encoder), repeats
+            )
+            decoded = cv.imdecode(np.frombuffer(png, np.uint8), cv.IMREAD_GRAYSCALE)
+            if not np.array_equal(decoded, expected):
+                raise RuntimeError(f"{encoder} PNG of {rows}x{cols} does not decode to the image")
+            records.append(
+                {"rows": rows, "cols": cols, "encoder": encoder, "seconds": best, "bytes": len(png)}
+            )
+            logger.info(f"{rows}x{cols} {encoder}: {best * 1000:.2f} ms, {len(png)} bytes")
+    return records
+
+
+def save_results(records, path=None):
+    """Write benchmark records as JSON and forget the table loaded from the previous file."""
+    benchmark_results.save_records(records, path or benchmark_file())
+    load_table.cache_clear()
+
+
+@lru_cache(maxsize=4)
+def load_table(path=None):
+    """Load the benchmark as seconds per image pixels and encoder.
+
+    Returns:
+        dict: {pixels: {encoder: seconds}}, empty when there is no benchmark file.
+
+    """
+    table = {}
+    for record in benchmark_results.load_records(path or benchmark_file()):
+        if record["encoder"] in AppSettings.PNG_ENCODERS:
+            timings = table.setdefault(record["rows"] * record["cols"], {})
+            timings[record["encoder"]] = record["seconds"]
+    return table
+
+
+def fastest_encoder(pixels, default="opencv"):
+    """Return the fastest measured encoder at the closest number of pixels.
+
+    Args:
+        pixels (int): Pixels of the image.
+        default (str): Encoder when there is no benchmark.
+
+    Returns:
+        str: Encoder name.
+
+    """
+    table = load_table()
+    if not table:
+        return default
+    measured = min(table, key=lambda size: abs(np.log(size / max(pixels, 1))))
+    return min(table[measured], key=table[measured].get)
+
+
+if __name__ == "__main__":
+    benchmark_results.run_script(run_benchmark, save_results, benchmark_file())
@@ -0,0 +1,242 @@
+"""Binary morphology on bit-packed images.
+
+ECA histories are strictly binary, so a row of pixels is stored with np.packbits (8 pixels
+per byte, first pixel in the most significant bit) and processed as 64-bit words. Dilation
+and erosion become shifted ORs and ANDs of whole words and neighbouring rows, which moves
+8 times less memory than the uint8 images used by OpenCV.
+
+The results are the same as cv.dilate and cv.erode with the same anchor (the kernel center
+by default) and the default border: pixels outside the image are 0 for dilation and 1 for
+erosion.
+
+dilate and erode take and return packed rows. Chains of passes work on the words with
+to_words, dilate_words, erode_words and from_words, so the image is converted once and
+not between passes.
+"""
+
+import numpy as np
+
+from structuring_elements import kernel_offsets
+
+_WORD_BITS = 64
+_ALL_ONES = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def pack_rows(image):
+    """Packs a binary image row by row.
+
+    Args:
+        image (np.ndarray): 2D array, non zero pixels are 1.
+
+    Returns:
+        np.ndarray: uint8 array of shape (rows, ceil(cols / 8)).
+
+    """
+    return np.packbits(np.asarray(image) > 0, axis=1)
+
+
+def unpack_rows(packed, cols, value=255):
+    """Unpacks a packed image to an uint8 image.
+
+    Args:
+        packed (np.ndarray): Packed rows as returned by pack_rows.
+        cols (int): Number of columns of the image.
+        value (int): Value of the 1 pixels.
+
+    Returns:
+        np.ndarray: uint8 image with 0 and value pixels.
+
+    """
+    bits = np.unpackbits(packed, axis=1, count=cols)
+    if value != 1:
+        bits *= np.uint8(value)
+    return bits
+
+
+def to_words(packed):
+    """Converts packed rows to native 64-bit words, padding each row with zero bytes.
+
+    Args:
+        packed (np.ndarray): Packed rows as returned by pack_rows, it can be a np.memmap.
+
+    Returns:
+        np.ndarray: uint64 array of shape (rows, ceil(cols / 64)).
+
+    """
+    rows, row_bytes = packed.shape
+    if row_bytes % 8:
+        n_words = -(-row_bytes // 8)
+        padded = np.zeros((rows, n_words * 8), dtype=np.uint8)
+        padded[:, :row_bytes] = packed
+        packed = padded
+    # Whole words are viewed as big endian, astype makes the only copy
+    return np.ascontiguousarray(packed).view(">u8").astype(np.uint64)
+
+
+def from_words(words, row_bytes):
+    """Converts 64-bit words back to packed rows of row_bytes bytes."""
+    return words.astype(">u8").view(np.uint8)[:, :row_bytes].copy()
+
+
+def _padding_mask(cols, n_words):
+    """Mask with the bits of the last word that are beyond the last column."""
+    mask = np.zeros(n_words, dtype=np.uint64)
+    extra = n_words * _WORD_BITS - cols
+    if extra:
+        mask[-1] = (np.uint64(1) << np.uint64(extra)) - np.uint64(1)
+    return mask
+
+
+def _shift_columns(words, offset, fill):
+    """Returns words whose pixel x is the pixel x + offset of the input, fill outside."""
+    if offset == 0:
+        return words
+    rows, n_words = words.shape
+    q, r = divmod(abs(offset), _WORD_BITS)
+    pad = np.full((rows, q + 1), _ALL_ONES if fill else 0, dtype=np.uint64)
+    r = np.uint64(r)
+    back = np.uint64(_WORD_BITS) - r
+    if offset > 0:
+        ext = np.concatenate((words, pad), axis=1)
+        high = ext[:, q : q + n_words]
+        low = ext[:, q + 1 : q + 1 + n_words]
+        return (high << r) | (low >> back) if r else high.copy()
+    ext = np.concatenate((pad, words), axis=1)
+    high = ext[:, 1 : n_words + 1]
+    low = ext[:, :n_words]
+    return (high >> r) | (low << back) if r else high.copy()
+
+
+def _shift_rows(words, offset, fill):
+    """Returns words whose row y is the row y + offset of the input, fill outside."""
+    if offset == 0:
+        return words
+    shifted = np.full_like(words, _ALL_ONES if fill else 0)
+    if abs(offset) >= len(words):
+        return shifted
+    if offset > 0:
+        shifted[: len(words) - offset] = words[offset:]
+    else:
+        shifted[-offset:] = words[: len(words) + offset]
+    return shifted
+
+
+def pad_words(words, cols, border, fill):
+    """Adds a border of pixels around a word image.
+
+    Args:
+        words (np.ndarray): Words as returned by to_words.
+        cols (int): Number of columns of the image.
+        border (tuple): (top, bottom, left, right) pixels added on each side.
+        fill (bool): Value of the border pixels.
+
+    Returns:
+        tuple: Words of the image with the border and its number of columns.
+
+    """
+    top, bottom, left, right = border
+    rows, n_words = words.shape
+    padded_cols = cols + left + right
+    fill_word = _ALL_ONES if fill else 0
+    padded = np.full(
+        (rows + top + bottom, -(-padded_cols // _WORD_BITS)), fill_word, dtype=np.uint64
+    )
+    # Bits beyond the last column become the right border once shifted
+    edge = _padding_mask(cols, n_words)
+    row = (words | edge) if fill else (words & ~edge)
+    padded[top : top + rows, :n_words] = row
+    padded[top : top + rows] = _shift_columns(padded[top : top + rows], -left, fill)
+    return padded, padded_cols
+
+
+def crop_words(words, border, cols):
+    """Removes the border added by pad_words from a word image of cols columns."""
+    top, bottom, left, _ = border
+    rows = words.shape[0] - top - bottom
+    n_words = -(-cols // _WORD_BITS)
+    cropped = _shift_columns(words[top : top + rows], left, False)[:, :n_words]
+    return cropped & ~_padding_mask(cols, n_words)
+
+
+def _row_offsets(kernel, anchor):
+    """Groups the kernel offsets by row, each row is shifted once after its columns."""
+    offsets = {}
+    for dy, dx in sorted(kernel_offsets(kernel, anchor)):
+        offsets.setdefault(dy, []).append(dx)
+    return offsets
+
+
+def _morph_words(words, cols, offsets, iterations, *, erode):
+    padding = _padding_mask(cols, words.shape[1])
+    for _ in range(iterations):
+        # Pixels beyond the last column are outside the image
+        words = (words | padding) if erode else (words & ~padding)
+        result = None
+        for dy, dxs in offsets.items():
+            row = None
+            for dx in dxs:
+                shifted = _shift_columns(words, dx, erode)
+                if row is None:
+                    row = shifted
+                elif erode:
+                    row = row & shifted
+                else:
+                    row = row | shifted
+            row = _shift_rows(row, dy, erode)
+            if result is None:
+                result = row
+            elif erode:
+                result = result & row
+            else:
+                result = result | row
+        if result is None:
+            # An empty kernel leaves the image without neighbours
+            result = np.full_like(words, _ALL_ONES if erode else 0)
+        words = result
+    return words & ~padding
+
+
+def dilate_words(words, cols, kernel, iterations=1, anchor=None):
+    """Dilates a word image (to_words), as dilate does with packed rows."""
+    return _morph_words(words, cols, _row_offsets(kernel, anchor), iterations, erode=False)
+
+
+def erode_words(words, cols, kernel, iterations=1, anchor=None):
+    """Erodes a word image (to_words), as erode does with packed rows."""
+    return _morph_words(words, cols, _row_offsets(kernel, anchor), iterations, erode=True)
+
+
+def dilate(packed, cols, kernel, iterations=1, anchor=None):
+    """Dilates a packed binary image.
+
+    Args:
+        packed (np.ndarray): Packed rows as returned by pack_rows, it can be a np.memmap.
+        cols (int): Number of columns of the image.
+        kernel (np.ndarray): Structuring element, non zero cells are part of it.
+        iterations (int): Number of times the dilation is applied.
+        anchor (tuple): (x, y) anchor in the kernel as in OpenCV, the kernel center by default.
+
+    Returns:
+        np.ndarray: Packed rows of the dilated image.
+
+    """
+    words = dilate_words(to_words(packed), cols, kernel, iterations, anchor)
+    return from_words(words, packed.shape[1])
+
+
+def erode(packed, cols, kernel, iterations=1, anchor=None):
+    """Erodes a packed binary image.
+
+    Args:
+        packed (np.ndarray): Packed rows as returned by pack_rows, it can be a np.memmap.
+        cols (int): Number of columns of the image.
+        kernel (np.ndarray): Structuring element, non zero cells are part of it.
+        iterations (int): Number of times the erosion is applied.
+        anchor (tuple): (x, y) anchor in the kernel as in OpenCV, the kernel center by default.
+
+    Returns:
+        np.ndarray: Packed rows of the eroded image.
+
+    """
+    words = erode_words(to_words(packed), cols, kernel, iterations, anchor)
+    return from_words(words, packed.shape[1])
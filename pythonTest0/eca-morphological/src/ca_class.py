@@ -1,13 +1,12 @@
 """ECA class for elementary cellular automata."""
 
-import time
-
 import matplotlib.pyplot as plt
 import numpy as np
 from PIL import Image
 import logging
 
-logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+from fractal_dimension import box_counting_dimension
+from instrumentation import Instrumentation, timed
 
 
 class Eca:
@@ -69,8 +68,10 @@ class Eca:
         self.pixel_size = 1
         self.rdensity = 0.001
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.instrumentation = Instrumentation()
          # default color black
 
+    @timed("init")
     def define_evolution_config(
         self,
         size,
@@ -217,6 +218,7 @@ class Eca:
         p = np.concatenate(([array[-1]], array[:-1]))
         return self.dict_rules[self.rule_number](p, array, r)
 
+    @timed("evolution")
     def evolution(self, start_array=None):
         """Evolves the cellular automaton for a specified
         number of generations (defined by self.evolutions).
@@ -230,25 +232,44 @@ class Eca:
             list: List of np.ndarray representing the history of states.
 
         """
-        # Measure the initial time
-        initial_time = time.time()
+        # Create history list (matrix)
+        self.history = list(self.generate_rows(start_array))
+        self.instrumentation.count("generations", len(self.history))
+        self.instrumentation.count("cells", len(self.history) * len(self.history[0]))
+        return self.history
+
+    def generate_rows(self, start_array=None):
+        """Yields the states of the evolution one by one without keeping the history.
+
+        Args:
+            start_array (np.ndarray): Initial state array, the initial state by default.
+
+        Yields:
+            np.ndarray: Initial state followed by evolutions - 1 next states.
+
+        """
         # If start_array is None, use the initial state
         if start_array is None:
             start_array = self.init_state
-        # Create history list (matrix)
-        self.history = [start_array]
         # Create current array
         current_array = start_array
+        yield current_array
         # Iterate through the specified number of evolutions
-        for _ in range(self.evolutions -1 ):
+        for _ in range(self.evolutions - 1):
             current_array = self.next_evolution(current_array)
-            self.history.append(current_array)
-        # Measure the final time
-        final_time = time.time()
-        self.logger.debug(f"Evolution execution time: {final_time - initial_time:.6f} seconds")
-        
-        return self.history
+            yield current_array
+
+    def fractal_dimension(self):
+        """Estimates the box counting fractal dimension of the active cells in the history.
+
+        Returns:
+            float: Estimated fractal dimension, NaN when the history has no active cells
+            or is too short to fit one (box_counting_dimension).
+
+        """
+        return box_counting_dimension(np.array(self.history))
 
+    @timed("print")
     def print_history(self):
         """Prints the history of states in the cellular automaton."""
         if self.print_method == "pyplot":
@@ -267,15 +288,52 @@ class Eca:
         plt.title(f"Evolution of Rule {self.rule_number}")
         plt.show()
 
-    def _print_img(self,save_file=False):
-        file_name = f"CA_history_rule_{self.rule_number}.png"
-        image_data = np.array(self.history)
+    def history_array(self):
+        """Returns the history of states as an 8-bit grayscale image array.
+
+        Returns:
+            np.ndarray: uint8 array with active cells at 0 (cell_color_1 == 0) or 255.
+
+        """
+        return self.rows_array(self.history)
+
+    def rows_array(self, rows):
+        """Returns states as an 8-bit grayscale image array, as history_array does.
+
+        Args:
+            rows (list): States of the automaton.
+
+        Returns:
+            np.ndarray: uint8 array with one row per state.
+
+        """
+        image_data = np.array(rows)
         if self.cell_color_1 == 0:
             # Invert colors: 1 becomes black (0), 0 becomes white (255)
-            scaled_data = ((1 - image_data) * 255).astype(np.uint8)
-        else:
-            scaled_data = (image_data * 255).astype(np.uint8)
-        image = Image.fromarray(scaled_data, mode="L")
+            return ((1 - image_data) * 255).astype(np.uint8)
+        return (image_data * 255).astype(np.uint8)
+
+    def packed_history(self):
+        """Returns the history of states bit-packed row by row, as a 1-bit image.
+
+        Every row is padded to whole bytes with the first cell in the most significant bit,
+        white pixels are 1 as in PIL mode "1" images (active cells are black when
+        cell_color_1 == 0).
+
+        Returns:
+            np.ndarray: uint8 array of shape (evolutions, ceil(size / 8)).
+
+        """
+        packed = np.packbits(np.asarray(self.history, dtype=np.uint8), axis=1)
+        if self.cell_color_1 == 0:
+            np.invert(packed, out=packed)
+        return packed
+
+    def _print_img(self,save_file=False):
+        file_name = f"CA_history_rule_{self.rule_number}.png"
+        # 1-bit image straight from the packed history, PNGs are encoded at 1 bit per pixel
+        packed = self.packed_history()
+        image = Image.frombytes("1", (self.size, packed.shape[0]), packed.tobytes())
         
         self.logger.info(f"Image generated: {file_name}")
         if save_file:
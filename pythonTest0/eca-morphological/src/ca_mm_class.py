@@ -1,22 +1,93 @@
 """ECA_MM class for multi-modal morphological operations."""
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+
 import cv2 as cv
 import numpy as np
 
+import binary_morphology
+import numpy_morphology
+import structuring_elements
 from ca_class import Eca
+from config import MorphologySettings
+from instrumentation import timed
+from morphology_benchmark import fastest_backend, is_binary
+
+# Gray levels of uint8 images, pattern_spectrum stores larger sizes as uint16
+UINT8_LEVELS = 256
+
+
+@lru_cache(maxsize=64)
+def _plan(kernel_bytes, shape, iterations, backend):
+    """Decomposition of a kernel for a backend, memoized by the kernel bytes and shape."""
+    kernel = np.frombuffer(kernel_bytes, dtype=np.uint8).reshape(shape)
+    return structuring_elements.decompose(
+        kernel,
+        iterations,
+        MorphologySettings.PASS_COSTS[backend],
+        native_rectangles=backend == "opencv",
+    )
+
+
+def _pack_words(img):
+    """64-bit words (binary_morphology.to_words) of a binary image, non zero pixels are 1."""
+    return binary_morphology.to_words(binary_morphology.pack_rows(img))
+
+
+def _unpack_words(words, cols):
+    """0 / 255 image of a word image of cols columns."""
+    packed = binary_morphology.from_words(words, (cols + 7) // 8)
+    return binary_morphology.unpack_rows(packed, cols)
+
+
+def _derive_ops(img, ops, dilate, erode, subtract):
+    """Compute the operations on img from one dilate and one erode pass.
+
+    dilate, erode and subtract work on the representation of img, uint8 images or
+    packed words.
+    """
+    dilated = None
+    eroded = None
+    if {"dilation", "gradation", "blackhat"}.intersection(ops):
+        dilated = dilate(img)
+    if {"erosion", "gradation"}.intersection(ops):
+        eroded = erode(img)
+
+    results = {}
+    for op in ops:
+        if op == "dilation":
+            results[op] = dilated
+        elif op == "erosion":
+            results[op] = dilate(eroded)
+        elif op == "gradation":
+            results[op] = subtract(dilated, eroded)
+        else:
+            results[op] = subtract(erode(dilated), img)
+    return results
 
 
 class EcaMm(Eca):
     """ECA_MM extends ECA to provide morphological operations
     dilation, erosion, gradient, black hat)
-    on the cellular automaton evolution images using OpenCV.
+    on the cellular automaton evolution images using OpenCV, shifted NumPy arrays
+    or the bit-packed binary morphology backend.
     """
 
+    # File written by each operation when save_file is True
+    OPERATION_FILES = {
+        "dilation": "dilated_image.png",
+        "erosion": "eroded_image.png",
+        "gradation": "gradient_image.png",
+        "blackhat": "black_hat_image.png",
+    }
+
     def __init__(
         self,
         rule_number=22,
         kernel=np.array([[0, 1, 0], [1, 1, 1]], np.uint8),
         iterations=1,
+        backend="auto",
     ):
         """Initialize the ECA_MM class.
 
@@ -24,6 +95,7 @@ class EcaMm(Eca):
             rule_number (int): The rule number for the elementary cellular automaton.
             kernel (np.ndarray): The structuring element used for morphological operations.
             iterations (int): The number of iterations for morphological operations.
+            backend (str): Morphology backend, one of MorphologySettings.MORPHOLOGY_BACKENDS.
 
         """
         super().__init__(rule_number=rule_number)
@@ -31,6 +103,11 @@ class EcaMm(Eca):
         self.kernel = kernel
         self.image_file = ""
         self.iterations = iterations
+        self.backend = None
+        self.set_backend(backend)
+        self.image = None
+        self._image_binary = None
+        self.cache = None
 
     def set_kernel(self, kernel):
         """Set the structuring element for morphological operations.
@@ -50,42 +127,444 @@ class EcaMm(Eca):
         """
         self.iterations = iterations
 
-    def dilation(self):
-        """Apply morphological dilation to the image."""
-        dilated_filename = "dilated_image.png"
-        if self.image_file == "":
-            self.image_file = super()._print_img()
-        img = cv.imread(self.image_file, 0)
-        dilation = cv.dilate(img, self.kernel, iterations=self.iterations)
-        cv.imwrite(dilated_filename, dilation, [cv.IMWRITE_PNG_BILEVEL, 1])
-        return dilated_filename
-
-    def erosion(self):
-        """Apply morphological erosion to the image."""
-        eroded_filename = "eroded_image.png"
-        if self.image_file == "":
-            self.image_file = super()._print_img()
-        img = cv.imread(self.image_file, 0)
-        erosion = cv.morphologyEx(img, cv.MORPH_OPEN, self.kernel, iterations=self.iterations)
-        cv.imwrite(eroded_filename, erosion, [cv.IMWRITE_PNG_BILEVEL, 1])
-        return eroded_filename
-
-    def gradation(self):
-        """Apply morphological gradient to the image."""
-        gradient_filename = "gradient_image.png"
-        if self.image_file == "":
-            self.image_file = super()._print_img()
-        img = cv.imread(self.image_file, 0)
-        gradient = cv.morphologyEx(img, cv.MORPH_GRADIENT, self.kernel, iterations=self.iterations)
-        cv.imwrite(gradient_filename, gradient, [cv.IMWRITE_PNG_BILEVEL, 1])
-        return gradient_filename
-
-    def black_hat(self):
-        """Apply morphological black hat to the image."""
-        black_hat_filename = "black_hat_image.png"
-        if self.image_file == "":
-            self.image_file = super()._print_img()
-        img = cv.imread(self.image_file, 0)
-        black_hat = cv.morphologyEx(img, cv.MORPH_BLACKHAT, self.kernel, iterations=self.iterations)
-        cv.imwrite(black_hat_filename, black_hat, [cv.IMWRITE_PNG_BILEVEL, 1])
-        return black_hat_filename
+    def set_backend(self, backend):
+        """Set the backend used for dilation and erosion.
+
+        Args:
+            backend (str): "opencv" for cv.dilate / cv.erode, "numpy" for shifted NumPy
+                arrays (numpy_morphology), "packed" for the bit-packed binary morphology
+                (binary_morphology), which treats non zero pixels as 1, or "auto" for the
+                fastest one in the benchmark results (morphology_benchmark) for the image
+                shape and kernel, "packed" only for 0 / 255 images.
+
+        """
+        if backend not in MorphologySettings.MORPHOLOGY_BACKENDS:
+            raise ValueError(f"Unknown morphology backend: {backend}")
+        self.backend = backend
+
+    def set_image(self, img):
+        """Set an image to apply the morphological operations to instead of the history.
+
+        Args:
+            img (np.ndarray): uint8 grayscale image, None to use the history again.
+
+        """
+        self.image = img
+        self._image_binary = None
+
+    def set_cache(self, cache):
+        """Set the cache of morphology results.
+
+        Args:
+            cache (MorphologyCache): Shared result cache, None to disable caching.
+
+        """
+        self.cache = cache
+
+    def _backend_for(self, img, binary=None):
+        """Return the backend used for img, the fastest measured one for the "auto" backend.
+
+        It is decided once per call of the operations and passed to every pass. Whether
+        img is binary (for "packed") is given by the caller or checked once per image
+        set with set_image.
+        """
+        if self.backend != "auto":
+            return self.backend
+        if binary is None and img is self.image:
+            if self._image_binary is None:
+                self._image_binary = is_binary(img)
+            binary = self._image_binary
+        return fastest_backend(img, self.kernel, binary=binary)
+
+    def _dilate(self, img, iterations=None, backend=None):
+        """Dilate an image with the kernel and iterations using the selected backend."""
+        return self._morph(img, erode=False, iterations=iterations, backend=backend)
+
+    def _erode(self, img, iterations=None, backend=None):
+        """Erode an image with the kernel and iterations using the selected backend."""
+        return self._morph(img, erode=True, iterations=iterations, backend=backend)
+
+    def _morph(self, img, erode, iterations=None, backend=None):
+        """Run the passes of the kernel decomposition (structuring_elements.decompose)."""
+        if backend is None:
+            backend = self._backend_for(img)
+        if backend == "packed":
+            cols = img.shape[1]
+            words = self._morph_words(_pack_words(img), cols, erode, iterations)
+            return _unpack_words(words, cols)
+        kernel = np.asarray(self.kernel, dtype=np.uint8)
+        if iterations is None:
+            iterations = self.iterations
+        plan = _plan(kernel.tobytes(), kernel.shape, iterations, backend)
+        for step in plan:
+            if step["pad"] is None:
+                img = self._morph_factors(img, step["factors"], step["repeat"], erode, backend)
+                continue
+            # Padding with the neutral value makes the factors one pass with the kernel
+            top, bottom, left, right = step["pad"]
+            rows, cols = img.shape
+            for _ in range(step["repeat"]):
+                img = cv.copyMakeBorder(
+                    img, top, bottom, left, right, cv.BORDER_CONSTANT, value=255 if erode else 0
+                )
+                img = self._morph_factors(img, step["factors"], 1, erode, backend)
+                img = np.ascontiguousarray(img[top : top + rows, left : left + cols])
+        return img
+
+    def _morph_words(self, words, cols, erode, iterations=None):
+        """Run the passes of the kernel decomposition on 64-bit words (binary_morphology).
+
+        The words stay packed between the passes, including the padded steps.
+        """
+        kernel = np.asarray(self.kernel, dtype=np.uint8)
+        if iterations is None:
+            iterations = self.iterations
+        morph = binary_morphology.erode_words if erode else binary_morphology.dilate_words
+        for step in _plan(kernel.tobytes(), kernel.shape, iterations, "packed"):
+            if step["pad"] is None:
+                for element, anchor in step["factors"]:
+                    words = morph(words, cols, element, step["repeat"], anchor)
+                continue
+            for _ in range(step["repeat"]):
+                padded, padded_cols = binary_morphology.pad_words(words, cols, step["pad"], erode)
+                for element, anchor in step["factors"]:
+                    padded = morph(padded, padded_cols, element, 1, anchor)
+                words = binary_morphology.crop_words(padded, step["pad"], cols)
+        return words
+
+    def _morph_factors(self, img, factors, iterations, erode, backend):
+        """Dilate or erode with each (element, anchor) factor in turn using a backend."""
+        if backend == "numpy":
+            morph = numpy_morphology.erode if erode else numpy_morphology.dilate
+            for element, anchor in factors:
+                img = morph(img, element, iterations, anchor)
+            return img
+        morph = cv.erode if erode else cv.dilate
+        for element, anchor in factors:
+            img = morph(img, element, anchor=anchor, iterations=iterations)
+        return img
+
+    def source_image(self):
+        """Return the image the morphological operations are applied to.
+
+        The image set with set_image is used first, then the history and then the
+        image read from image_file.
+
+        Returns:
+            np.ndarray: uint8 grayscale image.
+
+        """
+        if self.image is not None:
+            return self.image
+        if self.history:
+            return self.history_array()
+        if self.image_file:
+            img = cv.imread(self.image_file, 0)
+            if img is None:
+                raise ValueError(f"Could not read image file: {self.image_file}")
+            return img
+        raise ValueError("There is no history or image file to apply the operation to")
+
+    def _save_result(self, result, file_name, save_file):
+        """Optionally write a result as a bilevel PNG and return it."""
+        if save_file:
+            cv.imwrite(file_name, result, [cv.IMWRITE_PNG_BILEVEL, 1])
+        return result
+
+    @timed("dilation")
+    def dilation(self, save_file=False):
+        """Apply morphological dilation to the image.
+
+        Args:
+            save_file (bool): Also write the result to dilated_image.png.
+
+        Returns:
+            np.ndarray: The dilated image.
+
+        """
+        dilation = self._cached_ops(self.source_image(), ["dilation"])["dilation"]
+        return self._save_result(dilation, self.OPERATION_FILES["dilation"], save_file)
+
+    @timed("erosion")
+    def erosion(self, save_file=False):
+        """Apply morphological erosion (opening: erode then dilate) to the image.
+
+        Args:
+            save_file (bool): Also write the result to eroded_image.png.
+
+        Returns:
+            np.ndarray: The eroded image.
+
+        """
+        erosion = self._cached_ops(self.source_image(), ["erosion"])["erosion"]
+        return self._save_result(erosion, self.OPERATION_FILES["erosion"], save_file)
+
+    @timed("gradation")
+    def gradation(self, save_file=False):
+        """Apply morphological gradient to the image.
+
+        Args:
+            save_file (bool): Also write the result to gradient_image.png.
+
+        Returns:
+            np.ndarray: The gradient image.
+
+        """
+        gradient = self._cached_ops(self.source_image(), ["gradation"])["gradation"]
+        return self._save_result(gradient, self.OPERATION_FILES["gradation"], save_file)
+
+    @timed("black_hat")
+    def black_hat(self, save_file=False):
+        """Apply morphological black hat to the image.
+
+        Args:
+            save_file (bool): Also write the result to black_hat_image.png.
+
+        Returns:
+            np.ndarray: The black hat image.
+
+        """
+        black_hat = self._cached_ops(self.source_image(), ["blackhat"])["blackhat"]
+        return self._save_result(black_hat, self.OPERATION_FILES["blackhat"], save_file)
+
+    @timed("apply_all")
+    def apply_all(self, ops=None, save_file=False):
+        """Apply several morphological operations sharing the dilate and erode passes.
+
+        The image is dilated and eroded once with the kernel and iterations, every
+        operation is derived from those passes with the same result as its own method:
+        erosion (opening) dilates the eroded image, gradation is dilated - eroded and
+        blackhat erodes the dilated image (closing) and subtracts the image.
+
+        Args:
+            ops (list): Operation names from OPERATION_FILES, all of them by default.
+            save_file (bool): Also write every result to its OPERATION_FILES file.
+
+        Returns:
+            dict: Result image of each requested operation.
+
+        """
+        ops = self._check_ops(ops)
+        results = self._cached_ops(self.source_image(), ops)
+        return {
+            op: self._save_result(results[op], self.OPERATION_FILES[op], save_file) for op in ops
+        }
+
+    @timed("apply_packed")
+    def apply_packed(self, packed, cols, ops=None):
+        """Apply several morphological operations to a bit-packed binary image.
+
+        The rows are converted to 64-bit words once and every pass of the packed backend
+        (binary_morphology) runs on the words, the image is never unpacked to uint8.
+
+        Args:
+            packed (np.ndarray): Packed rows (binary_morphology.pack_rows), it can be a
+                np.memmap.
+            cols (int): Number of columns of the image.
+            ops (list): Operation names from OPERATION_FILES, all of them by default.
+
+        Returns:
+            dict: Packed rows of the result of each requested operation.
+
+        """
+        ops = self._check_ops(ops)
+        return self._apply_packed_ops(np.asarray(packed), cols, ops)
+
+    def _apply_packed_ops(self, packed, cols, ops):
+        """Compute the operations on packed rows and return them as packed rows."""
+        results = self._apply_words(binary_morphology.to_words(packed), cols, ops)
+        return {op: binary_morphology.from_words(results[op], packed.shape[1]) for op in ops}
+
+    @timed("apply_tiled")
+    def apply_tiled(self, source, outputs, tile_rows=1024, workers=1, cols=None):
+        """Apply morphological operations to an image larger than memory, in row tiles.
+
+        Every tile is read with the halo of rows its results depend on above and below
+        (_halo_rows), so the result is the same as a whole image pass.
+
+        Args:
+            source (np.ndarray): uint8 image, usually a read only np.memmap.
+            outputs (dict): Output array (usually a np.memmap) of each operation, with the
+                shape of source.
+            tile_rows (int): Rows written per tile.
+            workers (int): Threads processing tiles, OpenCV and NumPy release the GIL.
+            cols (int): Number of columns when source and outputs are packed rows
+                (binary_morphology.pack_rows), which are processed as words with the
+                packed backend (apply_packed). None for uint8 images.
+
+        """
+        ops = self._check_ops(outputs)
+        rows = source.shape[0]
+        halo_above, halo_below = self._halo_rows(ops)
+
+        def process(start):
+            stop = min(start + tile_rows, rows)
+            low = max(0, start - halo_above)
+            high = min(rows, stop + halo_below)
+            tile = np.asarray(source[low:high])
+            if cols is None:
+                results = self._apply_ops(tile, ops)
+            else:
+                results = self._apply_packed_ops(tile, cols, ops)
+            for op in ops:
+                outputs[op][start:stop] = results[op][start - low : stop - low]
+
+        tiles = range(0, rows, tile_rows)
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(process, tiles))
+        else:
+            for start in tiles:
+                process(start)
+        for output in outputs.values():
+            if isinstance(output, np.memmap):
+                output.flush()
+
+    @timed("stream_morphology")
+    def stream_morphology(self, ops=None, start_array=None, block_rows=32):
+        """Evolve the automaton and yield the morphological operations as rows are generated.
+
+        Only the rows of the block being processed and its halo (_halo_rows) are kept, the
+        history is neither stored nor materialised. The rows are the same as apply_all on
+        the whole history image.
+
+        Args:
+            ops (list): Operation names from OPERATION_FILES, all of them by default.
+            start_array (np.ndarray): Initial state array, the initial state by default.
+            block_rows (int): Rows of each yielded block.
+
+        Yields:
+            dict: Block of result rows of each operation, blocks come in row order.
+
+        """
+        ops = self._check_ops(ops)
+        halo_above, halo_below = self._halo_rows(ops)
+        # window[0] is row first of the image, block starts at row start
+        window = []
+        first = 0
+        start = 0
+        for state in self.generate_rows(start_array):
+            window.append(state)
+            if first + len(window) < start + block_rows + halo_below:
+                continue
+            yield self._stream_block(window, first, (start, start + block_rows), halo_above, ops)
+            start += block_rows
+            drop = max(0, start - halo_above - first)
+            del window[:drop]
+            first += drop
+        end = first + len(window)
+        while start < end:
+            stop = min(start + block_rows, end)
+            yield self._stream_block(window, first, (start, stop), halo_above, ops)
+            start = stop
+
+    def _stream_block(self, window, first, rows, halo_above, ops):
+        """Compute the result rows (start, stop) from the window of states starting at row first."""
+        start, stop = rows
+        low = max(first, start - halo_above)
+        # States are 0 / 255 rows
+        results = self._apply_ops(self.rows_array(window[low - first :]), ops, binary=True)
+        return {op: results[op][start - low : stop - low] for op in ops}
+
+    def _halo_rows(self, ops):
+        """Return the rows above and below a result row that the operations depend on."""
+        anchor_y = np.asarray(self.kernel).shape[0] // 2
+        below = np.asarray(self.kernel).shape[0] - 1 - anchor_y
+        # Opening and closing chain two passes, dilation and gradient one
+        passes = 2 if {"erosion", "blackhat"}.intersection(ops) else 1
+        return passes * self.iterations * anchor_y, passes * self.iterations * below
+
+    @timed("pattern_spectrum")
+    def pattern_spectrum(self, max_size):
+        """Compute the pattern spectrum (granulometry) of the image.
+
+        The opening of size n is the opening with n iterations of the kernel, as erosion
+        computes with iterations = n. Each eroded image is the erosion of the previous
+        one. When the kernel contains its anchor the erosions are nested, so the level
+        of a pixel (the last size whose erosion keeps it) is dilated once per size as a
+        grayscale image and a pixel is in the opening of size n when that dilation is at
+        least n: max_size erosions and max_size dilations instead of O(max_size²).
+
+        Args:
+            max_size (int): Largest opening size.
+
+        Returns:
+            np.ndarray: spectrum[n] is the number of pixels in the opening of size n and not
+            in the opening of size n + 1 (size 0 is the image), for n in 0..max_size - 1.
+
+        """
+        img = self.source_image()
+        kernel = np.asarray(self.kernel, dtype=np.uint8)
+        anchor_y, anchor_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+        nested = bool(kernel[anchor_y, anchor_x])
+        backend = self._backend_for(img)
+
+        areas = np.zeros(max_size + 1, dtype=np.int64)
+        areas[0] = cv.countNonZero(img)
+        levels = np.zeros(img.shape, dtype=np.uint8 if max_size < UINT8_LEVELS else np.uint16)
+        eroded = img
+        last = 0
+        for size in range(1, max_size + 1):
+            eroded = self._erode(eroded, iterations=1, backend=backend)
+            if not eroded.any():
+                break
+            last = size
+            if nested:
+                levels[eroded > 0] = size
+            else:
+                areas[size] = cv.countNonZero(
+                    self._dilate(eroded, iterations=size, backend=backend)
+                )
+
+        if nested:
+            for size in range(1, last + 1):
+                levels = cv.dilate(levels, kernel)
+                areas[size] = np.count_nonzero(levels >= size)
+        return areas[:-1] - areas[1:]
+
+    def _check_ops(self, ops):
+        """Return the list of operations, all of them when ops is None."""
+        ops = list(self.OPERATION_FILES) if ops is None else list(ops)
+        unknown = [op for op in ops if op not in self.OPERATION_FILES]
+        if unknown:
+            raise ValueError(f"Unknown morphological operations: {unknown}")
+        return ops
+
+    def _cached_ops(self, img, ops):
+        """Compute the operations on img, taking the results in the cache from it."""
+        if self.cache is None:
+            return self._apply_ops(img, ops)
+        image_digest = self.cache.digest(img)
+        keys = {op: self.cache.key(image_digest, self.kernel, self.iterations, op) for op in ops}
+        results = {op: self.cache.get(keys[op]) for op in ops}
+        missing = [op for op in ops if results[op] is None]
+        if missing:
+            for op, result in self._apply_ops(img, missing).items():
+                results[op] = self.cache.put(keys[op], result)
+        return results
+
+    def _apply_ops(self, img, ops, binary=None):
+        """Compute the operations on img with the backend decided once for the call."""
+        backend = self._backend_for(img, binary)
+        if backend == "packed":
+            cols = img.shape[1]
+            words = self._apply_words(_pack_words(img), cols, ops)
+            return {op: _unpack_words(words[op], cols) for op in ops}
+        return _derive_ops(
+            img,
+            ops,
+            partial(self._dilate, backend=backend),
+            partial(self._erode, backend=backend),
+            cv.subtract,
+        )
+
+    def _apply_words(self, words, cols, ops):
+        """Compute the operations on a word image, every pass keeps the words packed."""
+        return _derive_ops(
+            words,
+            ops,
+            partial(self._morph_words, cols=cols, erode=False),
+            partial(self._morph_words, cols=cols, erode=True),
+            # Binary images: a - b keeps the pixels of a that are not in b
+            lambda a, b: a & ~b,
+        )
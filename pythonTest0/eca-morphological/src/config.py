@@ -1,3 +1,6 @@
+import os
+
+
 class AppSettings:
     """
     A class to hold static configuration variables for the application.
@@ -22,6 +25,68 @@ class AppSettings:
         "png"
     ]
 
+    # Worker processes of the web app (ECA_WORKERS, one per CPU by default), requests that
+    # may wait for a worker beyond the running ones and seconds before a request fails (504).
+    WORKER_PROCESSES = int(os.environ.get("ECA_WORKERS", "0")) or None
+    MAX_QUEUED_REQUESTS = 32
+    REQUEST_TIMEOUT = 60
+
+    # Admission control (admission.py): memory the running tasks may use together
+    # (ECA_MEMORY_BUDGET_MB) and address space limit of each worker process
+    # (ECA_WORKER_MEMORY_MB, none by default) so an allocation beyond it fails in the task
+    # instead of the kernel killing the worker.
+    MEMORY_BUDGET = int(os.environ.get("ECA_MEMORY_BUDGET_MB", "4096")) * 1024 * 1024
+    WORKER_MEMORY_LIMIT = int(os.environ.get("ECA_WORKER_MEMORY_MB", "0")) * 1024 * 1024 or None
+    # Cost model of the tasks: peak bytes per cell or pixel held and cell or pixel updates
+    # per second (morphology counts pixels x kernel cells x iterations x operations),
+    # measured with rule 30 and the built-in kernels.
+    TASK_BASE_MEMORY = 1024 * 1024
+    TASK_COSTS = {
+        "image": {"bytes_per_cell": 10, "work_per_second": 5e7},
+        "packed": {"bytes_per_cell": 0.3, "work_per_second": 2.5e8},
+        "tile": {"bytes_per_cell": 0.3, "work_per_second": 1e9},
+        "morphology": {"bytes_per_cell": 6, "work_per_second": 1.5e10},
+    }
+
+    # /generate_image result cache: in-memory limits, on-disk directory (None = memory
+    # only) and seconds browsers and proxies may reuse an image before revalidating it.
+    IMAGE_CACHE_MAX_ENTRIES = 256
+    IMAGE_CACHE_MAX_BYTES = 128 * 1024 * 1024
+    IMAGE_CACHE_DIR = None
+    IMAGE_MAX_AGE = 24 * 60 * 60
+
+    # Runs (/generate_image, /runs, /tiles, morphology by run ID): tile side in pixels, runs
+    # remembered, seconds a run is kept after its last use, and in-memory limits of their
+    # packed histories (larger tiled runs are refused).
+    TILE_SIZE = 256
+    MAX_RUNS = 1024
+    RUN_TTL = 60 * 60
+    HISTORY_CACHE_MAX_ENTRIES = 16
+    HISTORY_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+    # Streamed generations (/ws/generate_image): rows of the first block, and seconds
+    # and bytes the blocks grow to so later blocks amortize the per-block overhead.
+    STREAM_FIRST_BLOCK_ROWS = 16
+    STREAM_BLOCK_SECONDS = 0.05
+    STREAM_MAX_BLOCK_BYTES = 1024 * 1024
+
+    # 1-bit PNG encoding of evolution images (bilevel_png.py): zlib level, encoder ("auto"
+    # uses the fastest one measured by the benchmark), and image sizes timed by the
+    # benchmark and file of its results (relative paths are in the src directory).
+    PNG_COMPRESS_LEVEL = 6
+    PNG_ENCODERS = [
+        "pil",
+        "opencv",
+        "auto",
+    ]
+    PNG_ENCODER = "auto"
+    PNG_BENCHMARK_SIZES = [
+        (256, 256),
+        (1024, 1024),
+        (4096, 4096),
+    ]
+    PNG_BENCHMARK_FILE = "png_benchmark.json"
+
 class MorphologySettings:
     """
     A class to hold static configuration variables for the morphology application.
@@ -32,12 +97,26 @@ class MorphologySettings:
 
     KERNEL_SMALL = np.array([[0, 1, 0], [1, 1, 1]], np.uint8)
     KERNEL_LARGE = np.array([[0, 0, 1, 0, 0], [0, 1, 1, 1, 0], [1, 1, 1, 1, 1]], np.uint8)
+    KERNEL_HOLLOW = np.array(
+        [
+            [0, 0, 0, 1, 0, 0, 0],
+            [0, 0, 1, 1, 1, 0, 0],
+            [0, 1, 0, 0, 0, 1, 0],
+            [1, 1, 1, 0, 1, 1, 1],
+        ],
+        np.uint8,
+    )
 
     KERNEL_OPTIONS = {
         "small": KERNEL_SMALL,
         "large": KERNEL_LARGE,
+        "hollow": KERNEL_HOLLOW,
     }
 
+    # User kernels offered with KERNEL_OPTIONS: name -> rows of 0 and 1 or a string like
+    # "0,1,0;1,1,1" (see structuring_elements.parse_kernel).
+    CUSTOM_KERNELS = {}
+
     # Define the list of morphology operations as a static class variable.
     MORPHOLOGY_OPERATIONS = [
         "dilation",
@@ -46,3 +125,38 @@ class MorphologySettings:
         "blackhat",
     ]
 
+    # Backends that implement dilation and erosion for EcaMm, "auto" picks the fastest
+    # one from the benchmark results (morphology_benchmark.py).
+    MORPHOLOGY_BACKENDS = [
+        "opencv",
+        "packed",
+        "numpy",
+        "auto",
+    ]
+
+    # Image sizes timed by morphology_benchmark.py and file of its results (relative
+    # paths are in the src directory).
+    BENCHMARK_SIZES = [
+        (256, 256),
+        (1024, 1024),
+        (2048, 2048),
+        (4096, 4096),
+    ]
+    BENCHMARK_FILE = "morphology_benchmark.json"
+
+    # Maximum number of (operation, kernel, iterations) specs of a batch request.
+    BATCH_MAX_SPECS = 32
+
+    # Fixed cost of a dilate / erode pass over the image in kernel cells, per backend. It
+    # decides when a kernel is decomposed into smaller elements (structuring_elements).
+    PASS_COSTS = {
+        "opencv": 32,
+        "packed": 4,
+        "numpy": 2,
+    }
+
+    # Morphology result cache: in-memory limits and on-disk directory (None = memory only).
+    CACHE_MAX_ENTRIES = 128
+    CACHE_MAX_BYTES = 256 * 1024 * 1024
+    CACHE_DIR = None
+
@@ -1,9 +1,13 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
 from random import random
-from PIL import Image, ImageDraw
+from PIL import Image
+import cv2 as cv
 import numpy as np
 import logging
 
-logging.basicConfig(level=logging.DEBUG, format='%(name)s - %(levelname)s - %(message)s')
+from fractal_dimension import box_counting_dimension
+from instrumentation import Instrumentation, timed
 
 
 class FractalCountTriangle:
@@ -13,8 +17,10 @@ class FractalCountTriangle:
         image_path="",
         one_pixel_color=(255, 255, 255),
         zero_pixel_color=(0, 0, 0),
+        engine="lines",
     ):
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.instrumentation = Instrumentation()
         self.histogram_lines = {}
         self.image_path = image_path
         self.one_pixel_color = one_pixel_color
@@ -23,7 +29,9 @@ class FractalCountTriangle:
         self.line_value_search = False
         self.histogram_triangles = []
         self.histogram_colors = {}
+        self.engine = engine
 
+    @timed("read_image")
     def read_image(self):
         """Reads the image from the specified path and converts it to a binary format."""
         try:
@@ -35,90 +43,65 @@ class FractalCountTriangle:
             self.logger.error(f"Error reading image: {e}")
             return None
 
+    @timed("count_lines")
     def count_lines_for(self):
         # Get the dimensions of the binary image
         rows, cols = self.binary_image.shape
-        self.logger.debug(f"Image shape: {rows}x{cols}")
         list_lines = []
         for x in range(rows):
-        #for x in range(9,14):
             # Set the starting column index for the current row
             y = 0
             # Set the list of lines for the current row to an empty list
             list_lines = []
-            self.logger.debug(f"Processing row {x}")
             line_start = None
             line_end = None
             while y < cols:
                 # Get the value of the current pixel in the binary image
                 value = self.binary_image[x, y]
-                self.logger.debug(f" |Processing pixel at ({x}, {y}): {value}")
                 # Check if the current pixel value is different from the line value we are searching for
-
                 if value == self.line_value_search:
-
+                    # Found a pixel that matches the line value we are searching for, so we need to find the start and end of the line
                     line_start = y
                     line_end = y
-                    self.logger.debug(f"     || y value {y} {value}")
                     # Increment y to continue searching for the end of the line
                     y += 1
                     while y < cols and (line_end is not None) :
                         next_value = self.binary_image[x, y]
-                        self.logger.debug(f"     || yy value {y} {next_value}")
                         if next_value == self.line_value_search:
                             # If next pixel is the same as the line value, update the end of the line
                             line_end = y
                         else:
                             # 1. Check if is a single point
                             # If next pixel is different, we have found the end of the line or a single point
-                            if line_start == line_end:
-                                self.logger.debug(f"     ||Found a single point at ({x}, {y}, {next_value})")
-                            else:
-                            # 2, Check end of line on right side right pixel is different) 
-                                self.logger.debug(f"     ||Found a line from ({x}, {line_start}) to ({x}, {line_end})")
-                                self.logger.debug(f"     ||End line at {y} ")
+                            if line_start != line_end:
+                            # 2, Check end of line on right side right pixel is different)
                                 list_lines.append((line_start, line_end))
                             line_start = None
                             line_end = None
                         y += 1
                     if line_start is not None and line_end is cols - 1:
-                        self.logger.debug(f"     ||Found a line from ({x}, {line_start}) to ({x}, {line_end})")
-                        self.logger.debug(f"     ||End line at {y} ")
                         list_lines.append((line_start, line_end))
-                        
                     y += 1
                 y += 1
 
-                    
-                    # Found a pixel that matches the line value we are searching for, so we need to find the start and end of the line
-
             # Check end line conditions.
             if len(list_lines) > 0:
-                self.logger.debug(f"            ||| Checking for wrap-around lines in row {x}: {list_lines}")
-                first_line = list_lines[0] if list_lines else None
-                last_line = list_lines[-1] if list_lines else None
+                first_line = list_lines[0]
+                last_line = list_lines[-1]
                 if first_line[0] == 0 and last_line[1] == cols - 1:
-                    self.logger.debug(f"     ||Found a line that wraps around the row {x}: {first_line} to {last_line}")
                     # Merge the first and last lines into a single line
                     merged_line = (last_line[0], first_line[1])
                     list_lines = [merged_line] + list_lines[1:-1]
-                    self.logger.debug(f"     ||Merged line: {merged_line}")
                 elif  last_line[1] == cols - 1 and  self.binary_image[x, 0] == self.line_value_search:
-                    self.logger.debug(f"     ||Found a line that wraps around the row {x}: 0 to {last_line}")
                     merged_line = (last_line[0], 0)
                     list_lines = [merged_line] + list_lines[1:-1]
-                    self.logger.debug(f"     ||Merged line: {merged_line}")
-                #elif first_line[0] == 0 and  self.binary_image[x,  cols - 1] == self.line_value_search:
-                #    self.logger.debug(f"     ||Found a line that wraps around the row {x}: 0 to {last_line}")
-                #    merged_line = ( cols - 1 ,first_line[0])
-                #    list_lines = [merged_line] + list_lines[1:-1]
-                #    self.logger.debug(f"     ||Merged line: {merged_line}")
-                
-
-                    
+
             self.histogram_lines[x] = list_lines
-            self.logger.debug(f"List of lines found {x}: {list_lines}, value search {self.line_value_search}")
-        self.logger.info(f"Final histogram of lines by row: {self.histogram_lines}")
+        if self.instrumentation.enabled:
+            self.instrumentation.count("rows", rows)
+            total_lines = sum(len(self.histogram_lines[x]) for x in range(rows))
+            self.instrumentation.count("lines", total_lines)
+        self.logger.debug("Histogram of lines computed for %d rows", rows)
 
     def count_triangles(self):
         rows, cols = self.binary_image.shape
@@ -240,143 +223,423 @@ class FractalCountTriangle:
             # Process the cell at row_list, x
             x += 1
 
+    @timed("draw_lines")
     def draw_lines(self):
-        img_result = Image.open(self.image_path).convert("RGBA")
-        draw = ImageDraw.Draw(img_result)
-        rows, cols = self.binary_image.shape
-        for x in self.histogram_lines:
-            for line in self.histogram_lines[x]:
-                start_col, end_col = line
-
-                # if start_col < 0:
-                #     print("Error in start_col", start_col, ":", 49 + start_col)
-                #     start_col = 49 + start_col
-
-                #     draw.line([(0, x), (end_col, x)], fill="red", width=1)
-                #     draw.line([(start_col, x), (49, x)], fill="blue", width=1)
-                if start_col > end_col:
-                    #print("Line with border lines ", start_col, end_col)
-                    draw.line([(start_col, x), (cols-1, x)], fill="red", width=1)
-                    draw.line([(0, x), (end_col, x)], fill="red", width=1)
-                else:
-                    draw.line([(start_col, x), (end_col, x)], fill="red", width=1)
-                # Draw the line at the appropriate position
-        img_result.save("result_" + self.image_path)
+        """Draws the histogram of lines in red over the image and saves it as result_<image_path>.
+
+        Returns:
+            PIL.Image: The RGBA result image.
+        """
+        segments = [(x, line, 1) for x in self.histogram_lines for line in self.histogram_lines[x]]
+        img_result = self.render_overlay(segments, [(255, 0, 0, 255)])
+        if self.image_path:
+            img_result.save("result_" + self.image_path)
+        return img_result
 
+    @timed("count_triangles")
     def count_triangles_for(self):
         # Implement the logic to count lines based on the histogram of lines
         # Get the histogram of lines
         lines = self.histogram_lines.copy()
         # Get the dimensions of the binary image
         rows, cols = self.binary_image.shape
-        self.logger.debug(f"SHAPE")
         # Iterate through each row in the histogram of lines
-        for x in lines:
-            self.logger.debug(f"Processing line {x} ")
-            triangle_lines = []
-            list_lines = lines[x]
-            
-            for line in list_lines:
-                is_triangle = True
-                #
-                #triangle_lines.append(line)
+        records, _ = self.trace_triangles(lines, list(lines), rows, cols, rows)
+        triangles = self.collect_triangles(records)
+        self.histogram_triangles.extend(triangles)
+        self.instrumentation.count("triangles", len(triangles))
+        self.logger.info(f"Total triangles found: {len(self.histogram_triangles)}")
+
+    def trace_triangles(self, lines, start_rows, rows, cols, row_limit):
+        """
+        Follows every line of the given start rows down the image to check if it is the base
+        of a triangle.
+
+        Args:
+            lines (dict): Histogram of lines by row, consumed lines are removed from it.
+            start_rows (iterable): Rows whose lines are used as triangle bases.
+            rows (int): Number of rows of the whole image.
+            cols (int): Number of columns of the image.
+            row_limit (int): First row that can not be read, a triangle reaching it stays open.
+
+        Returns:
+            tuple: List of triangle records in scan order and the sublist of open records.
+        """
+        records = []
+        open_records = []
+        for x in start_rows:
+            for line in lines[x]:
                 # Determine the start and end columns of the line
-                start_line_y = line[0]
-                end_line_y = line[1]
+                start_line_y, end_line_y = line
                 if end_line_y > start_line_y:
                     base = end_line_y - start_line_y
                 else:
                     base = (cols - start_line_y) + end_line_y
-                
-                self.logger.info(f"Line found at row {x}, from column {start_line_y} to {end_line_y} with base {base}")
 
-
-                is_pair = True if base % 2 == 0 else False
                 # Calculate the height and area of the triangle based on whether the base is even or odd
-                if is_pair:
-                    # 
+                if base % 2 == 0:
                     height = base // 2
                     area = height * (height + 1)
                 else:
                     height = (base + 1) // 2
                     area = height * height
-                xx = 1
-                # For to check if the next lines in the subsequent rows form a triangle with the current line
-                self.logger.debug("+++++++++++++++++++++++++++")
-                for h in range(x , x+ height - 1):
-                    self.logger.info(f" h {h}")
-                    # Check follow up lines in the next rows to see if they form a triangle with the current line
-                    if start_line_y < end_line_y:
-                        next_start = (start_line_y + xx )  % cols
-                        next_end = (end_line_y - xx  )  % cols
-                    else:
-                        next_start = (start_line_y + xx )  % cols 
-                        next_end = (end_line_y - xx  )  % cols 
-                    self.logger.debug(f"    {h} , {xx} | current lines {start_line_y} {end_line_y} | {next_start} {next_end} ")
-
-                    next__line = (next_start, next_end)
-                    self.logger.info(f"Checking for triangle at row {h+1}, expected line: {next__line}")
-                    if h + 1 >= rows:
-                        self.logger.info(f"Reached the end of the image at row {h+1}, stopping triangle check.")
-                        if h - x >= 2 :
-                            is_triangle = True
-                        else:
-                            is_triangle = False
-                        break
-                    if next__line not in lines[h+1]  :
-                        is_triangle = False
-                        break
-                    else:
-                        print("NEXT LINE "+ str(next__line))
-                        triangle_lines.append(next__line)
-                        lines[h+1].remove(next__line)
-                    xx += 1
-                if is_triangle and len(triangle_lines) > 0:
-                    print("FIRST LINE"+ str(line))
-                    triangle_lines.insert(0,line)
-                    self.logger.info(f"Triangle found with base {base} and height {height} at row {x} and first line {triangle_lines[0]}")
-                    triangle =  { "base": base, "height": height, "lines": triangle_lines , "area": area, "row": x}
-                    self.histogram_triangles.append(triangle)
-                    triangle_lines = []
-                
+                record = {
+                    "row": x,
+                    "line": line,
+                    "base": base,
+                    "height": height,
+                    "area": area,
+                    "lines": [],
+                    "xx": 1,
+                    "is_triangle": None,
+                }
+                self.follow_triangle(lines, record, rows, cols, row_limit)
+                records.append(record)
+                if record["is_triangle"] is None:
+                    open_records.append(record)
+        return records, open_records
+
+    def follow_triangle(self, lines, record, rows, cols, row_limit):
+        """
+        Checks (or resumes checking) the lines below a triangle base.
+
+        Args:
+            lines (dict): Histogram of lines by row, consumed lines are removed from it.
+            record (dict): Triangle record created by trace_triangles, updated in place.
+            rows (int): Number of rows of the whole image.
+            cols (int): Number of columns of the image.
+            row_limit (int): First row that can not be read.
+
+        Description:
+            Every row below the base must contain the line shrunk by one pixel on each side.
+            "is_triangle" is left as None when the next row to check is beyond row_limit,
+            "xx" keeps the next offset so the check can be resumed with the following rows.
+        """
+        x = record["row"]
+        start_line_y, end_line_y = record["line"]
+        xx = record["xx"]
+        is_triangle = True
+        # For to check if the next lines in the subsequent rows form a triangle with the current line
+        for h in range(x + xx - 1, x + record["height"] - 1):
+            next_start = (start_line_y + xx) % cols
+            next_end = (end_line_y - xx) % cols
+            next__line = (next_start, next_end)
+            if h + 1 >= rows:
+                is_triangle = h - x >= 2
+                break
+            if h + 1 >= row_limit:
+                is_triangle = None
+                break
+            if next__line not in lines[h + 1]:
+                is_triangle = False
+                break
+            record["lines"].append(next__line)
+            lines[h + 1].remove(next__line)
+            xx += 1
+        record["xx"] = xx
+        record["is_triangle"] = is_triangle
+
+    def collect_triangles(self, records):
+        """
+        Builds the triangle histogram entries from the records of trace_triangles.
+
+        Lines matched by a failed record are kept and prepended to the next triangle found
+        on the same row, as the row by row scan always did.
+
+        Args:
+            records (list): Closed triangle records in scan order.
+
+        Returns:
+            list: Triangles as dictionaries with base, height, lines, area and row.
+        """
+        triangles = []
+        row = None
+        triangle_lines = []
+        for record in records:
+            if record["row"] != row:
+                row = record["row"]
+                triangle_lines = []
+            triangle_lines.extend(record["lines"])
+            if record["is_triangle"] and len(triangle_lines) > 0:
+                triangle_lines.insert(0, record["line"])
+                triangle = {
+                    "base": record["base"],
+                    "height": record["height"],
+                    "lines": triangle_lines,
+                    "area": record["area"],
+                    "row": row,
+                }
+                triangles.append(triangle)
+                triangle_lines = []
+        return triangles
+
+    @timed("count_parallel")
+    def count_parallel(self, workers=None, band_rows=None):
+        """
+        Counts lines and triangles splitting the image in horizontal bands processed
+        in a process pool. The result is the same as count_lines_for followed by
+        count_triangles_for.
+
+        Args:
+            workers (int): Number of processes, defaults to the number of CPUs.
+            band_rows (int): Rows per band, defaults to an even split between the workers.
+
+        Description:
+            1. Every band finds its lines and traces the triangles based on its own rows,
+               triangles that reach the end of the band are left open.
+            2. The merge goes through the bands in order, the open triangles of the previous
+               bands are resumed first against the whole histogram of lines.
+            3. If a resumed triangle consumed lines of the band, the band is traced again
+               from the current histogram, otherwise the band result is taken as it is.
+        """
+        rows, cols = self.binary_image.shape
+        workers = workers or os.cpu_count() or 1
+        if band_rows is None:
+            band_rows = max(1, -(-rows // workers))
+        bands = [(start, min(start + band_rows, rows)) for start in range(0, rows, band_rows)]
+        jobs = [
+            (self.binary_image[start:stop], start, rows, self.line_value_search)
+            for start, stop in bands
+        ]
+        self.logger.info(f"Counting {len(bands)} bands of {band_rows} rows with {workers} workers")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_count_band, jobs))
+
+        lines = {}
+        for band_lines, _, _, _ in results:
+            lines.update(band_lines)
+        if self.instrumentation.enabled:
+            self.instrumentation.count("rows", rows)
+            self.instrumentation.count("lines", sum(len(row_lines) for row_lines in lines.values()))
+        records = []
+        open_records = []
+        touched_rows = set()
+        for (start, stop), (_, band_after, band_records, band_open) in zip(bands, results):
+            # Resume the open triangles of the previous bands before this band starts
+            for record in open_records:
+                matched = len(record["lines"])
+                self.follow_triangle(lines, record, rows, cols, rows)
+                touched_rows.update(range(record["row"] + matched + 1, record["row"] + len(record["lines"]) + 1))
+            if touched_rows.intersection(range(start, stop)):
+                self.logger.debug(f"Band {start}-{stop} consumed by open triangles, tracing again")
+                band_records, band_open = self.trace_triangles(lines, range(start, stop), rows, cols, stop)
+            else:
+                for x in range(start, stop):
+                    lines[x] = band_after[x]
+            records.extend(band_records)
+            open_records = band_open
+
+        self.histogram_lines.update(lines)
+        triangles = self.collect_triangles(records)
+        self.histogram_triangles.extend(triangles)
+        self.instrumentation.count("triangles", len(triangles))
         self.logger.info(f"Total triangles found: {len(self.histogram_triangles)}")
 
-    def draw_triangles(self):
-        img_result = Image.open(self.image_path).convert("RGBA")
-        draw = ImageDraw.Draw(img_result)
+    def find_triangles(self):
+        """
+        Counts the triangles of the image with the selected engine.
+
+        "lines" runs count_lines_for and count_triangles_for, "components" runs
+        count_triangles_components.
+        """
+        if self.engine == "lines":
+            self.count_lines_for()
+            self.count_triangles_for()
+        elif self.engine == "components":
+            self.count_triangles_components()
+        else:
+            raise ValueError(f"Unknown triangle engine: {self.engine}")
+
+    @timed("count_components")
+    def count_triangles_components(self):
+        """
+        Counts the triangles labelling the line pixels with cv2.connectedComponentsWithStats.
+
+        Description:
+            1. The line pixels are labelled with 4-connectivity, components that touch the
+               left and right borders on the same row are merged (the image wraps around).
+            2. The base of a component is the width of its top row minus one, as the base of
+               a line in count_triangles_for, and gives the height and area of the triangle.
+               Triangles of height 1 are not counted, as in count_triangles_for.
+            3. A triangle of area A and height h has A + h pixels in h rows, plus one row with
+               a single pixel at the apex when the base is even. Components that match are
+               added to histogram_triangles in row and column order.
+        """
         rows, cols = self.binary_image.shape
+        mask = (self.binary_image == self.line_value_search).astype(np.uint8)
+        count, labels, stats, _ = cv.connectedComponentsWithStats(mask, connectivity=4)
+        top = stats[:, cv.CC_STAT_TOP].copy()
+        bottom = top + stats[:, cv.CC_STAT_HEIGHT] - 1
+        left = stats[:, cv.CC_STAT_LEFT].copy()
+        pixels = stats[:, cv.CC_STAT_AREA].copy()
+
+        # Merge the components that wrap around the right border
+        root = np.arange(count)
+        wrapped = np.zeros(count, dtype=bool)
+        border = (labels[:, 0] > 0) & (labels[:, -1] > 0) & (labels[:, 0] != labels[:, -1])
+        for first, last in set(zip(labels[border, 0].tolist(), labels[border, -1].tolist())):
+            while root[first] != first:
+                first = root[first]
+            while root[last] != last:
+                last = root[last]
+            if first != last:
+                first, last = min(first, last), max(first, last)
+                root[last] = first
+                wrapped[first] = True
+                pixels[first] += pixels[last]
+                top[first] = min(top[first], top[last])
+                bottom[first] = max(bottom[first], bottom[last])
+                pixels[last] = 0
+        if wrapped.any():
+            while not np.array_equal(root, root[root]):
+                root = root[root]
+            labels = root[labels]
+
+        # Width of the top row of every component
+        row_index = np.arange(rows)[:, np.newaxis]
+        top_row = (labels > 0) & (row_index == top[labels])
+        width = np.bincount(labels[top_row], minlength=count)
+
+        base = width - 1
+        even = base % 2 == 0
+        height = np.where(even, base // 2, (base + 1) // 2)
+        area = np.where(even, height * (height + 1), height * height)
+        span = bottom - top + 1
+        is_triangle = (height > 1) & (
+            ((pixels == area + height) & (span == height))
+            | (even & (pixels == area + height + 1) & (span == height + 1))
+        )
+        is_triangle[0] = False
+
+        triangles = []
+        for label in np.flatnonzero(is_triangle):
+            x = int(top[label])
+            if wrapped[label]:
+                columns = np.flatnonzero(labels[x] == label)
+                gap = np.flatnonzero(np.diff(columns) > 1)
+                start = int(columns[gap[0] + 1]) if len(gap) else int(columns[0])
+            else:
+                start = int(left[label])
+            end = (start + int(base[label])) % cols
+            h = int(height[label])
+            triangle = {
+                "base": int(base[label]),
+                "height": h,
+                "lines": [((start + i) % cols, (end - i) % cols) for i in range(h)],
+                "area": int(area[label]),
+                "row": x,
+            }
+            triangles.append(triangle)
+        triangles.sort(key=lambda triangle: (triangle["row"], triangle["lines"][0][0]))
+        self.histogram_triangles.extend(triangles)
+        self.instrumentation.count("triangles", len(triangles))
+        self.logger.info(f"Total triangles found: {len(self.histogram_triangles)}")
+
+    def fractal_dimension(self):
+        """
+        Estimates the box counting fractal dimension of the image.
+
+        Returns:
+            float: Estimated fractal dimension of the pixels that are not line pixels, NaN
+            when there are none or the image is too small (box_counting_dimension).
+        """
+        return box_counting_dimension(self.binary_image != self.line_value_search)
+
+    def area_histogram(self):
+        """
+        Counts the triangles found by area.
+
+        Returns:
+            dict: Number of triangles for each area, sorted by area.
+        """
+        areas, counts = np.unique([triangle["area"] for triangle in self.histogram_triangles], return_counts=True)
+        return {int(area): int(count) for area, count in zip(areas, counts)}
+
+    @timed("draw_triangles")
+    def draw_triangles(self):
+        """
+        Draws every triangle over the image with one color per area (histogram_colors)
+        and saves it as result_triangle_<image_path>.
+
+        Returns:
+            PIL.Image: The RGBA result image.
+        """
+        palette = []
+        area_labels = {}
+        segments = []
         for triangle in self.histogram_triangles:
-            self.logger.info(f"Triangle details: {triangle}")
             area = str(triangle["area"])
-            if area in self.histogram_colors:
-                color = self.histogram_colors[area]
-            else:
+            if area not in self.histogram_colors:
                 r = int(random() * 256)
                 g = int(random() * 256)
                 b = int(random() * 256)
-                color = (r,g,b)
-                self.histogram_colors[area]= color
-
-            x = triangle["row"]
-            lines = triangle["lines"]
-            
-            for line in lines:
-                start_col, end_col = line
-
-                # if start_col < 0:
-                #     print("Error in start_col", start_col, ":", 49 + start_col)
-                #     start_col = 49 + start_col
-
-                #     draw.line([(0, x), (end_col, x)], fill="red", width=1)
-                #     draw.line([(start_col, x), (49, x)], fill="blue", width=1)
-                if start_col > end_col:
-                    #print("Line with border lines ", start_col, end_col)
-                    draw.line([(start_col, x), (cols-1, x)], fill=color, width=1)
-                    draw.line([(0, x), (end_col, x)], fill=color, width=1)
-                else:
-                    draw.line([(start_col, x), (end_col, x)], fill=color, width=1)
-                # Draw the line at the appropriate position
-                x = x + 1
-        img_result.save("result_triangle_" + self.image_path)
-    
+                self.histogram_colors[area] = (r, g, b)
+            if area not in area_labels:
+                palette.append((*self.histogram_colors[area], 255))
+                area_labels[area] = len(palette)
+            # Every line of the triangle goes one row below the previous one
+            segments.extend(
+                (triangle["row"] + i, line, area_labels[area]) for i, line in enumerate(triangle["lines"])
+            )
+        img_result = self.render_overlay(segments, palette)
+        if self.image_path:
+            img_result.save("result_triangle_" + self.image_path)
+        return img_result
+
+    def render_overlay(self, segments, palette):
+        """
+        Renders horizontal line segments over the image in memory.
+
+        Args:
+            segments (list): Tuples (row, (start_col, end_col), label), a segment with
+                start_col > end_col wraps around the right border. Labels start at 1.
+            palette (list): RGBA color of each label, palette[0] is the color of label 1.
 
+        Returns:
+            PIL.Image: The RGBA image with the segments composited over it.
+
+        Description:
+            1. The segments are expanded to pixel coordinates with numpy repeat and
+               written to a label array with a single fancy indexing assignment.
+            2. The labels are mapped to colors through the palette and composited over
+               the image once.
+        """
+        rows, cols = self.binary_image.shape
+        label = np.zeros((rows, cols), dtype=np.intp)
+        if segments:
+            segment_array = np.array([(x, start, end, value) for x, (start, end), value in segments], dtype=np.intp)
+            segment_array = segment_array[segment_array[:, 0] < rows]
+            x, start, end, value = segment_array.T
+            lengths = (end - start) % cols + 1
+            offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            label[np.repeat(x, lengths), (np.repeat(start, lengths) + offsets) % cols] = np.repeat(value, lengths)
+
+        colors = np.array([(0, 0, 0, 0), *palette], dtype=np.uint8)
+        img_result = np.array(Image.fromarray(self.binary_image).convert("RGBA"))
+        mask = label > 0
+        img_result[mask] = colors[label[mask]]
+        return Image.fromarray(img_result)
+
+
+def _count_band(job):
+    """
+    Process pool worker of FractalCountTriangle.count_parallel.
+
+    Args:
+        job (tuple): Band pixels, first row of the band, rows of the image and line value search.
+
+    Returns:
+        tuple: Lines of the band before and after tracing, triangle records and open records.
+    """
+    pixels, offset, rows, line_value_search = job
+    counter = FractalCountTriangle()
+    counter.binary_image = pixels
+    counter.line_value_search = line_value_search
+    counter.count_lines_for()
+    band_lines = {offset + x: lines for x, lines in counter.histogram_lines.items()}
+    original_lines = {x: list(lines) for x, lines in band_lines.items()}
+    stop = offset + len(pixels)
+    records, open_records = counter.trace_triangles(
+        band_lines, range(offset, stop), rows, pixels.shape[1], stop
+    )
+    return original_lines, band_lines, records, open_records
@@ -0,0 +1,68 @@
+"""Box counting fractal dimension for ECA histories and images."""
+
+import numpy as np
+
+# Box counting works on 2D images
+MASK_DIMENSIONS = 2
+# Fewest box sizes a line can be fitted to
+MIN_FIT_SIZES = 2
+
+
+def box_counts(mask):
+    """Counts the occupied boxes of a binary image for box sizes 1, 2, 4, ...
+
+    Every level halves the resolution of the previous one: the image is padded to even
+    dimensions, reshaped into 2x2 blocks and reduced with any(), so each level is O(pixels)
+    and the whole pyramid costs less than two passes over the image.
+
+    Args:
+        mask (np.ndarray): 2D array, non zero values are the cells of the set.
+
+    Returns:
+        tuple: Array of box sizes and array with the number of occupied boxes of each size.
+
+    """
+    level = np.asarray(mask, dtype=bool)
+    if level.ndim != MASK_DIMENSIONS:
+        raise ValueError("mask must be a 2D array")
+    sizes = []
+    counts = []
+    size = 1
+    while True:
+        sizes.append(size)
+        counts.append(np.count_nonzero(level))
+        rows, cols = level.shape
+        if rows <= 1 and cols <= 1:
+            break
+        level = np.pad(level, ((0, rows % 2), (0, cols % 2)))
+        level = level.reshape(level.shape[0] // 2, 2, level.shape[1] // 2, 2).any(axis=(1, 3))
+        size *= 2
+    return np.array(sizes), np.array(counts)
+
+
+def box_counting_dimension(mask):
+    """Estimates the fractal dimension of a binary image with box counting.
+
+    The dimension is the slope of the log-log fit of the occupied boxes against the
+    inverse of the box size. Box sizes that reach the smallest side of the image are
+    left out of the fit, a single box covering the whole image says nothing about the set.
+
+    Images without cells, or too small for two box sizes (e.g. a one generation history),
+    have no estimate: NaN is returned so batch runs go on, check it with np.isnan.
+
+    Args:
+        mask (np.ndarray): 2D array, non zero values are the cells of the set.
+
+    Returns:
+        float: Estimated fractal dimension, NaN when it cannot be estimated.
+
+    Raises:
+        ValueError: When mask is not a 2D array.
+
+    """
+    sizes, counts = box_counts(mask)
+    fit = sizes < min(np.shape(mask))
+    if counts[0] == 0 or np.count_nonzero(fit) < MIN_FIT_SIZES:
+        return float("nan")
+    slope, _ = np.polyfit(np.log(1 / sizes[fit]), np.log(counts[fit]), 1)
+    return float(slope)
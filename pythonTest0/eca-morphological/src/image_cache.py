@@ -0,0 +1,61 @@
+"""Cache of the encoded evolution images served by the web app."""
+
+import hashlib
+import json
+
+from morphology_cache import MorphologyCache
+
+# SimulationParams fields that determine the image, density and seed only matter for
+# the random initial state and pixel_size only for exported PNGs
+_IMAGE_FIELDS = ("rule", "cell_space", "num_evolutions", "init_method", "print_method")
+
+
+class ImageCache(MorphologyCache):
+    """Bounded in-memory LRU of encoded images (bytes) with an optional on-disk tier.
+
+    Images are keyed by the simulation parameters and the response format, so the key
+    is known before the evolution runs and doubles as the ETag of the response.
+    """
+
+    suffix = ".bin"
+
+    @staticmethod
+    def key(params, format="png"):
+        """Return the cache key of an image.
+
+        Args:
+            params (dict): SimulationParams fields.
+            format (str): Response format, "png" or "packed".
+
+        Returns:
+            str: Hex digest identifying the image, None when the image is not reproducible
+            (random initial state without a seed).
+
+        """
+        fields = {name: str(params[name]) for name in _IMAGE_FIELDS}
+        if params["init_method"] == "random":
+            if params.get("seed") is None:
+                return None
+            fields["density"] = float(params["density"])
+            fields["seed"] = int(params["seed"])
+        if format == "png" and params.get("export"):
+            fields["pixel_size"] = int(params["pixel_size"])
+        fields["format"] = format
+        encoded = json.dumps(fields, sort_keys=True).encode()
+        return hashlib.blake2b(encoded, digest_size=20).hexdigest()
+
+    @staticmethod
+    def _freeze(result):
+        return bytes(result)
+
+    @staticmethod
+    def _size(result):
+        return len(result)
+
+    @staticmethod
+    def _write(file, result):
+        file.write(result)
+
+    @staticmethod
+    def _read(file):
+        return file.read()
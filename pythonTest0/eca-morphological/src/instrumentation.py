@@ -0,0 +1,129 @@
+"""Per-stage timers and counters for the ECA, morphology and triangle counting classes.
+
+Instrumentation is enabled with the environment variable ECA_INSTRUMENTATION=1 and is read
+once at import. When it is disabled the timed decorator returns the method untouched and
+stage() returns a shared null context, so the instrumented code runs as if it was not there.
+An Instrumentation created with enabled=True records regardless of the variable, the web
+app workers time the stages of their tasks that way.
+"""
+
+import functools
+import os
+import time
+from contextlib import nullcontext
+
+ENABLED = os.environ.get("ECA_INSTRUMENTATION", "0").lower() not in ("", "0", "false", "no")
+
+_NULL_STAGE = nullcontext()
+
+
+class Instrumentation:
+    """Accumulates the time spent in each stage and the counters of one object."""
+
+    def __init__(self, enabled=None):
+        """Initialize the timers and counters.
+
+        Args:
+            enabled (bool): Whether stages and counters are recorded, ENABLED by default.
+
+        """
+        self.enabled = ENABLED if enabled is None else enabled
+        self.timers = {}
+        self.counters = {}
+
+    def stage(self, name):
+        """Context manager that adds the elapsed time of the block to the stage timer.
+
+        Args:
+            name (str): Name of the stage.
+
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def add_time(self, name, seconds):
+        """Adds one call of the given duration to a stage timer.
+
+        Args:
+            name (str): Name of the stage.
+            seconds (float): Elapsed time of the call.
+
+        """
+        calls, total = self.timers.get(name, (0, 0.0))
+        self.timers[name] = (calls + 1, total + seconds)
+
+    def count(self, name, value=1):
+        """Increments a counter, call it once per stage and never from an inner loop.
+
+        Args:
+            name (str): Name of the counter.
+            value (int): Amount to add.
+
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        """Returns the timers and counters collected so far.
+
+        Returns:
+            dict: {"timers": {stage: {"calls": int, "seconds": float}}, "counters": {name: int}}
+
+        """
+        return {
+            "timers": {
+                name: {"calls": calls, "seconds": total}
+                for name, (calls, total) in self.timers.items()
+            },
+            "counters": dict(self.counters),
+        }
+
+    def reset(self):
+        """Clears all timers and counters."""
+        self.timers.clear()
+        self.counters.clear()
+
+
+class _Stage:
+    """Context manager returned by Instrumentation.stage when instrumentation is enabled."""
+
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def timed(stage):
+    """Decorator that times a method in the stage of its object's instrumentation.
+
+    The object must have an ``instrumentation`` attribute. When instrumentation is
+    disabled the method is returned as it is.
+
+    Args:
+        stage (str): Name of the stage.
+
+    """
+
+    def decorator(method):
+        if not ENABLED:
+            return method
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.instrumentation.stage(stage):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
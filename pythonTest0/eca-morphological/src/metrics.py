@@ -0,0 +1,100 @@
+"""Latency histograms and counters of the web app, in the Prometheus text format.
+
+The stage timings come from the worker tasks (web_tasks.timed_call), the web app adds
+them to the stage histogram and to the Server-Timing header of the response.
+"""
+
+import bisect
+import threading
+
+# Latency buckets in seconds and size buckets in bytes (1 KiB to 256 MiB)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(1024 * 4**power for power in range(10))
+
+
+def server_timing(timings):
+    """Return a Server-Timing header value from seconds by stage name."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+def _format_labels(names, values, extra=""):
+    labels = [f'{name}="{value}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Histogram:
+    """Cumulative histogram of observations, one per combination of label values."""
+
+    def __init__(self, name, help, buckets, labels=()):
+        """Initialize the histogram.
+
+        Args:
+            name (str): Metric name.
+            help (str): Description of the metric.
+            buckets (tuple): Increasing upper bounds, +Inf is added.
+            labels (tuple): Label names.
+
+        """
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """Add one observation with the label values, in the order of the label names."""
+        with self._lock:
+            counts, total = self._series.get(label_values, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[label_values] = (counts, total + value)
+
+    def render(self):
+        """Return the lines of the metric in the text format."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for values, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts, strict=True):
+                cumulative += count
+                labels = _format_labels(self.labels, values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Values read when the metrics are rendered, from a function of no arguments.
+
+    The function returns {label values: value}, or a number when there are no labels.
+    Counters read from other objects are gauges with the type "counter".
+    """
+
+    def __init__(self, name, help, read, labels=(), type="gauge"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labels = tuple(labels)
+        self.type = type
+
+    def render(self):
+        """Return the lines of the metric in the text format."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+def render(metrics):
+    """Return the metrics in the Prometheus text format."""
+    return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
@@ -0,0 +1,177 @@
+"""Benchmark of the EcaMm morphology backends and selection of the fastest one.
+
+Run it as a script to time every operation with every backend for each image size of
+MorphologySettings.BENCHMARK_SIZES and each kernel of MorphologySettings.KERNEL_OPTIONS,
+on rule 30 histories. OpenCV morphologyEx is timed as a reference. The results are
+written to MorphologySettings.BENCHMARK_FILE, which the "auto" backend of EcaMm reads
+to pick the fastest backend for an image shape and kernel:
+
+    python3 src/morphology_benchmark.py
+"""
+
+import logging
+from functools import lru_cache, partial
+
+import cv2 as cv
+import numpy as np
+
+import benchmark_results
+from config import MorphologySettings
+
+logger = logging.getLogger(__name__)
+
+# Value of the white pixels of binary images
+WHITE = 255
+
+# OpenCV operation equivalent to each EcaMm operation
+MORPHOLOGY_EX = {
+    "dilation": cv.MORPH_DILATE,
+    "erosion": cv.MORPH_OPEN,
+    "gradation": cv.MORPH_GRADIENT,
+    "blackhat": cv.MORPH_BLACKHAT,
+}
+
+
+def benchmark_file():
+    """Return the path of the benchmark results, relative paths are in the src directory."""
+    return benchmark_results.results_file(MorphologySettings.BENCHMARK_FILE)
+
+
+def _history(rows, cols, seed=30):
+    """Rule 30 history from a random state, as a 0 / 255 image."""
+    eca = benchmark_results.rule_30_history(rows, cols, seed)
+    eca.cell_color_1 = 1
+    return eca.history_array()
+
+
+def run_benchmark(sizes=None, kernels=None, backends=None, repeats=3):
+    """Time the EcaMm operations with every backend.
+
+    Args:
+        sizes (list): (rows, cols) image sizes, MorphologySettings.BENCHMARK_SIZES by default.
+        kernels (dict): Kernels by name, MorphologySettings.KERNEL_OPTIONS by default.
+        backends (list): Backends to time, every backend except "auto" by default.
+        repeats (int): Runs of each measure, the best time is kept.
+
+    Returns:
+        list: Records with rows, cols, kernel name, kernel cells, operation, backend and
+        seconds. The backend "morphologyEx" is the OpenCV reference.
+
+    """
+    # ca_mm_class imports fastest_backend from this module when it is loaded, a module
+    # level import would load it before fastest_backend is defined
+    from ca_mm_class import EcaMm  # noqa: PLC0415
+
+    sizes = sizes or MorphologySettings.BENCHMARK_SIZES
+    kernels = kernels or MorphologySettings.KERNEL_OPTIONS
+    backends = backends or [b for b in MorphologySettings.MORPHOLOGY_BACKENDS if b != "auto"]
+    records = []
+    for rows, cols in sizes:
+        image = _history(rows, cols)
+        for name, cells in kernels.items():
+            kernel = np.asarray(cells, dtype=np.uint8)
+            for op in MorphologySettings.MORPHOLOGY_OPERATIONS:
+                seconds, expected = benchmark_results.best_time(
+                    partial(cv.morphologyEx, image, MORPHOLOGY_EX[op], kernel), repeats
+                )
+                timings = {"morphologyEx": seconds}
+                for backend in backends:
+                    eca = EcaMm(kernel=kernel, backend=backend)
+                    eca.set_image(image)
+                    seconds, result = benchmark_results.best_time(
+                        lambda eca=eca, op=op: eca.apply_all([op])[op], repeats
+                    )
+                    if not np.array_equal(result, expected):
+                        raise RuntimeError(f"{backend} {op} with {name} differs from OpenCV")
+                    timings[backend] = seconds
+                for backend, seconds in timings.items():
+                    records.append(
+                        {
+                            "rows": rows,
+                            "cols": cols,
+                            "kernel": name,
+                            "kernel_cells": kernel.tolist(),
+                            "operation": op,
+                            "backend": backend,
+                            "seconds": seconds,
+                        }
+                    )
+                logger.info(
+                    f"{rows}x{cols} {name} {op}: "
+                    + ", ".join(f"{b} {s * 1000:.2f} ms" for b, s in timings.items())
+                )
+    return records
+
+
+def save_results(records, path=None):
+    """Write benchmark records as JSON and forget the table loaded from the previous file."""
+    benchmark_results.save_records(records, path or benchmark_file())
+    load_table.cache_clear()
+
+
+@lru_cache(maxsize=4)
+def load_table(path=None):
+    """Load the benchmark as total seconds of the operations per (rows, cols, kernel, backend).
+
+    Returns:
+        dict: {(rows, cols, kernel cells as a tuple of tuples): {backend: seconds}}, empty
+        when there is no benchmark file.
+
+    """
+    table = {}
+    for record in benchmark_results.load_records(path or benchmark_file()):
+        if record["backend"] not in MorphologySettings.MORPHOLOGY_BACKENDS:
+            continue
+        key = (record["rows"], record["cols"], tuple(map(tuple, record["kernel_cells"])))
+        timings = table.setdefault(key, {})
+        timings[record["backend"]] = timings.get(record["backend"], 0.0) + record["seconds"]
+    return table
+
+
+def is_binary(image):
+    """Return whether an image only has 0 and 255 pixels, as the packed backend needs."""
+    return not np.any((image != 0) & (image != WHITE))
+
+
+def fastest_backend(image, kernel, default="opencv", binary=None):
+    """Return the fastest measured backend for an image and kernel.
+
+    The measure of the same kernel (or else of the kernel with the closest number of cells)
+    at the closest number of pixels is used. "packed" is only used for 0 / 255 images.
+
+    Args:
+        image (np.ndarray): Image to process.
+        kernel (np.ndarray): Structuring element.
+        default (str): Backend when there is no benchmark.
+        binary (bool): Whether the image only has 0 and 255 pixels, when the caller knows
+            it. None to scan the image (is_binary) if "packed" is the fastest backend.
+
+    Returns:
+        str: Backend name.
+
+    """
+    table = load_table()
+    if not table:
+        return default
+    cells = tuple(map(tuple, np.asarray(kernel, dtype=np.uint8).tolist()))
+    kernel_cells = np.count_nonzero(kernel)
+    pixels = max(image.size, 1)
+
+    def distance(key):
+        rows, cols, measured = key
+        kernel_distance = abs(np.count_nonzero(measured) - kernel_cells)
+        return (measured != cells, kernel_distance, abs(np.log(rows * cols / pixels)))
+
+    timings = table[min(table, key=distance)]
+    for backend in sorted(timings, key=timings.get):
+        if backend != "packed":
+            return backend
+        if binary is None:
+            binary = is_binary(image)
+        if binary:
+            return backend
+    return default
+
+
+if __name__ == "__main__":
+    benchmark_results.run_script(run_benchmark, save_results, benchmark_file())
@@ -0,0 +1,172 @@
+"""Content-addressed cache of morphological operation results."""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class MorphologyCache:
+    """Bounded in-memory LRU of morphology results with an optional on-disk tier.
+
+    Results are keyed by a hash of the input bitmap, the kernel, the iterations and the
+    operation, so the same history processed again with the same settings is a lookup
+    whatever the rule or parameters that produced it. Cached arrays are read only.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=256 * 1024 * 1024, cache_dir=None):
+        """Initialize the cache.
+
+        Args:
+            max_entries (int): Maximum number of results kept in memory.
+            max_bytes (int): Maximum size in bytes of the results kept in memory.
+            cache_dir (str): Directory for the on-disk tier, None to keep results only in memory.
+
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def digest(img):
+        """Return the hex digest of an input image.
+
+        The image is hashed once and every operation key is built from its digest
+        (key), so a batch of operations on the same image reads the bitmap once.
+
+        Args:
+            img (np.ndarray): Input image.
+
+        Returns:
+            str: Hex digest of the shape, dtype and pixels of the image.
+
+        """
+        img = np.ascontiguousarray(img)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{img.shape}{img.dtype}|".encode())
+        digest.update(memoryview(img).cast("B"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(image_digest, kernel, iterations, operation):
+        """Return the cache key of an operation.
+
+        Args:
+            image_digest (str): Digest of the input image (digest).
+            kernel (np.ndarray): Structuring element.
+            iterations (int): Number of iterations.
+            operation (str): Operation name.
+
+        Returns:
+            str: Hex digest identifying the result.
+
+        """
+        kernel = np.ascontiguousarray(kernel, dtype=np.uint8)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{image_digest}|{kernel.shape}|{iterations}|{operation}|".encode())
+        digest.update(kernel.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached result for key or None."""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+        result = self._load(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._insert(key, result)
+        return result
+
+    def put(self, key, result):
+        """Store a result, write it to the on-disk tier and return the read only array."""
+        result = self._freeze(result)
+        with self._lock:
+            self._insert(key, result)
+        if self.cache_dir:
+            path = self._path(key)
+            if not os.path.exists(path):
+                temp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as file:
+                    self._write(file, result)
+                os.replace(temp_path, path)
+        return result
+
+    def clear(self):
+        """Remove every result from memory, the on-disk tier is kept."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return the number of entries, bytes in memory, hits and misses."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _insert(self, key, result):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = result
+        self._bytes += self._size(result)
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= self._size(evicted)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}{self.suffix}")
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), "rb") as file:
+                return self._read(file)
+        except (OSError, ValueError):
+            return None
+
+    # Storage of the results, overridden by caches of other kinds of results
+
+    suffix = ".npy"
+
+    @staticmethod
+    def _freeze(result):
+        result = np.array(result)
+        result.setflags(write=False)
+        return result
+
+    @staticmethod
+    def _size(result):
+        return result.nbytes
+
+    @staticmethod
+    def _write(file, result):
+        np.save(file, result)
+
+    @staticmethod
+    def _read(file):
+        result = np.load(file)
+        result.setflags(write=False)
+        return result
@@ -0,0 +1,72 @@
+"""Grayscale morphology with shifted NumPy arrays.
+
+Each pass pads the image with the neutral value (the dtype minimum for dilation and
+maximum for erosion) and takes the maximum or minimum of the views of the padded image
+shifted by every kernel offset. The results are the same as cv.dilate and cv.erode with
+the same anchor (the kernel center by default) and the default border.
+"""
+
+import numpy as np
+
+from structuring_elements import kernel_offsets
+
+
+def _morph(image, kernel, iterations, anchor, erode):
+    image = np.asarray(image)
+    offsets = sorted(kernel_offsets(kernel, anchor))
+    info = np.iinfo(image.dtype)
+    fill = info.max if erode else info.min
+    reduce = np.minimum if erode else np.maximum
+    if not offsets:
+        # An empty kernel leaves the image without neighbours
+        return np.full_like(image, fill)
+
+    rows, cols = image.shape
+    top = max(0, -min(dy for dy, _ in offsets))
+    bottom = max(0, *(dy for dy, _ in offsets))
+    left = max(0, -min(dx for _, dx in offsets))
+    right = max(0, *(dx for _, dx in offsets))
+    padded = np.full((rows + top + bottom, cols + left + right), fill, dtype=image.dtype)
+    for _ in range(iterations):
+        padded[top : top + rows, left : left + cols] = image
+        result = None
+        for dy, dx in offsets:
+            view = padded[top + dy : top + dy + rows, left + dx : left + dx + cols]
+            if result is None:
+                result = view.copy()
+            else:
+                reduce(result, view, out=result)
+        image = result
+    return image
+
+
+def dilate(image, kernel, iterations=1, anchor=None):
+    """Dilates an image.
+
+    Args:
+        image (np.ndarray): 2D integer image.
+        kernel (np.ndarray): Structuring element, non zero cells are part of it.
+        iterations (int): Number of times the dilation is applied.
+        anchor (tuple): (x, y) anchor in the kernel as in OpenCV, the kernel center by default.
+
+    Returns:
+        np.ndarray: Dilated image.
+
+    """
+    return _morph(image, kernel, iterations, anchor, erode=False)
+
+
+def erode(image, kernel, iterations=1, anchor=None):
+    """Erodes an image.
+
+    Args:
+        image (np.ndarray): 2D integer image.
+        kernel (np.ndarray): Structuring element, non zero cells are part of it.
+        iterations (int): Number of times the erosion is applied.
+        anchor (tuple): (x, y) anchor in the kernel as in OpenCV, the kernel center by default.
+
+    Returns:
+        np.ndarray: Eroded image.
+
+    """
+    return _morph(image, kernel, iterations, anchor, erode=True)
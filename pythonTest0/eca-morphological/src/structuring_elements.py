@@ -0,0 +1,211 @@
+"""User supplied structuring elements and their decomposition into cheaper passes.
+
+A structuring element is handled as the set of (dy, dx) offsets of its non zero cells
+relative to the anchor, the kernel center as in OpenCV. The cost of a dilation or erosion
+pass grows with the number of offsets, so a kernel is replaced by an equivalent sequence
+of smaller elements when that sequence is cheaper, counting a fixed cost per pass that
+depends on the backend:
+
+1. Rectangular kernels: k iterations are one rectangle enlarged to k * (size - 1) + 1
+   (as OpenCV does), applied as a row pass and a column pass.
+2. Other kernels: the kernel is factorized as a Minkowski sum of smaller elements
+   (segments, small crosses and triangles), B1 + B2 + ... . Each iteration pads the image
+   with the neutral border value, applies the factors and crops it back, which is exactly
+   one pass with the whole kernel.
+"""
+
+import numpy as np
+
+# Largest accepted kernel side
+MAX_KERNEL_SIZE = 63
+# Kernels are 2D matrices
+KERNEL_DIMENSIONS = 2
+# Kernels with fewer cells are a single pass whatever the backend
+MIN_FACTORED_CELLS = 2
+
+# Small elements tried as Minkowski factors, as (dy, dx) offsets
+_FACTOR_CANDIDATES = [
+    frozenset({(0, 0), (0, 1)}),
+    frozenset({(0, 0), (1, 0)}),
+    frozenset({(0, 0), (1, 1)}),
+    frozenset({(0, 0), (1, -1)}),
+    frozenset({(0, -1), (0, 0), (0, 1)}),
+    frozenset({(-1, 0), (0, 0), (1, 0)}),
+    frozenset({(-1, 0), (0, -1), (0, 0), (0, 1)}),
+    frozenset({(1, 0), (0, -1), (0, 0), (0, 1)}),
+    frozenset({(-1, 0), (0, -1), (0, 0), (0, 1), (1, 0)}),
+]
+
+
+def parse_kernel(spec):
+    """Builds a structuring element from user input.
+
+    Args:
+        spec: Nested lists / array of 0 and 1, or a string with rows separated by ";"
+            and cells by "," or spaces, e.g. "0,1,0;1,1,1".
+
+    Returns:
+        np.ndarray: uint8 kernel.
+
+    """
+    if isinstance(spec, str):
+        rows = [row.replace(",", " ").split() for row in spec.strip().split(";") if row.strip()]
+        spec = [[int(cell) for cell in row] for row in rows]
+    try:
+        kernel = np.array(spec, dtype=np.int64)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Kernel must be a rectangular matrix of 0 and 1: {e}") from e
+    if kernel.ndim != KERNEL_DIMENSIONS or kernel.size == 0:
+        raise ValueError("Kernel must be a non empty 2D matrix")
+    if max(kernel.shape) > MAX_KERNEL_SIZE:
+        raise ValueError(f"Kernel sides must be at most {MAX_KERNEL_SIZE}")
+    if not np.isin(kernel, (0, 1)).all():
+        raise ValueError("Kernel cells must be 0 or 1")
+    if not kernel.any():
+        raise ValueError("Kernel must have at least one cell set to 1")
+    return kernel.astype(np.uint8)
+
+
+def kernel_offsets(kernel, anchor=None):
+    """Returns the (dy, dx) offsets of the non zero cells of a kernel.
+
+    Args:
+        kernel (np.ndarray): Structuring element.
+        anchor (tuple): (x, y) anchor as in OpenCV, the kernel center by default.
+
+    Returns:
+        frozenset: Offsets relative to the anchor.
+
+    """
+    kernel = np.asarray(kernel)
+    if anchor is None:
+        anchor = (kernel.shape[1] // 2, kernel.shape[0] // 2)
+    anchor_x, anchor_y = anchor
+    return frozenset(
+        (int(y) - anchor_y, int(x) - anchor_x) for y, x in zip(*np.nonzero(kernel), strict=True)
+    )
+
+
+def offsets_kernel(offsets):
+    """Builds the kernel and OpenCV anchor of a set of offsets.
+
+    The kernel is extended with 0 cells when needed so that the anchor lies inside it.
+
+    Returns:
+        tuple: uint8 kernel and (x, y) anchor.
+
+    """
+    min_y = min(0, *(y for y, _ in offsets))
+    min_x = min(0, *(x for _, x in offsets))
+    height = max(0, *(y for y, _ in offsets)) - min_y + 1
+    width = max(0, *(x for _, x in offsets)) - min_x + 1
+    kernel = np.zeros((height, width), dtype=np.uint8)
+    for y, x in offsets:
+        kernel[y - min_y, x - min_x] = 1
+    return kernel, (-min_x, -min_y)
+
+
+def minkowski_sum(first, second):
+    """Returns the Minkowski sum of two offset sets."""
+    return frozenset((y1 + y2, x1 + x2) for y1, x1 in first for y2, x2 in second)
+
+
+def minkowski_difference(offsets, element):
+    """Returns the offsets r such that r + element is contained in offsets."""
+    y0, x0 = next(iter(element))
+    candidates = {(y - y0, x - x0) for y, x in offsets}
+    return frozenset(
+        (ry, rx)
+        for ry, rx in candidates
+        if all((ry + y, rx + x) in offsets for y, x in element)
+    )
+
+
+def factorize(offsets):
+    """Greedily factorizes an offset set as a Minkowski sum of smaller elements.
+
+    Returns:
+        list: Offset sets whose Minkowski sum is offsets, with fewer offsets in total
+        than offsets when a factorization was found.
+
+    """
+    factors = []
+    current = frozenset(offsets)
+    found = True
+    while found:
+        found = False
+        for candidate in _FACTOR_CANDIDATES:
+            if len(candidate) >= len(current):
+                continue
+            rest = minkowski_difference(current, candidate)
+            if (
+                rest
+                and len(rest) + len(candidate) < len(current)
+                and minkowski_sum(rest, candidate) == current
+            ):
+                factors.append(candidate)
+                current = rest
+                found = True
+                break
+    factors.append(current)
+    return factors
+
+
+def decompose(kernel, iterations=1, pass_cost=16, native_rectangles=False):
+    """Plans the passes equivalent to iterations applications of a kernel.
+
+    The plan with the lowest cost is returned, a pass costs pass_cost plus the number of
+    cells of its element and the padding of a factorized kernel costs two passes.
+
+    Args:
+        kernel (np.ndarray): Structuring element with the anchor at its center.
+        iterations (int): Number of applications.
+        pass_cost (int): Fixed cost of a pass over the image, in kernel cells.
+        native_rectangles (bool): The backend already enlarges and splits rectangular
+            kernels (OpenCV does), they are applied directly.
+
+    Returns:
+        list: Steps as dictionaries with "factors" (list of (kernel, (x, y) anchor) applied
+        in order), "pad" ((top, bottom, left, right) neutral border added before the factors
+        and cropped after them, or None) and "repeat" (times the step is applied).
+
+    """
+    kernel = np.asarray(kernel)
+    offsets = kernel_offsets(kernel)
+    height, width = kernel.shape
+    anchor_x, anchor_y = width // 2, height // 2
+    direct = [{"factors": [(kernel, (anchor_x, anchor_y))], "pad": None, "repeat": iterations}]
+    if iterations < 1 or len(offsets) < MIN_FACTORED_CELLS:
+        return direct
+    best_cost = iterations * (len(offsets) + pass_cost)
+
+    if len(offsets) == kernel.size:
+        if native_rectangles:
+            return direct
+        # Rectangle: enlarged once for all the iterations, then split in row and column
+        width = iterations * (width - 1) + 1
+        height = iterations * (height - 1) + 1
+        factors = []
+        if width > 1:
+            factors.append((np.ones((1, width), np.uint8), (iterations * anchor_x, 0)))
+        if height > 1:
+            factors.append((np.ones((height, 1), np.uint8), (0, iterations * anchor_y)))
+        cost = sum(element.size + pass_cost for element, _ in factors)
+        if cost < best_cost:
+            return [{"factors": factors, "pad": None, "repeat": 1}]
+        return direct
+
+    factors = factorize(offsets)
+    cost = iterations * (
+        sum(len(factor) + pass_cost for factor in factors) + 2 * pass_cost
+    )
+    if len(factors) == 1 or cost >= best_cost:
+        return direct
+    pad = (
+        max(0, -min(y for y, _ in offsets)),
+        max(0, *(y for y, _ in offsets)),
+        max(0, -min(x for _, x in offsets)),
+        max(0, *(x for _, x in offsets)),
+    )
+    factors = [offsets_kernel(factor) for factor in factors]
+    return [{"factors": factors, "pad": pad, "repeat": iterations}]
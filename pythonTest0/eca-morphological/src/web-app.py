@@ -1,24 +1,344 @@
-import io
-import base64
-import ca_class
+import asyncio
+import contextvars
+import json
+import math
+import multiprocessing
+import os
+import secrets
+import struct
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from functools import partial
+from http import HTTPStatus
+from typing import Annotated
 
-import cv2
 import numpy as np
 import uvicorn
 
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from PIL import Image, ImageDraw, ImageFont
+from pydantic import BaseModel, Field, ValidationError
 
+import metrics
+import web_tasks
+
+from admission import AdmissionController, AdmissionError, task_cost
 
 # Import the settings class from your new config file
 from config import AppSettings, MorphologySettings
+from image_cache import ImageCache
+from structuring_elements import parse_kernel
+
+class WorkerPool:
+    """Holder of the worker process pool, created on first use and replaced when broken."""
+
+    def __init__(self, create):
+        """Initialize the holder.
+
+        Args:
+            create: Function of no arguments returning a new executor.
+
+        """
+        self.create = create
+        self._pool = None
+
+    def get(self):
+        """Return the pool, created on first use."""
+        if self._pool is None:
+            self._pool = self.create()
+        return self._pool
+
+    def discard(self, pool):
+        """Shut down pool if it is still the current one, the next get creates another."""
+        if self._pool is pool:
+            self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        """Shut down the current pool, if any."""
+        if self._pool is not None:
+            self.discard(self._pool)
+
+
+# CPU bound work runs in a pool of worker processes (web_tasks) so the event loop keeps
+# serving other clients. The admission controller runs one task per worker, within the
+# memory budget, and queues at most MAX_QUEUED_REQUESTS others.
+admission = AdmissionController(
+    workers=AppSettings.WORKER_PROCESSES or os.cpu_count() or 1,
+    memory_budget=AppSettings.MEMORY_BUDGET,
+    max_queued=AppSettings.MAX_QUEUED_REQUESTS,
+    timeout=AppSettings.REQUEST_TIMEOUT,
+)
+worker_pool = WorkerPool(
+    lambda: ProcessPoolExecutor(
+        max_workers=admission.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=web_tasks.limit_memory,
+        initargs=(AppSettings.WORKER_MEMORY_LIMIT,),
+    )
+)
+
+
+def _release_when_done(loop, memory, seconds, future):
+    # Called from a thread of the pool, the controller belongs to the event loop
+    try:
+        loop.call_soon_threadsafe(admission.release, memory, seconds)
+    except RuntimeError:
+        # The loop is closed, no task is admitted any more
+        pass
+
+
+async def run_in_pool(cost, function, *args):
+    """Run function(*args) in a worker process once admitted for its cost.
+
+    Args:
+        cost (tuple): Estimated (bytes, seconds) of the task (admission.task_cost).
+        function: web_tasks function.
+        *args: Its arguments.
+
+    Raises:
+        HTTPException: 413 or 429 when the task is not admitted, 503 when it runs out of
+            memory or its worker dies, 504 when it takes longer than REQUEST_TIMEOUT,
+            including the wait. A task that times out while running finishes in its
+            worker, its result is discarded. It keeps its worker and memory in the
+            admission controller until then.
+
+    """
+    memory, seconds = cost
+    pool = worker_pool.get()
+    loop = asyncio.get_running_loop()
+    try:
+        async with asyncio.timeout(AppSettings.REQUEST_TIMEOUT):
+            start = time.perf_counter()
+            await admission.acquire(memory, seconds)
+            record_stage("queue", time.perf_counter() - start)
+            try:
+                future = pool.submit(web_tasks.timed_call, function, *args)
+            except BaseException:
+                admission.release(memory, seconds)
+                raise
+            # Released when the worker is done, not when the request gives up on it
+            future.add_done_callback(partial(_release_when_done, loop, memory, seconds))
+            result, stages = await asyncio.wrap_future(future)
+            for name, stage_seconds in stages.items():
+                record_stage(name, stage_seconds)
+            return result
+    except AdmissionError as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+        raise HTTPException(
+            status_code=e.status_code, detail=e.detail, headers=headers
+        ) from e
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail="The request took too long") from e
+    except MemoryError as e:
+        raise HTTPException(status_code=503, detail="The request ran out of memory") from e
+    except BrokenProcessPool as e:
+        # A worker died, the pool is replaced for the next requests
+        worker_pool.discard(pool)
+        raise HTTPException(
+            status_code=503, detail="The worker running the request died"
+        ) from e
+
+
+# Latency of the pipeline stages (web_tasks.timed_call, plus "queue" for the wait for a
+# worker) and of the requests by route, request and response sizes. The stages of the
+# current request are also sent in its Server-Timing header.
+stage_seconds = metrics.Histogram(
+    "eca_stage_seconds", "Seconds spent in each stage.", metrics.LATENCY_BUCKETS, ("stage",)
+)
+request_seconds = metrics.Histogram(
+    "eca_request_seconds", "Seconds to serve a request.", metrics.LATENCY_BUCKETS, ("endpoint",)
+)
+request_bytes = metrics.Histogram(
+    "eca_request_bytes", "Size of the request bodies.", metrics.SIZE_BUCKETS, ("endpoint",)
+)
+response_bytes = metrics.Histogram(
+    "eca_response_bytes", "Size of the response bodies.", metrics.SIZE_BUCKETS, ("endpoint",)
+)
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def record_stage(name, seconds):
+    """Add the duration of a stage to its histogram and to the timings of the request."""
+    stage_seconds.observe(seconds, name)
+    timings = request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+# Encoded evolution images and tiles by key, the packed histories of the tiled runs, and
+# the results being generated so concurrent requests for the same key share the work.
+image_cache = ImageCache(
+    max_entries=AppSettings.IMAGE_CACHE_MAX_ENTRIES,
+    max_bytes=AppSettings.IMAGE_CACHE_MAX_BYTES,
+    cache_dir=AppSettings.IMAGE_CACHE_DIR,
+)
+history_cache = ImageCache(
+    max_entries=AppSettings.HISTORY_CACHE_MAX_ENTRIES,
+    max_bytes=AppSettings.HISTORY_CACHE_MAX_BYTES,
+    cache_dir=AppSettings.IMAGE_CACHE_DIR,
+)
+pending_results = {}
+caches = {"image": image_cache, "history": history_cache}
+
+
+def _cache_stat(read):
+    return lambda: {(name,): read(cache.stats()) for name, cache in caches.items()}
+
+
+def _hit_ratio(stats):
+    lookups = stats["hits"] + stats["misses"]
+    return stats["hits"] / lookups if lookups else 0.0
+
+
+app_metrics = [
+    stage_seconds,
+    request_seconds,
+    request_bytes,
+    response_bytes,
+    metrics.Gauge(
+        "eca_cache_hits_total",
+        "Cache hits.",
+        _cache_stat(lambda stats: stats["hits"]),
+        ("cache",),
+        type="counter",
+    ),
+    metrics.Gauge(
+        "eca_cache_misses_total",
+        "Cache misses.",
+        _cache_stat(lambda stats: stats["misses"]),
+        ("cache",),
+        type="counter",
+    ),
+    metrics.Gauge("eca_cache_hit_ratio", "Hits per lookup.", _cache_stat(_hit_ratio), ("cache",)),
+    metrics.Gauge(
+        "eca_cache_bytes", "Bytes in memory.", _cache_stat(lambda stats: stats["bytes"]), ("cache",)
+    ),
+    metrics.Gauge(
+        "eca_queue_depth", "Tasks waiting for a worker.", lambda: admission.stats()["queued"]
+    ),
+    metrics.Gauge("eca_running_tasks", "Tasks running.", lambda: admission.running),
+    metrics.Gauge(
+        "eca_task_memory_bytes", "Estimated memory of the running tasks.", lambda: admission.memory
+    ),
+    metrics.Gauge(
+        "eca_admitted_tasks_total", "Tasks admitted.", lambda: admission.admitted, type="counter"
+    ),
+    metrics.Gauge(
+        "eca_rejected_tasks_total",
+        "Tasks refused with 413 or 429.",
+        lambda: admission.rejected,
+        type="counter",
+    ),
+]
+
+# Parameters and expiry time of the runs by run ID, in order of last use. Runs unused for
+# RUN_TTL seconds and the least recently used beyond MAX_RUNS are forgotten.
+runs = OrderedDict()
+
+
+def register_run(params):
+    """Register the run of SimulationParams fields and return its ID.
+
+    Random initial states without a seed are given one (params is updated) so the run
+    ID always describes the same history.
+    """
+    if params["init_method"] == "random" and params["seed"] is None:
+        params["seed"] = secrets.randbelow(2**31)
+    run = ImageCache.key(params, "packed")
+    runs[run] = (params, time.monotonic() + AppSettings.RUN_TTL)
+    runs.move_to_end(run)
+    while len(runs) > AppSettings.MAX_RUNS:
+        runs.popitem(last=False)
+    return run
+
+
+def get_run(run):
+    """Return the SimulationParams fields of a run and extend its TTL, 404 when unknown."""
+    now = time.monotonic()
+    # Runs are in order of last use, so of expiry time
+    while runs and next(iter(runs.values()))[1] < now:
+        runs.popitem(last=False)
+    if run not in runs:
+        raise HTTPException(status_code=404, detail="Unknown run")
+    params, _ = runs[run]
+    runs[run] = (params, now + AppSettings.RUN_TTL)
+    runs.move_to_end(run)
+    return params
+
+
+async def run_history(run, params):
+    """Return the packed history of a run (rows x bytes), from history_cache or computed."""
+    content = await cached(history_cache, run, partial(generate_evolution, params, "packed"))
+    rows = max(1, params["num_evolutions"])
+    return np.frombuffer(content, np.uint8, offset=8).reshape(rows, -1)
+
+
+async def generate_evolution(params, format):
+    """Return the encoded image of an evolution, computed in a worker process.
+
+    The packed format is the shape as two little endian uint32 (rows, cols) followed by
+    the bit-packed rows.
+    """
+    cells = max(1, params["num_evolutions"]) * params["cell_space"]
+    if format == "packed":
+        cost = task_cost("packed", cells)
+        packed, rows, cols = await run_in_pool(cost, web_tasks.generate_packed, params)
+        return struct.pack("<II", rows, cols) + packed
+    # Exports also hold the image upscaled by pixel_size
+    scaled = cells * params["pixel_size"] ** 2 if params.get("export") else 0
+    cost = task_cost("image", cells + scaled)
+    return await run_in_pool(cost, web_tasks.generate_image, params)
+
+
+async def _generate_and_put(cache, key, generate):
+    content = await generate()
+    cache.put(key, content)
+    return content
+
+
+async def cached(cache, key, generate):
+    """Return cache[key], on a miss the result of await generate() stored in the cache.
+
+    A None key is never cached.
+    """
+    if key is None:
+        return await generate()
+    content = cache.get(key)
+    if content is not None:
+        return content
+    task = pending_results.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_generate_and_put(cache, key, generate))
+        pending_results[key] = task
+        task.add_done_callback(lambda _: pending_results.pop(key, None))
+    # A client that disconnects does not cancel the work of the others
+    return await asyncio.shield(task)
+
+
+def etag_matches(request, etag):
+    """Return whether the If-None-Match header of the request matches etag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    worker_pool.shutdown()
+
 
 # --- Application Setup ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 # Assume the templates directory is relative to the project root
 templates = Jinja2Templates(directory="templates")
 
@@ -26,23 +346,73 @@ templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    """Records the latency and sizes of a request and sends its stages in Server-Timing."""
+    timings = {}
+    token = request_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    total = time.perf_counter() - start
+    # The route template, not the path, so tiles and runs do not make a series each
+    endpoint = getattr(request.scope.get("route"), "path", "other")
+    request_seconds.observe(total, endpoint)
+    request_bytes.observe(int(request.headers.get("content-length") or 0), endpoint)
+    if "content-length" in response.headers:
+        response_bytes.observe(int(response.headers["content-length"]), endpoint)
+    response.headers["Server-Timing"] = metrics.server_timing({**timings, "total": total})
+    return response
+
+
+# Named kernels: the built-in options and the user kernels of the config
+kernel_options = {
+    **MorphologySettings.KERNEL_OPTIONS,
+    **{name: parse_kernel(spec) for name, spec in MorphologySettings.CUSTOM_KERNELS.items()},
+}
+
+
 # --- Pydantic Models for Input Validation ---
 class MorphologicalParams(BaseModel):
-    image_data: str       # base64 data URL from canvas
+    image_data: str | None = None  # base64 data URL from canvas
+    run: str | None = None  # run ID of /generate_image or /runs, instead of image_data
+    operation: str        # dilation | erosion | gradation | blackhat
+    kernel: str           # name in kernel_options
+    iterations: int = 1
+    custom_kernel: list[list[int]] | str | None = None  # 0/1 rows, overrides kernel
+
+
+class MorphologySpec(BaseModel):
     operation: str        # dilation | erosion | gradation | blackhat
-    kernel: str           # small | large
+    kernel: str = "small"  # name in kernel_options
     iterations: int = 1
+    custom_kernel: list[list[int]] | str | None = None  # 0/1 rows, overrides kernel
+
+
+class MorphologicalBatchParams(BaseModel):
+    image_data: str | None = None  # base64 data URL from canvas
+    run: str | None = None  # run ID of /generate_image or /runs, instead of image_data
+    specs: list[MorphologySpec]
 
 
 class SimulationParams(BaseModel):
     rule: str
-    cell_space: int
-    num_evolutions: int
+    cell_space: int = Field(ge=1)
+    num_evolutions: int = Field(ge=1)
     init_method: str
     print_method: str
     density: float = 0.5
-    pixel_size: int = 3
+    pixel_size: int = Field(default=3, ge=1)
       # Default pixel size value
+    seed: int | None = None  # random initial state seed, None for a new state each time
+    export: bool = False  # upscale the PNG by pixel_size on the server, for downloads
+
+
+class SimulationQuery(SimulationParams):
+    format: str = "png"  # png | packed
 
 
 # --- API Endpoints ---
@@ -62,6 +432,17 @@ async def debug_page(request: Request):
     )
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Returns the stage and request latency histograms, request and response
+    sizes, cache hits and queue depth in the Prometheus text format.
+    """
+    return Response(
+        content=metrics.render(app_metrics), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Serves the main HTML page and passes the config lists from the AppSettings class."""
@@ -73,96 +454,328 @@ async def read_root(request: Request):
             "init_methods": AppSettings.CELLULAR_AUTOMATA_INIT_METHODS,
             "print_methods": AppSettings.CELLULAR_AUTOMATA_PRINT_METHODS,
             "morphology_operations": MorphologySettings.MORPHOLOGY_OPERATIONS,
-            "kernel_options": list(MorphologySettings.KERNEL_OPTIONS.keys()),
+            "kernel_options": list(kernel_options.keys()),
         },
     )
 
 
+async def image_response(request, params, format):
+    """Return the image of an evolution, 304 when the client already has it.
+
+    Images of the same parameters are served from image_cache with an ETag derived from
+    the parameters. Random initial states without a seed are generated every time and
+    are not cached. The run is registered and its ID sent in the X-Run-Id header, so
+    morphology requests can reference the history instead of uploading the image.
+    """
+    if format not in ("png", "packed"):
+        raise HTTPException(status_code=400, detail=f"Unknown image format: {format}")
+    params = params.model_dump(exclude={"format"})
+    key = ImageCache.key(params, format)
+    if key is None:
+        headers = {"Cache-Control": "no-store"}
+    else:
+        etag = f'"{key}"'
+        headers = {"ETag": etag, "Cache-Control": f"public, max-age={AppSettings.IMAGE_MAX_AGE}"}
+    headers["X-Run-Id"] = register_run(params)
+    if key is not None and etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    content = await cached(image_cache, key, partial(generate_evolution, params, format))
+    if format == "packed":
+        rows, cols = struct.unpack_from("<II", content)
+        headers.update({"X-Image-Rows": str(rows), "X-Image-Cols": str(cols)})
+        return Response(
+            content=content[8:], media_type="application/octet-stream", headers=headers
+        )
+    return Response(content=content, media_type="image/png", headers=headers)
+
+
+@app.get("/generate_image")
+async def generate_image_query(request: Request, params: Annotated[SimulationQuery, Query()]):
+    """
+    Same as POST /generate_image with the parameters in the query string, so
+    browsers and proxies can cache the image and revalidate it with its ETag.
+    """
+    return await image_response(request, params, params.format)
+
+
 @app.post("/generate_image")
-async def generate_image(params: SimulationParams):
-    """
-    Receives parameters, generates a CA evolution image,
-    and returns it as a Base64-encoded data URL.
-    """
-    eca_rule_number = int(params.rule)
-    eca_size = int(params.cell_space)
-    eca_evolutions = int(params.num_evolutions)
-    eca_init_method = params.init_method
-    eca_print_method = params.print_method
-    eca_density = float(params.density)
-    eca = ca_class.Eca(rule_number=eca_rule_number)
-    eca.define_evolution_config(
-        size=eca_size, 
-        evolutions=eca_evolutions, 
-        print_method=eca_print_method, 
-        init_method=eca_init_method
-    )
-    
-    # If using random init method, pass the density to the init_random method
-    # This requires modifying the evolution method to accept density parameter
-    if eca_init_method == "random":
-        eca.init_state = eca.init_random(rdensity=eca_density)
-    
-    eca.evolution()
-    print(eca)
-    #pixel_size = 1
-    print("params", params)
-    pixel_size = params.pixel_size
-    eca.set_pixel_size(pixel_size)
-    img = eca.print_history()
-    ImageDraw.Draw(img)
-
-    if pixel_size > 1:
-        new_size = (img.width * pixel_size, img.height * pixel_size)
-        print("New size:", new_size)
-        img = img.resize(new_size, Image.NEAREST)
+async def generate_image(request: Request, params: SimulationParams, format: str = "png"):
+    """
+    Receives parameters, generates a CA evolution image and returns it
+    as an image/png response, or with format=packed as the states
+    bit-packed row by row (application/octet-stream, one bit per cell,
+    rows padded to whole bytes, shape in X-Image-Rows / X-Image-Cols).
+    """
+    return await image_response(request, params, format)
+
+
+@app.websocket("/ws/generate_image")
+async def stream_image(websocket: WebSocket):
+    """
+    Streams an evolution while it is computed. The client sends SimulationParams as
+    JSON and receives {"rows", "cols", "run"} (the run is registered as in
+    /generate_image), then one binary message per block of rows:
+    the first row index as a little endian uint32 followed by the rows bit-packed as
+    in /generate_image?format=packed, and finally {"done": true}.
+
+    Blocks start small for a fast first paint and grow while they take less than
+    STREAM_BLOCK_SECONDS, each one is computed in the worker pool.
+    """
+    await websocket.accept()
+    try:
+        params = SimulationParams.model_validate(await websocket.receive_json()).model_dump()
+    except (ValidationError, ValueError) as e:
+        await websocket.close(code=1008, reason=str(e)[:120])
+        return
+    except WebSocketDisconnect:
+        return
+
+    rows, cols = max(1, params["num_evolutions"]), params["cell_space"]
+    max_block_rows = max(1, AppSettings.STREAM_MAX_BLOCK_BYTES // ((cols + 7) // 8))
+    block_rows = min(AppSettings.STREAM_FIRST_BLOCK_ROWS, max_block_rows)
+    state = None
+    first_row = 0
+    # Gives random initial states without a seed one, so the run is the streamed history
+    run = register_run(params)
+    try:
+        await websocket.send_json({"rows": rows, "cols": cols, "run": run})
+        while first_row < rows:
+            count = min(block_rows, rows - first_row)
+            start = time.perf_counter()
+            cost = task_cost("packed", count * cols)
+            packed, state = await run_in_pool(
+                cost, web_tasks.generate_block, params, state, count
+            )
+            await websocket.send_bytes(struct.pack("<I", first_row) + packed)
+            first_row += count
+            if time.perf_counter() - start < AppSettings.STREAM_BLOCK_SECONDS:
+                block_rows = min(block_rows * 2, max_block_rows)
+        await websocket.send_json({"done": True})
+        await websocket.close()
+    except WebSocketDisconnect:
+        return
+    except HTTPException as e:
+        # Not admitted (1013: try again later) or failed in run_in_pool
+        code = 1013 if e.status_code == HTTPStatus.TOO_MANY_REQUESTS else 1011
+        await websocket.close(code=code, reason=e.detail)
+
+
+def tile_levels(rows, cols):
+    """Return the highest zoom level of a run, where one pixel is one cell.
+
+    Level 0 shows the whole run in one tile and every level halves the cells per pixel.
+    """
+    return max(0, math.ceil(math.log2(max(rows, cols) / AppSettings.TILE_SIZE)))
+
+
+@app.post("/runs")
+async def create_run(params: SimulationParams):
+    """
+    Registers a run for the tile endpoint and returns its ID, shape, tile size and
+    highest zoom level. Nothing is computed until a tile is requested. Random initial
+    states without a seed are given one so their tiles fit together.
+    """
+    params = params.model_dump()
+    rows, cols = max(1, params["num_evolutions"]), params["cell_space"]
+    if rows * ((cols + 7) // 8) > AppSettings.HISTORY_CACHE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="The run is too large")
+
+    run = register_run(params)
+    return {
+        "run": run,
+        "rows": rows,
+        "cols": cols,
+        "tile_size": AppSettings.TILE_SIZE,
+        "max_zoom": tile_levels(rows, cols),
+    }
+
+
+@app.get("/tiles/{run}/{z}/{x}/{y}.png")
+async def get_tile(request: Request, run: str, z: int, x: int, y: int):
+    """
+    Returns the tile of a run at zoom level z, column x and row y as an image/png
+    response. Tiles are TILE_SIZE pixels square except at the right and bottom edges.
+    The history of the run and the tile are computed on first use and cached.
+    """
+    params = get_run(run)
+    rows, cols = max(1, params["num_evolutions"]), params["cell_space"]
+    max_zoom = tile_levels(rows, cols)
+    scale = 2 ** (max_zoom - z) if 0 <= z <= max_zoom else 0
+    span = AppSettings.TILE_SIZE * scale
+    if not scale or not (0 <= y * span < rows and 0 <= x * span < cols):
+        raise HTTPException(status_code=404, detail="No such tile")
+
+    key = f"{run}-{z}-{x}-{y}"
+    # A run ID always describes the same history, its tiles never change
+    headers = {"ETag": f'"{key}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    async def render():
+        packed = await run_history(run, params)
+        left = x * span
+        tile_cols = min(span, cols - left)
+        region = packed[y * span : (y + 1) * span, left // 8 : (left + tile_cols + 7) // 8]
+        cost = task_cost("tile", region.shape[0] * tile_cols)
+        return await run_in_pool(cost, web_tasks.render_tile, region, tile_cols, scale)
+
+    content = await cached(image_cache, key, render)
+    return Response(content=content, media_type="image/png", headers=headers)
+
+
+async def morphology_source(image_data, run):
+    """Return the image of a morphology request and its (rows, cols).
+
+    The image is the packed history of the run and its number of cells per row, or the
+    base64 PNG data URL, of which only the header is read here (400 if invalid).
+    """
+    if (image_data is None) == (run is None):
+        raise HTTPException(status_code=400, detail="Either image_data or run is required")
+    if run is not None:
+        params = get_run(run)
+        packed = await run_history(run, params)
+        return (packed, params["cell_space"]), (packed.shape[0], params["cell_space"])
     try:
-        ImageFont.truetype("arial.ttf", 15)
-    except IOError:
-        ImageFont.load_default()
-    
-    buffered = io.BytesIO()
+        return image_data, web_tasks.png_shape(image_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+def morphology_cost(shape, groups):
+    """Return the estimated (bytes, seconds) of groups of morphological operations.
+
+    Args:
+        shape (tuple): (rows, cols) of the image.
+        groups (list): (kernel, iterations, operations) of each group.
 
-    img.save(buffered, format="PNG")
+    """
+    rows, cols = shape
+    pixels = rows * cols
+    # Every operation is up to two passes of the kernel per iteration
+    work = sum(
+        pixels * np.count_nonzero(kernel) * iterations * 2 * len(ops)
+        for kernel, iterations, ops in groups
+    )
+    return task_cost("morphology", pixels * max(len(ops) for _, _, ops in groups), work)
 
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    img_data_url = f"data:image/png;base64,{img_str}"
 
-    return {"image_data": img_data_url}
+def resolve_kernel(name, custom_kernel):
+    """Return the named kernel, or the custom kernel when given (400 if it is invalid)."""
+    if custom_kernel is None:
+        return kernel_options.get(name, MorphologySettings.KERNEL_SMALL)
+    try:
+        return parse_kernel(custom_kernel)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
 
 @app.post("/generate_morphological")
 async def generate_morphological(params: MorphologicalParams):
     """
-    Receives a base64 canvas image and morphological parameters,
-    applies the selected operation via OpenCV, and returns the result
-    as a Base64-encoded data URL.
+    Receives a base64 canvas image, or the ID of a run whose history is
+    processed server-side, and morphological parameters, applies the
+    selected operation via OpenCV, and returns the result as an
+    image/png response.
     """
-    # Decode base64 image from canvas
-    header, encoded = params.image_data.split(",", 1)
-    img_bytes = base64.b64decode(encoded)
-    np_arr = np.frombuffer(img_bytes, np.uint8)
-    img = cv2.imdecode(np_arr, cv2.IMREAD_GRAYSCALE)
-
-    print("Morphological operation:", params.operation)
-    kernel = MorphologySettings.KERNEL_OPTIONS.get(params.kernel, MorphologySettings.KERNEL_SMALL)
+    kernel = resolve_kernel(params.kernel, params.custom_kernel)
     iterations = max(1, params.iterations)
 
-    if params.operation == "dilation":
-        result = cv2.dilate(img, kernel, iterations=iterations)
-    elif params.operation == "erosion":
-        result = cv2.morphologyEx(img, cv2.MORPH_OPEN, kernel, iterations=iterations)
-    elif params.operation == "gradation":
-        result = cv2.morphologyEx(img, cv2.MORPH_GRADIENT, kernel, iterations=iterations)
-    elif params.operation == "blackhat":
-        result = cv2.morphologyEx(img, cv2.MORPH_BLACKHAT, kernel, iterations=iterations)
-    else:
-        result = img
+    image, shape = await morphology_source(params.image_data, params.run)
+    cost = morphology_cost(shape, [(kernel, iterations, [params.operation])])
+    content = await run_in_pool(
+        cost,
+        web_tasks.generate_morphological,
+        image,
+        params.operation,
+        kernel,
+        iterations,
+    )
+    return Response(content=content, media_type="image/png")
 
-    _, buffer = cv2.imencode(".png", result)
-    img_str = base64.b64encode(buffer).decode()
-    img_data_url = f"data:image/png;base64,{img_str}"
 
-    return {"image_data": img_data_url}
+@app.post("/generate_morphological_batch")
+async def generate_morphological_batch(params: MorphologicalBatchParams):
+    """
+    Receives one base64 canvas image (or a run ID, as /generate_morphological)
+    and a list of (operation, kernel, iterations) specs and returns a
+    multipart/form-data response: a "results" JSON part with the operation,
+    kernel and iterations of every spec and one image/png part per spec,
+    named by its index. The image is decoded once and the specs sharing a
+    kernel and iterations share their dilate and erode passes.
+    """
+    if not params.specs or len(params.specs) > MorphologySettings.BATCH_MAX_SPECS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Between 1 and {MorphologySettings.BATCH_MAX_SPECS} specs are required",
+        )
+    unknown = [
+        spec.operation
+        for spec in params.specs
+        if spec.operation not in MorphologySettings.MORPHOLOGY_OPERATIONS
+    ]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown morphological operations: {unknown}")
+
+    # Specs grouped by kernel and iterations, each group is one apply_all call
+    groups = {}
+    for index, spec in enumerate(params.specs):
+        kernel = resolve_kernel(spec.kernel, spec.custom_kernel)
+        iterations = max(1, spec.iterations)
+        key = (kernel.tobytes(), kernel.shape, iterations)
+        group = groups.setdefault(key, {"kernel": kernel, "iterations": iterations, "specs": []})
+        group["specs"].append(index)
+    for group in groups.values():
+        ops = (params.specs[index].operation for index in group["specs"])
+        group["ops"] = list(dict.fromkeys(ops))
+
+    group_specs = [
+        (group["kernel"], group["iterations"], group["ops"]) for group in groups.values()
+    ]
+    image, shape = await morphology_source(params.image_data, params.run)
+    encoded_groups = await run_in_pool(
+        morphology_cost(shape, group_specs),
+        web_tasks.generate_morphological_batch,
+        image,
+        group_specs,
+    )
+    results = [None] * len(params.specs)
+    images = [None] * len(params.specs)
+    for group, encoded in zip(groups.values(), encoded_groups, strict=True):
+        for index in group["specs"]:
+            spec = params.specs[index]
+            results[index] = {
+                "operation": spec.operation,
+                "kernel": spec.kernel if spec.custom_kernel is None else "custom",
+                "iterations": group["iterations"],
+            }
+            images[index] = encoded[spec.operation]
+
+    boundary = uuid.uuid4().hex
+    parts = [
+        _form_part(boundary, "results", json.dumps(results).encode(), "application/json"),
+        *(
+            _form_part(boundary, str(index), image, "image/png", f"{index}.png")
+            for index, image in enumerate(images)
+        ),
+        f"--{boundary}--\r\n".encode(),
+    ]
+    return Response(
+        content=b"".join(parts), media_type=f"multipart/form-data; boundary={boundary}"
+    )
+
+
+def _form_part(boundary, name, content, content_type, filename=None):
+    """Return one part of a multipart/form-data body."""
+    disposition = f'form-data; name="{name}"'
+    if filename:
+        disposition += f'; filename="{filename}"'
+    header = (
+        f"--{boundary}\r\n"
+        f"Content-Disposition: {disposition}\r\n"
+        f"Content-Type: {content_type}\r\n\r\n"
+    )
+    return header.encode() + content + b"\r\n"
 
 
 if __name__ == "__main__":
@@ -0,0 +1,312 @@
+"""CPU bound work of the web app, run in the worker processes of its process pool.
+
+The functions only take and return picklable values: parameters, kernels, base64 data
+URLs, packed histories and encoded images as bytes. Their stages are timed in
+task_instrumentation, run them through timed_call to get the timings. Each worker
+process keeps its own morphology result cache, the on-disk tier
+(MorphologySettings.CACHE_DIR) is shared by all of them.
+"""
+
+import base64
+import struct
+from functools import lru_cache
+from itertools import islice
+
+import cv2
+import numpy as np
+
+import bilevel_png
+import binary_morphology
+import ca_class
+import ca_mm_class
+from config import MorphologySettings
+from instrumentation import Instrumentation
+from morphology_cache import MorphologyCache
+
+# Bytes of a PNG up to the width and height of its IHDR chunk: signature, chunk length
+# and type, width and height
+PNG_HEADER_BYTES = 24
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Stage timers of the task running in this process, recorded even when ECA_INSTRUMENTATION
+# is off since they are sent back with every result (timed_call)
+task_instrumentation = Instrumentation(enabled=True)
+
+
+@lru_cache(maxsize=1)
+def morphology_cache():
+    """Return the morphology result cache of this process, created on first use."""
+    return MorphologyCache(
+        max_entries=MorphologySettings.CACHE_MAX_ENTRIES,
+        max_bytes=MorphologySettings.CACHE_MAX_BYTES,
+        cache_dir=MorphologySettings.CACHE_DIR,
+    )
+
+
+def timed_call(function, *args):
+    """Run function(*args) and return its result and the seconds of each of its stages."""
+    task_instrumentation.reset()
+    result = function(*args)
+    timers = task_instrumentation.report()["timers"]
+    return result, {name: timer["seconds"] for name, timer in timers.items()}
+
+
+def limit_memory(limit):
+    """Limit the address space of this worker process.
+
+    An allocation beyond the limit raises MemoryError in the task instead of the kernel
+    killing the worker.
+
+    Args:
+        limit (int): Bytes, None for no limit.
+
+    """
+    if limit:
+        # POSIX only, imported here so that the module still loads on Windows
+        import resource  # noqa: PLC0415
+
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def png_shape(image_data):
+    """Return the (rows, cols) of a base64 PNG data URL from its header, without decoding it."""
+    header = base64.b64decode(image_data.split(",", 1)[-1][:32])
+    if len(header) < PNG_HEADER_BYTES or not header.startswith(PNG_SIGNATURE):
+        raise ValueError("image_data must be a base64 PNG data URL")
+    cols, rows = struct.unpack(">II", header[16:PNG_HEADER_BYTES])
+    return rows, cols
+
+
+def decode_image(image_data):
+    """Decode a base64 PNG data URL to a grayscale image."""
+    _, encoded = image_data.split(",", 1)
+    with task_instrumentation.stage("base64_decode"):
+        img_bytes = base64.b64decode(encoded)
+    np_arr = np.frombuffer(img_bytes, np.uint8)
+    with task_instrumentation.stage("png_decode"):
+        return cv2.imdecode(np_arr, cv2.IMREAD_GRAYSCALE)
+
+
+def source_image(source):
+    """Return the grayscale image of a morphology request.
+
+    Args:
+        source: base64 PNG data URL, or (packed rows, cols) of a run history with active
+            cells as 1 bits (generate_packed), drawn black on white as in its PNG.
+
+    Returns:
+        np.ndarray: uint8 image.
+
+    """
+    if isinstance(source, str):
+        return decode_image(source)
+    packed, cols = source
+    with task_instrumentation.stage("rendering"):
+        return binary_morphology.unpack_rows(np.invert(packed), cols)
+
+
+def encode_image(img):
+    """Encode a grayscale image as PNG bytes."""
+    with task_instrumentation.stage("png_encode"):
+        _, buffer = cv2.imencode(".png", img)
+    return buffer.tobytes()
+
+
+def configure_eca(params):
+    """Return the Eca described by SimulationParams fields, with its initial state."""
+    with task_instrumentation.stage("init"):
+        eca_rule_number = int(params["rule"])
+        eca_size = int(params["cell_space"])
+        eca_evolutions = int(params["num_evolutions"])
+        eca_init_method = params["init_method"]
+        eca_print_method = params["print_method"]
+        eca_density = float(params["density"])
+        eca = ca_class.Eca(rule_number=eca_rule_number)
+        eca.define_evolution_config(
+            size=eca_size,
+            evolutions=eca_evolutions,
+            print_method=eca_print_method,
+            init_method=eca_init_method,
+        )
+
+        # If using random init method, pass the density to the init_random method
+        # This requires modifying the evolution method to accept density parameter
+        if eca_init_method == "random":
+            if params.get("seed") is not None:
+                np.random.seed(int(params["seed"]))
+            eca.init_state = eca.init_random(rdensity=eca_density)
+    return eca
+
+
+def run_evolution(params):
+    """Run the evolution described by SimulationParams fields and return the Eca."""
+    eca = configure_eca(params)
+    with task_instrumentation.stage("evolution"):
+        eca.evolution()
+    return eca
+
+
+def generate_image(params):
+    """Run an evolution and render it as a 1-bit PNG, one pixel per cell.
+
+    Browsers scale the image themselves, it is only upscaled by pixel_size when export
+    is set (downloads).
+
+    Args:
+        params (dict): SimulationParams fields.
+
+    Returns:
+        bytes: PNG image.
+
+    """
+    eca = run_evolution(params)
+    pixel_size = params["pixel_size"] if params.get("export") else 1
+    eca.set_pixel_size(pixel_size)
+    with task_instrumentation.stage("rendering"):
+        packed = eca.packed_history()
+    cols = eca.size
+    if pixel_size > 1:
+        with task_instrumentation.stage("resize"):
+            image = binary_morphology.unpack_rows(packed, cols, value=1)
+            packed = binary_morphology.pack_rows(
+                image.repeat(pixel_size, axis=0).repeat(pixel_size, axis=1)
+            )
+        cols *= pixel_size
+    with task_instrumentation.stage("png_encode"):
+        return bilevel_png.encode(packed, cols)
+
+
+def generate_packed(params):
+    """Run an evolution and return its states bit-packed row by row.
+
+    Every row is padded to whole bytes, the first cell is the most significant bit of
+    the first byte and active cells are 1 (binary_morphology.pack_rows).
+
+    Args:
+        params (dict): SimulationParams fields.
+
+    Returns:
+        tuple: Packed bytes, rows and cols.
+
+    """
+    eca = configure_eca(params)
+    packed, _ = _pack_rows(eca.generate_rows(), max(1, eca.evolutions), eca.size)
+    return packed.tobytes(), packed.shape[0], eca.size
+
+
+def generate_block(params, state, count):
+    """Continue an evolution by count rows and return them bit-packed.
+
+    Long evolutions are generated block by block, each block from the last state of
+    the previous one, so they can be sent while the next block is computed.
+
+    Args:
+        params (dict): SimulationParams fields.
+        state (np.ndarray): Last state of the previous block, None for the first block,
+            which starts with the initial state.
+        count (int): Number of rows of the block.
+
+    Returns:
+        tuple: Packed bytes of the rows (as generate_packed) and the last state.
+
+    """
+    if state is None:
+        eca = configure_eca(dict(params, num_evolutions=count))
+        rows = eca.generate_rows()
+    else:
+        eca = configure_eca(dict(params, num_evolutions=count + 1))
+        rows = islice(eca.generate_rows(state), 1, None)
+    packed, state = _pack_rows(rows, count, eca.size)
+    return packed.tobytes(), state
+
+
+def _pack_rows(rows, count, cols):
+    # Rows are packed as they are generated, the history is never held unpacked, so both
+    # are timed as the evolution
+    packed = np.empty((count, (cols + 7) // 8), np.uint8)
+    row = None
+    with task_instrumentation.stage("evolution"):
+        for index, row in enumerate(rows):
+            packed[index] = binary_morphology.pack_rows(row[np.newaxis])[0]
+    return packed, row
+
+
+def render_tile(packed, cols, scale, active_color=0):
+    """Render a tile of a packed history as a PNG with scale x scale cells per pixel.
+
+    Each pixel is the fraction of active cells of its block, from white (none) to
+    active_color (all), the last row and column of blocks may be partial.
+
+    Args:
+        packed (np.ndarray): Packed rows of the cells of the tile (pack_rows), the first
+            cell of the tile is the first bit.
+        cols (int): Number of cells in each row of the tile.
+        scale (int): Cells per pixel side.
+        active_color (int): Gray level of active cells.
+
+    Returns:
+        bytes: PNG image of ceil(rows / scale) x ceil(cols / scale) pixels.
+
+    """
+    if scale == 1 and active_color == 0:
+        # Cells are pixels, the tile is the packed rows with white pixels as 1 bits
+        with task_instrumentation.stage("png_encode"):
+            return bilevel_png.encode(np.invert(packed), cols)
+    starts = np.arange(0, cols, scale)
+    widths = np.minimum(scale, cols - starts)
+    pixels = []
+    with task_instrumentation.stage("rendering"):
+        # One band of scale rows at a time, so coarse tiles never unpack all their cells
+        for top in range(0, packed.shape[0], scale):
+            band = np.unpackbits(packed[top : top + scale], axis=1, count=cols)
+            active = np.add.reduceat(band.sum(axis=0, dtype=np.int64), starts)
+            pixels.append(active / (widths * band.shape[0]))
+        image = np.rint(255 + (active_color - 255) * np.array(pixels)).astype(np.uint8)
+    return encode_image(image)
+
+
+def generate_morphological(source, operation, kernel, iterations):
+    """Apply one morphological operation to a PNG data URL or run history (source_image).
+
+    Unknown operations return the image unchanged.
+
+    Returns:
+        bytes: PNG image.
+
+    """
+    img = source_image(source)
+    if operation in MorphologySettings.MORPHOLOGY_OPERATIONS:
+        eca_mm = ca_mm_class.EcaMm(kernel=kernel, iterations=iterations)
+        eca_mm.set_cache(morphology_cache())
+        eca_mm.set_image(img)
+        with task_instrumentation.stage("morphology"):
+            result = eca_mm.apply_all([operation])[operation]
+    else:
+        result = img
+    return encode_image(result)
+
+
+def generate_morphological_batch(source, groups):
+    """Apply groups of morphological operations to an image decoded once.
+
+    Args:
+        source: base64 PNG data URL or run history (source_image).
+        groups (list): (kernel, iterations, operations) of each group, the operations of
+            a group share their dilate and erode passes.
+
+    Returns:
+        list: {operation: PNG bytes} of each group.
+
+    """
+    img = source_image(source)
+    eca_mm = ca_mm_class.EcaMm()
+    eca_mm.set_cache(morphology_cache())
+    eca_mm.set_image(img)
+    results = []
+    for kernel, iterations, ops in groups:
+        eca_mm.set_kernel(kernel)
+        eca_mm.set_iterations(iterations)
+        with task_instrumentation.stage("morphology"):
+            images = eca_mm.apply_all(ops)
+        results.append({op: encode_image(images[op]) for op in ops})
+    return results
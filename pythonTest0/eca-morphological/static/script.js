@@ -3,8 +3,22 @@ console.log('🔍 script.js loaded');
 // ===========================
 // CANVAS ZOOM/PAN STATE — Simulation tab
 // ===========================
-let canvasImage = null;
+// The run shown is loaded as tiles (/tiles/{run}/{z}/{x}/{y}.png): only the visible
+// tiles of the zoom level closest to the canvas resolution are requested
+let tiledRun = null;
+// Runs up to MAX_STREAM_CELLS are streamed instead (/ws/generate_image) and painted row
+// block by row block onto an offscreen canvas as the server computes them
+let streamRun = null;
+let streamSocket = null;
+const MAX_STREAM_CELLS = 4096 * 4096;
+const tiles = new Map();
+const MAX_TILES = 512;
+let drawScheduled = false;
 let zoom = 1;
+// Tiles come at one pixel per cell at the highest level, pixel_size is the zoom the
+// run is shown at
+let pixelScale = 1;
+let lastPayload = null;
 let pan = { x: 0, y: 0 };
 let isDragging = false;
 let dragStart = { x: 0, y: 0 };
@@ -104,8 +118,13 @@ document.addEventListener('DOMContentLoaded', function() {
     // ===========================
     // CANVAS ZOOM/PAN DRAWING
     // ===========================
+    function shownRun() {
+        return streamRun || tiledRun;
+    }
+    
     function drawCanvasWithZoom() {
-        if (!canvasImage || !ctx) return;
+        const run = shownRun();
+        if (!run || !ctx) return;
         
         // Clear canvas
         ctx.fillStyle = '#fdfdfd';
@@ -113,38 +132,190 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Save context state
         ctx.save();
+        // Nearest-neighbour scaling keeps the cells sharp
+        ctx.imageSmoothingEnabled = false;
         
-        // Translate to center, apply zoom and pan
+        // Translate to center, apply zoom and pan (cell coordinates from here on)
         ctx.translate(canvas.width / 2, canvas.height / 2);
         ctx.scale(zoom, zoom);
         ctx.translate(pan.x / zoom, pan.y / zoom);
-        ctx.translate(-canvasImage.width / 2, -canvasImage.height / 2);
+        ctx.translate(-run.cols / 2, -run.rows / 2);
         
-        // Draw image
-        ctx.drawImage(canvasImage, 0, 0);
+        if (streamRun) {
+            ctx.drawImage(streamRun.image, 0, 0);
+            ctx.restore();
+            return;
+        }
+        
+        // Level with at most one cell block per screen pixel
+        const { rows, cols, tile_size, max_zoom } = tiledRun;
+        const coarsening = zoom >= 1 ? 0 : Math.floor(Math.log2(1 / zoom));
+        const level = Math.max(0, max_zoom - coarsening);
+        const scale = 2 ** (max_zoom - level);
+        const span = tile_size * scale;
+        
+        // Visible cells, then the tiles covering them
+        const left = (-canvas.width / 2 - pan.x) / zoom + cols / 2;
+        const top = (-canvas.height / 2 - pan.y) / zoom + rows / 2;
+        const x0 = Math.max(0, Math.floor(left / span));
+        const y0 = Math.max(0, Math.floor(top / span));
+        const x1 = Math.min(Math.ceil(cols / span), Math.ceil((left + canvas.width / zoom) / span));
+        const y1 = Math.min(Math.ceil(rows / span), Math.ceil((top + canvas.height / zoom) / span));
+        for (let y = y0; y < y1; y++) {
+            for (let x = x0; x < x1; x++) {
+                const tile = getTile(level, x, y);
+                if (tile) {
+                    ctx.drawImage(tile, x * span, y * span, tile.width * scale, tile.height * scale);
+                }
+            }
+        }
         
         // Restore context state
         ctx.restore();
     }
     
+    // Returns the loaded tile or null, requesting it the first time
+    function getTile(level, x, y) {
+        const key = `${level}/${x}/${y}`;
+        const tile = tiles.get(key);
+        if (tile !== undefined) return tile;
+        tiles.set(key, null);
+        const run = tiledRun;
+        fetch(`/tiles/${run.run}/${key}.png`)
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+                return response.blob();
+            })
+            .then(blob => createImageBitmap(blob))
+            .then(bitmap => {
+                if (tiledRun !== run) { bitmap.close(); return; }
+                tiles.set(key, bitmap);
+                // Forget the oldest tiles (Map keeps insertion order)
+                for (const [oldKey, oldTile] of tiles) {
+                    if (tiles.size <= MAX_TILES) break;
+                    tiles.delete(oldKey);
+                    if (oldTile) oldTile.close();
+                }
+                scheduleDraw();
+            })
+            .catch(error => {
+                console.error('Tile error:', key, error);
+                if (tiledRun === run) tiles.delete(key);
+            });
+        return null;
+    }
+    
+    function scheduleDraw() {
+        if (drawScheduled) return;
+        drawScheduled = true;
+        requestAnimationFrame(() => {
+            drawScheduled = false;
+            drawCanvasWithZoom();
+        });
+    }
+    
+    function showRun(run) {
+        tiles.forEach(tile => { if (tile) tile.close(); });
+        tiles.clear();
+        if (streamSocket) streamSocket.close();
+        streamSocket = null;
+        streamRun = null;
+        tiledRun = run;
+        zoom = pixelScale;
+        pan = { x: 0, y: 0 };
+        updateZoomButtons();
+        drawCanvasWithZoom();
+    }
+    
     // ===========================
     // ZOOM FUNCTIONS
     // ===========================
     function handleZoom(direction) {
-        const zoomStep = 0.2;
+        // Steps are a factor so huge runs zoom out as fast as small ones
+        const zoomStep = 1.25;
         if (direction === 'in') {
-            zoom = Math.min(zoom + zoomStep, 5);
+            zoom = Math.min(zoom * zoomStep, maxZoom());
         } else {
-            zoom = Math.max(zoom - zoomStep, 0.1);
+            zoom = Math.max(zoom / zoomStep, minZoom());
         }
         updateZoomButtons();
         drawCanvasWithZoom();
     }
     
+    function maxZoom() {
+        return 5 * pixelScale;
+    }
+    
+    // Streams a run over a WebSocket: a {rows, cols, run} header, then binary blocks of the
+    // first row index (uint32 LE) and the rows bit-packed, first cell in the high bit
+    function streamRunImage(payload) {
+        showRun(null);
+        const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const socket = new WebSocket(`${protocol}//${location.host}/ws/generate_image`);
+        socket.binaryType = 'arraybuffer';
+        streamSocket = socket;
+        socket.onopen = () => socket.send(JSON.stringify(payload));
+        socket.onmessage = (event) => {
+            if (streamSocket !== socket) return;
+            if (typeof event.data === 'string') {
+                const message = JSON.parse(event.data);
+                if (message.done) {
+                    console.log('✓ Stream complete');
+                    socket.close();
+                    return;
+                }
+                const image = document.createElement('canvas');
+                image.width = message.cols;
+                image.height = message.rows;
+                streamRun = {
+                    run: message.run, rows: message.rows, cols: message.cols,
+                    image, ctx: image.getContext('2d')
+                };
+                updateZoomButtons();
+                drawCanvasWithZoom();
+                return;
+            }
+            paintBlock(streamRun, event.data);
+            scheduleDraw();
+        };
+        socket.onclose = (event) => {
+            if (event.code !== 1000 && event.code !== 1005 && streamSocket === socket) {
+                console.error('Stream closed:', event.code, event.reason);
+                alert('Error generando imagen: ' + (event.reason || event.code));
+            }
+        };
+    }
+    
+    function paintBlock(run, buffer) {
+        const firstRow = new DataView(buffer).getUint32(0, true);
+        const bytes = new Uint8Array(buffer, 4);
+        const rowBytes = Math.ceil(run.cols / 8);
+        const blockRows = bytes.length / rowBytes;
+        const block = run.ctx.createImageData(run.cols, blockRows);
+        // One RGBA word per pixel: opaque black for active cells, white otherwise
+        const pixels = new Uint32Array(block.data.buffer);
+        for (let row = 0; row < blockRows; row++) {
+            const offset = row * rowBytes;
+            for (let col = 0; col < run.cols; col++) {
+                const active = (bytes[offset + (col >> 3)] >> (7 - (col & 7))) & 1;
+                pixels[row * run.cols + col] = active ? 0xff000000 : 0xffffffff;
+            }
+        }
+        run.ctx.putImageData(block, 0, firstRow);
+    }
+    
+    // Small enough to see the whole run
+    function minZoom() {
+        const run = shownRun();
+        if (!run) return 0.1;
+        const fit = Math.min(canvas.width / run.cols, canvas.height / run.rows);
+        return Math.min(0.1, fit / 2);
+    }
+    
     function updateZoomButtons() {
-        if (zoomInBtn) zoomInBtn.disabled = !canvasImage || zoom >= 5;
-        if (zoomOutBtn) zoomOutBtn.disabled = !canvasImage || zoom <= 0.1;
-        if (resetBtn) resetBtn.disabled = !canvasImage;
+        if (zoomInBtn) zoomInBtn.disabled = !shownRun() || zoom >= maxZoom();
+        if (zoomOutBtn) zoomOutBtn.disabled = !shownRun() || zoom <= minZoom();
+        if (resetBtn) resetBtn.disabled = !shownRun();
         if (zoomDisplay) zoomDisplay.textContent = `Zoom: ${(zoom * 100).toFixed(0)}%`;
     }
     
@@ -155,7 +326,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Reset button
     if (resetBtn) {
         resetBtn.addEventListener('click', function() {
-            zoom = 1;
+            zoom = pixelScale;
             pan = { x: 0, y: 0 };
             updateZoomButtons();
             drawCanvasWithZoom();
@@ -174,13 +345,13 @@ document.addEventListener('DOMContentLoaded', function() {
     // Pan with mouse
     if (canvas) {
         canvas.addEventListener('mousedown', function(e) {
-            if (!canvasImage) return;
+            if (!shownRun()) return;
             isDragging = true;
             dragStart = { x: e.clientX, y: e.clientY };
         });
         
         canvas.addEventListener('mousemove', function(e) {
-            if (!isDragging || !canvasImage) return;
+            if (!isDragging || !shownRun()) return;
             
             const dx = e.clientX - dragStart.x;
             const dy = e.clientY - dragStart.y;
@@ -246,14 +417,26 @@ document.addEventListener('DOMContentLoaded', function() {
     // ===========================
     // SAVE IMAGE BUTTON
     // ===========================
+    // Exports the last image upscaled by pixel_size on the server
     if (saveBtn && canvas) {
-        saveBtn.addEventListener('click', function() {
+        saveBtn.addEventListener('click', async function() {
+            if (!lastPayload) return;
             const filename = 'simulacion.png';
-            const link = document.createElement('a');
-            link.download = filename;
-            link.href = canvas.toDataURL('image/png');
-            link.click();
-            alert(`Imagen guardada como: ${filename}\nRuta: Descargas o carpeta configurada en tu navegador.`);
+            try {
+                const params = new URLSearchParams({ ...lastPayload, export: 'true' });
+                const response = await fetch('/generate_image?' + params);
+                if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+                const url = URL.createObjectURL(await response.blob());
+                const link = document.createElement('a');
+                link.download = filename;
+                link.href = url;
+                link.click();
+                setTimeout(() => URL.revokeObjectURL(url), 0);
+                alert(`Imagen guardada como: ${filename}\nRuta: Descargas o carpeta configurada en tu navegador.`);
+            } catch (error) {
+                console.error('Error:', error);
+                alert('Error guardando imagen: ' + error);
+            }
         });
     }
     
@@ -266,10 +449,28 @@ document.addEventListener('DOMContentLoaded', function() {
             console.log('📤 Form submitted');
             
             const formData = new FormData(simForm);
-            const payload = Object.fromEntries(formData.entries());
+            // Empty optional fields (seed) are left out
+            const payload = Object.fromEntries(
+                [...formData.entries()].filter(([, value]) => value !== '')
+            );
             console.log('Sending payload:', payload);
+            // A random state without a seed changes every time, the export gets a seed so
+            // it is the image on the canvas
+            if (payload.init_method === 'random' && payload.seed === undefined) {
+                payload.seed = String(Math.floor(Math.random() * 2 ** 31));
+            }
+            
+            if (saveBtn) saveBtn.style.display = 'inline-block';
+            lastPayload = payload;
+            pixelScale = Math.max(1, parseInt(payload.pixel_size, 10) || 1);
+            const cells = parseInt(payload.cell_space, 10) * parseInt(payload.num_evolutions, 10);
+            if (cells <= MAX_STREAM_CELLS) {
+                streamRunImage(payload);
+                return;
+            }
             
-            fetch('/generate_image', {
+            // Larger runs are registered, their tiles are requested as they become visible
+            fetch('/runs', {
                 method: 'POST',
                 body: JSON.stringify(payload),
                 headers: {
@@ -283,23 +484,9 @@ document.addEventListener('DOMContentLoaded', function() {
                 }
                 return response.json();
             })
-            .then(data => {
-                console.log('✓ Image data received from backend');
-                if (saveBtn) saveBtn.style.display = 'inline-block';
-                
-                const img = new window.Image();
-                img.onload = function() {
-                    console.log('✓ Image loaded, drawing to canvas');
-                    canvasImage = img;
-                    zoom = 1;
-                    pan = { x: 0, y: 0 };
-                    updateZoomButtons();
-                    drawCanvasWithZoom();
-                };
-                img.onerror = function() {
-                    console.error('Failed to load image data');
-                };
-                img.src = data.image_data;
+            .then(run => {
+                console.log('✓ Run registered:', run);
+                showRun(run);
             })
             .catch(error => {
                 console.error('Error:', error);
@@ -377,6 +564,7 @@ document.addEventListener('DOMContentLoaded', function() {
         morphCtx.fillStyle = '#fdfdfd';
         morphCtx.fillRect(0, 0, morphCanvas.width, morphCanvas.height);
         morphCtx.save();
+        morphCtx.imageSmoothingEnabled = false;
         morphCtx.translate(morphCanvas.width / 2, morphCanvas.height / 2);
         morphCtx.scale(morphZoom, morphZoom);
         morphCtx.translate(morphPan.x / morphZoom, morphPan.y / morphZoom);
@@ -401,6 +589,13 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Expose so inline script functions (copySimulationToMorphCanvas,
     // generateMorphologicalTransformation) can hand images into the zoom/pan system
+    // ID of the run shown (/runs or the stream header) and, for streamed runs, its image
+    // at one pixel per cell: the morph tab processes the run on the server
+    window.simulationRun = () => {
+        const run = shownRun();
+        return run && run.run ? { id: run.run, image: run.image || null } : null;
+    };
+
     window.morphSetImage = function(img) {
         morphCanvasImage = img;
         morphZoom = 1;
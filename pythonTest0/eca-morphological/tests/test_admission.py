@@ -0,0 +1,54 @@
+"""Checks the admission of tasks by cost."""
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+from admission import AdmissionController, AdmissionError  # noqa: E402
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_memory_budget_and_queue(self):
+        async def scenario():
+            controller = AdmissionController(workers=2, memory_budget=100, max_queued=1, timeout=10)
+            with self.assertRaises(AdmissionError) as error:
+                await controller.acquire(101, 1)
+            self.assertEqual(error.exception.status_code, 413)
+
+            await controller.acquire(60, 1)
+            # A free worker but not enough memory: queued until the first task ends
+            waiting = asyncio.ensure_future(controller.acquire(60, 1))
+            await asyncio.sleep(0)
+            self.assertEqual(controller.stats()["queued"], 1)
+            with self.assertRaises(AdmissionError) as error:
+                await controller.acquire(10, 1)
+            self.assertEqual(error.exception.status_code, 429)
+            self.assertIsNotNone(error.exception.retry_after)
+
+            controller.release(60, 1)
+            await waiting
+            self.assertEqual(controller.stats()["running"], 1)
+            self.assertEqual(controller.memory, 60)
+
+        asyncio.run(scenario())
+
+    def test_cancelled_wait_leaves_the_queue(self):
+        async def scenario():
+            controller = AdmissionController(workers=1, memory_budget=100, max_queued=4, timeout=10)
+            await controller.acquire(10, 1)
+            waiting = asyncio.ensure_future(controller.acquire(10, 1))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            controller.release(10, 1)
+            self.assertEqual(controller.stats()["queued"], 0)
+            self.assertEqual(controller.memory, 0)
+
+        asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Checks that both benchmarks write records that their tables read back."""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+import benchmark_results  # noqa: E402
+import bilevel_png  # noqa: E402
+import morphology_benchmark  # noqa: E402
+from config import MorphologySettings  # noqa: E402
+
+
+class TestBenchmarkResults(unittest.TestCase):
+    def test_missing_or_invalid_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            self.assertEqual(benchmark_results.load_records(path), [])
+            with open(path, "w") as file:
+                file.write("{")
+            self.assertEqual(benchmark_results.load_records(path), [])
+
+    def test_relative_files_are_in_src(self):
+        path = benchmark_results.results_file("results.json")
+        self.assertEqual(os.path.dirname(path), os.path.dirname(benchmark_results.__file__))
+        self.assertEqual(benchmark_results.results_file(path), path)
+
+    def test_png_benchmark_round_trip(self):
+        records = bilevel_png.run_benchmark(sizes=[(16, 77)], repeats=1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "png.json")
+            bilevel_png.save_results(records, path)
+            table = bilevel_png.load_table(path)
+        self.assertEqual(set(table[16 * 77]), {record["encoder"] for record in records})
+
+    def test_morphology_benchmark_round_trip(self):
+        kernels = {"small": MorphologySettings.KERNEL_SMALL}
+        records = morphology_benchmark.run_benchmark(
+            sizes=[(16, 40)], kernels=kernels, backends=["opencv", "numpy"], repeats=1
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "morphology.json")
+            morphology_benchmark.save_results(records, path)
+            table = morphology_benchmark.load_table(path)
+        key = (16, 40, tuple(map(tuple, MorphologySettings.KERNEL_SMALL.tolist())))
+        self.assertEqual(set(table[key]), {"opencv", "numpy"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+"""Checks that 1-bit PNGs decode to the evolution images."""
+
+import os
+import sys
+import unittest
+
+import cv2 as cv
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+import bilevel_png  # noqa: E402
+from ca_class import Eca  # noqa: E402
+
+
+class TestBilevelPng(unittest.TestCase):
+    def test_encoders_match_history(self):
+        np.random.seed(1)
+        eca = Eca(rule_number=30)
+        # A width that is not a multiple of 8 leaves padding bits in every row
+        eca.define_evolution_config(
+            size=77, evolutions=40, print_method="png", init_method="random"
+        )
+        eca.init_state = eca.init_random(rdensity=0.5)
+        eca.evolution()
+        for encoder in ("pil", "opencv"):
+            png = bilevel_png.encode(eca.packed_history(), eca.size, encoder=encoder)
+            decoded = cv.imdecode(np.frombuffer(png, np.uint8), cv.IMREAD_UNCHANGED)
+            np.testing.assert_array_equal(decoded, eca.history_array())
+        self.assertEqual(eca.print_history().mode, "1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,254 @@
+"""Checks EcaMm results against the equivalent OpenCV calls."""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import cv2 as cv
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+import binary_morphology  # noqa: E402
+import ca_mm_class  # noqa: E402
+import morphology_benchmark  # noqa: E402
+from config import MorphologySettings  # noqa: E402
+
+# Fraction of white pixels of the random images
+DENSITY = 0.6
+
+
+def opening_areas(image, kernel, max_size):
+    return np.array(
+        [cv.countNonZero(image)]
+        + [
+            cv.countNonZero(cv.morphologyEx(image, cv.MORPH_OPEN, kernel, iterations=size))
+            for size in range(1, max_size + 1)
+        ]
+    )
+
+
+class TestPatternSpectrum(unittest.TestCase):
+    def test_matches_openings_per_size(self):
+        rng = np.random.default_rng(39)
+        image = ((rng.random((80, 120)) < DENSITY) * 255).astype(np.uint8)
+        image = cv.dilate(image, np.ones((3, 3), np.uint8))
+        # hollow does not contain its anchor, its erosions are not nested
+        for name in ("small", "large", "hollow"):
+            kernel = MorphologySettings.KERNEL_OPTIONS[name]
+            eca = ca_mm_class.EcaMm(kernel=kernel)
+            eca.set_image(image)
+            areas = opening_areas(image, kernel, 10)
+            self.assertTrue(np.array_equal(eca.pattern_spectrum(10), areas[:-1] - areas[1:]))
+
+
+def eca_image(rows, cols, seed=34):
+    rng = np.random.default_rng(seed)
+    image = ((rng.random((rows, cols)) < DENSITY) * 255).astype(np.uint8)
+    return cv.dilate(image, np.ones((2, 2), np.uint8))
+
+
+class TestApplyTiled(unittest.TestCase):
+    OPS = ["dilation", "erosion", "gradation", "blackhat"]
+
+    def whole_image(self, eca, image):
+        eca.set_image(image)
+        return eca.apply_all(self.OPS)
+
+    def assert_tiled_equal(self, eca, image, tile_rows, workers=1):
+        expected = self.whole_image(eca, image)
+        outputs = {op: np.zeros_like(image) for op in self.OPS}
+        eca.apply_tiled(image, outputs, tile_rows=tile_rows, workers=workers)
+        for op in self.OPS:
+            with self.subTest(op=op):
+                self.assertTrue(np.array_equal(outputs[op], expected[op]))
+
+    def test_matches_whole_image(self):
+        image = eca_image(61, 70)
+        for backend in MorphologySettings.MORPHOLOGY_BACKENDS:
+            for name in ("small", "large", "hollow"):
+                for iterations in (1, 3):
+                    eca = ca_mm_class.EcaMm(
+                        kernel=MorphologySettings.KERNEL_OPTIONS[name],
+                        iterations=iterations,
+                        backend=backend,
+                    )
+                    halo_above, halo_below = eca._halo_rows(self.OPS)
+                    # Tiles smaller than the halo, around the halo and the whole image
+                    for tile_rows in (1, max(halo_above, halo_below), 16, 61):
+                        with self.subTest(
+                            backend=backend, kernel=name, iterations=iterations, tiles=tile_rows
+                        ):
+                            self.assert_tiled_equal(eca, image, tile_rows)
+
+    def test_workers(self):
+        image = eca_image(90, 50)
+        eca = ca_mm_class.EcaMm(kernel=MorphologySettings.KERNEL_LARGE, iterations=2)
+        for tile_rows in (1, 3, 7):
+            with self.subTest(tiles=tile_rows):
+                self.assert_tiled_equal(eca, image, tile_rows, workers=4)
+
+    def test_memmap_source_and_outputs(self):
+        image = eca_image(75, 40)
+        eca = ca_mm_class.EcaMm(kernel=MorphologySettings.KERNEL_LARGE, iterations=2)
+        expected = self.whole_image(eca, image)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "source.raw")
+            np.memmap(path, np.uint8, "w+", shape=image.shape)[:] = image
+            source = np.memmap(path, np.uint8, "r", shape=image.shape)
+            outputs = {
+                op: np.memmap(os.path.join(directory, op), np.uint8, "w+", shape=image.shape)
+                for op in self.OPS
+            }
+            eca.apply_tiled(source, outputs, tile_rows=4, workers=2)
+            for op in self.OPS:
+                written = np.fromfile(os.path.join(directory, op), np.uint8).reshape(image.shape)
+                with self.subTest(op=op):
+                    self.assertTrue(np.array_equal(written, expected[op]))
+            del source, outputs
+
+
+class TestStreamMorphology(unittest.TestCase):
+    OPS = ["dilation", "erosion", "gradation", "blackhat"]
+
+    def assert_stream_equal(self, eca, block_rows):
+        eca.history = []
+        blocks = list(eca.stream_morphology(self.OPS, block_rows=block_rows))
+        eca.evolution()
+        expected = eca.apply_all(self.OPS)
+        for op in self.OPS:
+            with self.subTest(op=op):
+                streamed = np.concatenate([block[op] for block in blocks])
+                self.assertTrue(np.array_equal(streamed, expected[op]))
+
+    def test_matches_apply_all(self):
+        for rule, init_method in ((30, "single_cell"), (110, "random"), (22, "random")):
+            for name in ("small", "large", "hollow"):
+                eca = ca_mm_class.EcaMm(
+                    rule_number=rule,
+                    kernel=MorphologySettings.KERNEL_OPTIONS[name],
+                    iterations=2,
+                )
+                np.random.seed(rule)
+                eca.define_evolution_config(size=45, evolutions=40, init_method=init_method)
+                for block_rows in (1, 3, 32, 40, 64):
+                    with self.subTest(rule=rule, kernel=name, block_rows=block_rows):
+                        self.assert_stream_equal(eca, block_rows)
+
+    def test_evolutions_shorter_than_halo(self):
+        eca = ca_mm_class.EcaMm(
+            rule_number=90, kernel=MorphologySettings.KERNEL_LARGE, iterations=3
+        )
+        self.assertGreater(min(eca._halo_rows(self.OPS)), 3)
+        for evolutions in (1, 2, 3):
+            eca.define_evolution_config(size=20, evolutions=evolutions, init_method="single_cell")
+            for block_rows in (1, 2, 8):
+                with self.subTest(evolutions=evolutions, block_rows=block_rows):
+                    self.assert_stream_equal(eca, block_rows)
+
+
+class TestAutoBackend(unittest.TestCase):
+    def test_backend_decided_once_per_call(self):
+        image = eca_image(40, 40)
+        eca = ca_mm_class.EcaMm(kernel=MorphologySettings.KERNEL_HOLLOW, iterations=2)
+        eca.set_image(image)
+        expected = eca.apply_all()
+        with mock.patch.object(
+            ca_mm_class, "fastest_backend", wraps=ca_mm_class.fastest_backend
+        ) as fastest:
+            results = eca.apply_all()
+        self.assertEqual(fastest.call_count, 1)
+        for op, result in results.items():
+            self.assertTrue(np.array_equal(result, expected[op]))
+
+    def test_image_checked_once_for_packed(self):
+        image = eca_image(40, 40)
+        kernel = MorphologySettings.KERNEL_SMALL
+        cells = tuple(map(tuple, kernel.tolist()))
+        table = {(40, 40, cells): {"packed": 1.0, "opencv": 2.0}}
+        eca = ca_mm_class.EcaMm(kernel=kernel)
+        eca.set_image(image)
+        with (
+            mock.patch.object(morphology_benchmark, "load_table", return_value=table),
+            mock.patch.object(
+                ca_mm_class, "is_binary", wraps=morphology_benchmark.is_binary
+            ) as check,
+        ):
+            self.assertEqual(eca._backend_for(image), "packed")
+            eca.apply_all()
+            eca.pattern_spectrum(3)
+            self.assertEqual(check.call_count, 1)
+            gray = image // 2
+            eca.set_image(gray)
+            self.assertEqual(eca._backend_for(gray), "opencv")
+            self.assertEqual(check.call_count, 2)
+
+
+def diamond(radius):
+    y, x = np.mgrid[-radius : radius + 1, -radius : radius + 1]
+    return (abs(x) + abs(y) <= radius).astype(np.uint8)
+
+
+class TestPackedBackend(unittest.TestCase):
+    OPS = ["dilation", "erosion", "gradation", "blackhat"]
+
+    def assert_matches_opencv(self, image, kernel, iterations):
+        expected = ca_mm_class.EcaMm(kernel=kernel, iterations=iterations, backend="opencv")
+        expected.set_image(image)
+        packed = ca_mm_class.EcaMm(kernel=kernel, iterations=iterations, backend="packed")
+        packed.set_image(image)
+        results = packed.apply_all(self.OPS)
+        for op, result in expected.apply_all(self.OPS).items():
+            with self.subTest(op=op):
+                self.assertTrue(np.array_equal(results[op], result))
+
+    def test_padded_steps_match_opencv(self):
+        # Without a pass cost the large kernels are split in factors with a neutral border
+        ca_mm_class._plan.cache_clear()
+        self.addCleanup(ca_mm_class._plan.cache_clear)
+        image = eca_image(37, 130)
+        with mock.patch.dict(MorphologySettings.PASS_COSTS, {"packed": 0}):
+            for kernel in (diamond(4), MorphologySettings.KERNEL_HOLLOW):
+                plan = ca_mm_class._plan(kernel.tobytes(), kernel.shape, 2, "packed")
+                self.assertTrue(any(step["pad"] for step in plan))
+                with self.subTest(kernel=kernel.shape):
+                    self.assert_matches_opencv(image, kernel, 2)
+
+    def test_apply_packed(self):
+        image = eca_image(45, 70)
+        eca = ca_mm_class.EcaMm(kernel=MorphologySettings.KERNEL_LARGE, iterations=2)
+        eca.set_image(image)
+        expected = eca.apply_all(self.OPS)
+        results = eca.apply_packed(binary_morphology.pack_rows(image), image.shape[1], self.OPS)
+        for op in self.OPS:
+            with self.subTest(op=op):
+                unpacked = binary_morphology.unpack_rows(results[op], image.shape[1])
+                self.assertTrue(np.array_equal(unpacked, expected[op]))
+
+    def test_apply_tiled_packed_memmap(self):
+        image = eca_image(50, 70)
+        rows, cols = image.shape
+        eca = ca_mm_class.EcaMm(kernel=MorphologySettings.KERNEL_LARGE, iterations=2)
+        eca.set_image(image)
+        expected = eca.apply_all(self.OPS)
+        packed = binary_morphology.pack_rows(image)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "source.raw")
+            np.memmap(path, np.uint8, "w+", shape=packed.shape)[:] = packed
+            source = np.memmap(path, np.uint8, "r", shape=packed.shape)
+            outputs = {
+                op: np.memmap(os.path.join(directory, op), np.uint8, "w+", shape=packed.shape)
+                for op in self.OPS
+            }
+            eca.apply_tiled(source, outputs, tile_rows=3, workers=2, cols=cols)
+            for op in self.OPS:
+                written = np.fromfile(os.path.join(directory, op), np.uint8)
+                unpacked = binary_morphology.unpack_rows(written.reshape(packed.shape), cols)
+                with self.subTest(op=op):
+                    self.assertTrue(np.array_equal(unpacked, expected[op]))
+            del source, outputs
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+"""Cross-checks the triangle engines of FractalCountTriangle."""
+
+import os
+import sys
+import unittest
+
+import cv2 as cv
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+import ca_class  # noqa: E402
+import fra_count_tr_class  # noqa: E402
+
+
+def triangle_image(rows, cols, triangles):
+    """Draws triangles of 0 pixels over a 255 background, a triangle is (row, start, length)."""
+    image = np.full((rows, cols), 255, np.uint8)
+    for row, start, length in triangles:
+        i = 0
+        while length - 2 * i > 0:
+            columns = (start + i + np.arange(length - 2 * i)) % cols
+            image[row + i, columns] = 0
+            i += 1
+    return image
+
+
+def count(image, engine):
+    counter = fra_count_tr_class.FractalCountTriangle(engine=engine)
+    counter.binary_image = image
+    counter.find_triangles()
+    return counter.histogram_triangles
+
+
+def count_parallel(image, band_rows, workers=2):
+    counter = fra_count_tr_class.FractalCountTriangle()
+    counter.binary_image = image
+    counter.count_parallel(workers=workers, band_rows=band_rows)
+    return counter.histogram_triangles
+
+
+def eca_image(rule, init_method, size=120, evolutions=90):
+    np.random.seed(rule)
+    eca = ca_class.Eca(rule_number=rule)
+    eca.define_evolution_config(size=size, evolutions=evolutions, init_method=init_method)
+    if init_method == "random":
+        eca.init_state = eca.init_random(rdensity=0.5)
+    return np.array(eca.evolution(), np.uint8) * 255
+
+
+class TestTriangleEngines(unittest.TestCase):
+    def test_components_match_lines_on_isolated_triangles(self):
+        image = triangle_image(
+            40,
+            60,
+            [(1, 2, 9), (1, 20, 12), (8, 55, 10), (15, 30, 7), (16, 5, 14), (25, 40, 6)],
+        )
+        lines = count(image, "lines")
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(count(image, "components"), lines)
+
+    def test_components_match_lines_on_eca_history(self):
+        np.random.seed(30)
+        eca = ca_class.Eca(rule_number=30)
+        eca.define_evolution_config(size=200, evolutions=150, init_method="random")
+        eca.init_state = eca.init_random(rdensity=0.4)
+        history = np.array(eca.evolution(), np.uint8) * 255
+        image = cv.dilate(history, np.array([[0, 1, 0], [1, 1, 1]], np.uint8))
+        lines = count(image, "lines")
+        self.assertGreater(len(lines), 0)
+        self.assertEqual(count(image, "components"), lines)
+
+    def test_parallel_matches_serial_across_bands(self):
+        # Tall triangles crossing every band boundary, two of them wrapping around the edge
+        image = triangle_image(
+            40, 60, [(1, 5, 15), (3, 50, 13), (10, 20, 21), (12, 56, 9), (30, 30, 11)]
+        )
+        serial = count(image, "lines")
+        self.assertEqual(len(serial), 5)
+        for band_rows in (1, 2, 3, 7, 16, 40):
+            with self.subTest(band_rows=band_rows):
+                self.assertEqual(count_parallel(image, band_rows), serial)
+
+    def test_parallel_matches_serial_on_eca_histories(self):
+        for rule in (18, 22, 30, 54, 60, 90, 110, 126):
+            for init_method in ("single_cell", "random"):
+                image = eca_image(rule, init_method)
+                serial = count(image, "lines")
+                for band_rows in (1, 5, 32):
+                    with self.subTest(rule=rule, init_method=init_method, band_rows=band_rows):
+                        self.assertEqual(count_parallel(image, band_rows), serial)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            count(np.zeros((3, 3), np.uint8), "unknown")
+
+
+class TestRenderOverlay(unittest.TestCase):
+    RED = (255, 0, 0, 255)
+    GREEN = (0, 255, 0, 255)
+    BLUE = (0, 0, 255, 255)
+
+    def setUp(self):
+        self.counter = fra_count_tr_class.FractalCountTriangle()
+        self.image = np.full((5, 8), 255, np.uint8)
+        self.image[0, 0] = 0
+        self.counter.binary_image = self.image
+
+    def expected(self, pixels):
+        """RGBA image with the colors of {(row, col): color} over the gray image."""
+        expected = np.repeat(self.image[..., np.newaxis], 4, axis=2)
+        expected[..., 3] = 255
+        for (row, col), color in pixels.items():
+            expected[row, col] = color
+        return expected
+
+    def test_draw_lines(self):
+        # Row 3 wraps around the right border
+        self.counter.histogram_lines = {1: [(2, 4)], 3: [(6, 1)], 4: []}
+        result = np.array(self.counter.draw_lines())
+        pixels = {(1, 2): self.RED, (1, 3): self.RED, (1, 4): self.RED}
+        pixels.update({(3, col): self.RED for col in (6, 7, 0, 1)})
+        np.testing.assert_array_equal(result, self.expected(pixels))
+
+    def test_draw_triangles(self):
+        self.counter.histogram_triangles = [
+            {"row": 0, "lines": [(1, 5), (2, 4)], "area": 8, "base": 5, "height": 2},
+            {"row": 3, "lines": [(7, 1), (0, 0)], "area": 4, "base": 3, "height": 2},
+        ]
+        self.counter.histogram_colors = {"8": self.GREEN[:3], "4": self.BLUE[:3]}
+        result = np.array(self.counter.draw_triangles())
+        pixels = {(0, col): self.GREEN for col in range(1, 6)}
+        pixels.update({(1, col): self.GREEN for col in range(2, 5)})
+        pixels.update({(3, 7): self.BLUE, (3, 0): self.BLUE, (3, 1): self.BLUE})
+        pixels[4, 0] = self.BLUE
+        np.testing.assert_array_equal(result, self.expected(pixels))
+
+    def test_segments_below_the_image_are_ignored(self):
+        overlay = self.counter.render_overlay([(5, (0, 7), 1), (2, (3, 3), 1)], [self.RED])
+        np.testing.assert_array_equal(np.array(overlay), self.expected({(2, 3): self.RED}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+"""Checks the box counting dimension on sets of known dimension."""
+
+import math
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+from ca_class import Eca  # noqa: E402
+from fractal_dimension import box_counting_dimension  # noqa: E402
+
+
+def rule_history(rule, size, evolutions):
+    eca = Eca(rule_number=rule)
+    eca.define_evolution_config(size=size, evolutions=evolutions, init_method="single_cell")
+    eca.evolution()
+    return eca
+
+
+class TestBoxCountingDimension(unittest.TestCase):
+    def test_square_and_line(self):
+        self.assertAlmostEqual(box_counting_dimension(np.ones((256, 256))), 2.0)
+        line = np.zeros((256, 256), np.uint8)
+        line[100] = 1
+        self.assertAlmostEqual(box_counting_dimension(line), 1.0)
+
+    def test_sierpinski(self):
+        # Pascal's triangle mod 2 aligned with the boxes has dimension log2(3) = 1.585
+        rows, cols = np.indices((512, 512))
+        self.assertAlmostEqual(box_counting_dimension((rows & cols) == cols), math.log2(3))
+        # Rule 90 from a single cell draws it, the boxes are not aligned with it
+        eca = rule_history(90, 1024, 512)
+        self.assertAlmostEqual(eca.fractal_dimension(), math.log2(3), delta=0.1)
+
+    def test_no_estimate(self):
+        self.assertTrue(math.isnan(box_counting_dimension(np.zeros((64, 64)))))
+        self.assertTrue(math.isnan(rule_history(90, 64, 1).fractal_dimension()))
+        with self.assertRaises(ValueError):
+            box_counting_dimension(np.ones(8))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+"""Checks the keys and the tiers of the evolution image cache."""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+from image_cache import ImageCache  # noqa: E402
+
+PARAMS = {
+    "rule": "30",
+    "cell_space": 100,
+    "num_evolutions": 50,
+    "init_method": "single_cell",
+    "print_method": "png",
+    "density": 0.5,
+    "pixel_size": 1,
+    "seed": None,
+}
+
+
+class TestImageCache(unittest.TestCase):
+    def test_key(self):
+        key = ImageCache.key(PARAMS)
+        self.assertEqual(key, ImageCache.key(dict(PARAMS, density=0.3)))
+        # Only exported images are upscaled by pixel_size
+        self.assertEqual(key, ImageCache.key(dict(PARAMS, pixel_size=2)))
+        exported = dict(PARAMS, export=True)
+        self.assertNotEqual(ImageCache.key(exported), ImageCache.key(dict(exported, pixel_size=2)))
+        self.assertNotEqual(key, ImageCache.key(PARAMS, "packed"))
+        random = dict(PARAMS, init_method="random")
+        self.assertIsNone(ImageCache.key(random))
+        self.assertNotEqual(
+            ImageCache.key(dict(random, seed=1)), ImageCache.key(dict(random, seed=2))
+        )
+
+    def test_byte_budget_and_disk_tier(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ImageCache(max_bytes=10, cache_dir=cache_dir)
+            cache.put("a", b"123456")
+            cache.put("b", b"abcdef")
+            self.assertEqual(cache.stats()["bytes"], 6)
+            # "a" was evicted from memory and is read back from disk
+            self.assertEqual(cache.get("a"), b"123456")
+            self.assertIsNone(ImageCache(max_bytes=10).get("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Checks the stage timers and counters, with ECA_INSTRUMENTATION on and off."""
+
+import importlib.util
+import os
+import unittest
+from unittest import mock
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+
+
+def load_instrumentation(value):
+    """Load a fresh copy of the module with ECA_INSTRUMENTATION set to value.
+
+    The variable is read at import, a copy keeps the module used by the other tests.
+    """
+    spec = importlib.util.spec_from_file_location(
+        f"instrumentation_{value}", os.path.join(SRC, "instrumentation.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(os.environ, {"ECA_INSTRUMENTATION": value}):
+        spec.loader.exec_module(module)
+    return module
+
+
+def counted_class(module):
+    class Counted:
+        def __init__(self):
+            self.instrumentation = module.Instrumentation()
+
+        def run(self, value):
+            self.instrumentation.count("values", value)
+            return value * 2
+
+    Counted.timed_run = module.timed("run")(Counted.run)
+    return Counted
+
+
+class TestInstrumentationDisabled(unittest.TestCase):
+    def setUp(self):
+        self.module = load_instrumentation("0")
+
+    def test_disabled_values(self):
+        for value in ("", "0", "false", "No"):
+            self.assertFalse(load_instrumentation(value).ENABLED)
+
+    def test_timed_returns_the_method(self):
+        def method(self):
+            return 1
+
+        self.assertIs(self.module.timed("stage")(method), method)
+
+    def test_nothing_recorded(self):
+        counted = counted_class(self.module)()
+        self.assertEqual(counted.timed_run(3), 6)
+        with counted.instrumentation.stage("block"):
+            pass
+        self.assertEqual(counted.instrumentation.report(), {"timers": {}, "counters": {}})
+
+    def test_enabled_object(self):
+        instrumentation = self.module.Instrumentation(enabled=True)
+        with instrumentation.stage("block"):
+            instrumentation.count("rows", 2)
+        report = instrumentation.report()
+        self.assertEqual(report["timers"]["block"]["calls"], 1)
+        self.assertEqual(report["counters"], {"rows": 2})
+
+
+class TestInstrumentationEnabled(unittest.TestCase):
+    def setUp(self):
+        self.module = load_instrumentation("1")
+
+    def test_accumulates(self):
+        counted = counted_class(self.module)()
+        self.assertEqual(counted.timed_run(3), 6)
+        self.assertEqual(counted.timed_run(4), 8)
+        with counted.instrumentation.stage("block"):
+            pass
+        report = counted.instrumentation.report()
+        self.assertEqual(report["counters"], {"values": 7})
+        self.assertEqual(report["timers"]["run"]["calls"], 2)
+        self.assertEqual(report["timers"]["block"]["calls"], 1)
+        self.assertGreaterEqual(report["timers"]["run"]["seconds"], 0)
+
+    def test_add_time_and_reset(self):
+        instrumentation = self.module.Instrumentation()
+        instrumentation.add_time("load", 0.5)
+        instrumentation.add_time("load", 0.25)
+        timers = instrumentation.report()["timers"]
+        self.assertEqual(timers, {"load": {"calls": 2, "seconds": 0.75}})
+        instrumentation.reset()
+        self.assertEqual(instrumentation.report(), {"timers": {}, "counters": {}})
+
+    def test_stage_records_on_exception(self):
+        instrumentation = self.module.Instrumentation()
+        with self.assertRaises(KeyError), instrumentation.stage("failing"):
+            raise KeyError("cell")
+        self.assertEqual(instrumentation.report()["timers"]["failing"]["calls"], 1)
+
+    def test_disabled_object(self):
+        instrumentation = self.module.Instrumentation(enabled=False)
+        with instrumentation.stage("block"):
+            instrumentation.count("rows")
+        self.assertEqual(instrumentation.report(), {"timers": {}, "counters": {}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+"""Checks the stage timings and the Prometheus text format of the metrics."""
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+import metrics  # noqa: E402
+import web_tasks  # noqa: E402
+
+
+def _task(value):
+    with web_tasks.task_instrumentation.stage("double"):
+        value *= 2
+    with web_tasks.task_instrumentation.stage("double"):
+        return value * 2
+
+
+class TestMetrics(unittest.TestCase):
+    def test_timed_call(self):
+        result, stages = web_tasks.timed_call(_task, 3)
+        self.assertEqual(result, 12)
+        self.assertEqual(list(stages), ["double"])
+        # The next task starts without the stages of the previous one
+        self.assertEqual(web_tasks.timed_call(int, "1"), (1, {}))
+
+    def test_render(self):
+        histogram = metrics.Histogram("latency", "Latency.", (0.1, 1), ("stage",))
+        histogram.observe(0.1, "init")
+        histogram.observe(5, "init")
+        gauge = metrics.Gauge("depth", "Depth.", lambda: 2)
+        lines = metrics.render([histogram, gauge]).splitlines()
+        self.assertIn('latency_bucket{stage="init",le="0.1"} 1', lines)
+        self.assertIn('latency_bucket{stage="init",le="1"} 1', lines)
+        self.assertIn('latency_bucket{stage="init",le="+Inf"} 2', lines)
+        self.assertIn('latency_count{stage="init"} 2', lines)
+        self.assertIn("# TYPE depth gauge", lines)
+        self.assertIn("depth 2", lines)
+
+    def test_label_values_must_match_names(self):
+        histogram = metrics.Histogram("latency", "Latency.", (0.1, 1), ("stage",))
+        histogram.observe(0.5, "init", "extra")
+        with self.assertRaises(ValueError):
+            histogram.render()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+"""Checks the keys, the LRU eviction and the tiers of the morphology result cache."""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+import ca_mm_class  # noqa: E402
+from morphology_cache import MorphologyCache  # noqa: E402
+
+KERNEL = np.array([[0, 1, 0], [1, 1, 1]], np.uint8)
+DENSITY = 0.5
+
+
+def result(value, size=100):
+    return np.full(size, value, np.uint8)
+
+
+class TestMorphologyCache(unittest.TestCase):
+    def test_key(self):
+        image = np.zeros((4, 5), np.uint8)
+        digest = MorphologyCache.digest(image)
+        key = MorphologyCache.key(digest, KERNEL, 1, "dilation")
+        self.assertEqual(key, MorphologyCache.key(digest, KERNEL.copy(), 1, "dilation"))
+        self.assertNotEqual(key, MorphologyCache.key(digest, KERNEL, 2, "dilation"))
+        self.assertNotEqual(key, MorphologyCache.key(digest, KERNEL, 1, "erosion"))
+        self.assertNotEqual(key, MorphologyCache.key(digest, KERNEL.T, 1, "dilation"))
+        # Same bytes with another shape are another image
+        self.assertNotEqual(digest, MorphologyCache.digest(image.reshape(5, 4)))
+        changed = image.copy()
+        changed[3, 4] = 255
+        self.assertNotEqual(digest, MorphologyCache.digest(changed))
+
+    def test_hit_and_miss(self):
+        cache = MorphologyCache()
+        self.assertIsNone(cache.get("a"))
+        stored = cache.put("a", result(1))
+        self.assertFalse(stored.flags.writeable)
+        self.assertIs(cache.get("a"), stored)
+        self.assertEqual(cache.stats(), {"entries": 1, "bytes": 100, "hits": 1, "misses": 1})
+
+    def test_evicts_least_recently_used_by_entries(self):
+        cache = MorphologyCache(max_entries=2)
+        cache.put("a", result(1))
+        cache.put("b", result(2))
+        cache.get("a")
+        cache.put("c", result(3))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        cache = MorphologyCache(max_bytes=250)
+        cache.put("a", result(1))
+        cache.put("b", result(2))
+        cache.get("a")
+        cache.put("c", result(3))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["bytes"], 200)
+        # A result larger than the budget is not kept in memory
+        cache.put("d", result(4, 300))
+        self.assertEqual((cache.stats()["entries"], cache.stats()["bytes"]), (0, 0))
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = MorphologyCache(max_entries=1, cache_dir=cache_dir)
+            cache.put("a", result(1))
+            cache.put("b", result(2))
+            self.assertEqual(sorted(os.listdir(cache_dir)), ["a.npy", "b.npy"])
+            # "a" was evicted from memory and is read back from disk
+            loaded = cache.get("a")
+            np.testing.assert_array_equal(loaded, result(1))
+            self.assertFalse(loaded.flags.writeable)
+            np.testing.assert_array_equal(
+                MorphologyCache(cache_dir=cache_dir).get("b"), result(2)
+            )
+            self.assertIsNone(MorphologyCache().get("a"))
+
+    def test_batch_hashes_image_once(self):
+        image = ((np.random.default_rng(35).random((30, 40)) < DENSITY) * 255).astype(np.uint8)
+        eca = ca_mm_class.EcaMm(kernel=KERNEL, backend="opencv")
+        eca.set_image(image)
+        expected = eca.apply_all()
+        cache = MorphologyCache()
+        eca.set_cache(cache)
+        with mock.patch.object(cache, "digest", wraps=cache.digest) as digest:
+            results = eca.apply_all()
+            self.assertEqual(digest.call_count, 1)
+            self.assertEqual(cache.stats()["misses"], len(results))
+            eca.apply_all()
+        self.assertEqual(cache.stats()["hits"], len(results))
+        for op, image in results.items():
+            np.testing.assert_array_equal(image, expected[op])
+
+
+if __name__ == "__main__":
+    unittest.main()
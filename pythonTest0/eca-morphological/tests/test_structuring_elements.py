@@ -0,0 +1,62 @@
+"""Checks that decomposed structuring elements give the same results as OpenCV."""
+
+import os
+import sys
+import unittest
+
+import cv2 as cv
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+import ca_mm_class  # noqa: E402
+import structuring_elements  # noqa: E402
+from config import MorphologySettings  # noqa: E402
+
+# Fraction of white pixels of the random images
+DENSITY = 0.3
+
+
+def diamond(radius):
+    y, x = np.mgrid[-radius : radius + 1, -radius : radius + 1]
+    return (abs(y) + abs(x) <= radius).astype(np.uint8)
+
+
+class TestStructuringElements(unittest.TestCase):
+    def test_parse_kernel(self):
+        kernel = structuring_elements.parse_kernel("0,1,0; 1 1 1")
+        self.assertTrue(np.array_equal(kernel, MorphologySettings.KERNEL_SMALL))
+        for spec in ("1,2", "0,0", [[1, 1], [1]], ""):
+            with self.assertRaises(ValueError):
+                structuring_elements.parse_kernel(spec)
+
+    def test_large_kernel_factors(self):
+        offsets = structuring_elements.kernel_offsets(MorphologySettings.KERNEL_LARGE)
+        factors = structuring_elements.factorize(offsets)
+        self.assertEqual(len(factors), 2)
+        total = structuring_elements.minkowski_sum(*factors)
+        self.assertEqual(total, offsets)
+
+    def test_decomposed_morphology_matches_opencv(self):
+        rng = np.random.default_rng(36)
+        kernels = [
+            diamond(12),
+            np.ones((4, 6), np.uint8),
+            MorphologySettings.KERNEL_LARGE,
+            MorphologySettings.KERNEL_HOLLOW,
+        ]
+        for backend in MorphologySettings.MORPHOLOGY_BACKENDS:
+            for kernel in kernels:
+                for iterations in (1, 3):
+                    for shape in ((7, 5), (90, 130)):
+                        image = ((rng.random(shape) < DENSITY) * 255).astype(np.uint8)
+                        eca = ca_mm_class.EcaMm(
+                            kernel=kernel, iterations=iterations, backend=backend
+                        )
+                        dilated = cv.dilate(image, kernel, iterations=iterations)
+                        eroded = cv.erode(image, kernel, iterations=iterations)
+                        self.assertTrue(np.array_equal(eca._dilate(image), dilated))
+                        self.assertTrue(np.array_equal(eca._erode(image), eroded))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,329 @@
+"""Checks how the web app runs its tasks in the worker pool and what its routes return."""
+
+import asyncio
+import base64
+import importlib.util
+import json
+import os
+import struct
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from email import policy
+from email.parser import BytesParser
+from unittest import mock
+
+import cv2
+import numpy as np
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(PROJECT_DIR, "src"))
+from admission import AdmissionController  # noqa: E402
+from config import AppSettings  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+import web_tasks  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+def load_web_app():
+    """Import src/web-app.py, whose static and templates directories are project relative."""
+    cwd = os.getcwd()
+    os.chdir(PROJECT_DIR)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            "web_app", os.path.join(PROJECT_DIR, "src", "web-app.py")
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        os.chdir(cwd)
+
+
+web_app = load_web_app()
+
+DENSITY = 0.4
+RUN_PARAMS = {
+    "rule": "30",
+    "cell_space": 45,
+    "num_evolutions": 37,
+    "init_method": "random",
+    "print_method": "png",
+    "density": 0.5,
+    "seed": 7,
+}
+
+
+class TestRunInPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.admission = AdmissionController(workers=1, memory_budget=100, max_queued=4, timeout=10)
+        patches = [
+            mock.patch.object(web_app, "worker_pool", web_app.WorkerPool(lambda: self.pool)),
+            mock.patch.object(web_app, "admission", self.admission),
+            mock.patch.object(web_app.AppSettings, "REQUEST_TIMEOUT", 0.1),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.pool.shutdown)
+
+    def test_timed_out_task_keeps_its_worker(self):
+        async def scenario():
+            with self.assertRaises(HTTPException) as error:
+                await web_app.run_in_pool((10, 0.01), time.sleep, 0.5)
+            self.assertEqual(error.exception.status_code, 504)
+            # The worker is still sleeping, its slot and memory are not free yet
+            self.assertEqual(self.admission.running, 1)
+            self.assertEqual(self.admission.memory, 10)
+            await asyncio.sleep(0.6)
+            self.assertEqual(self.admission.running, 0)
+            self.assertEqual(self.admission.memory, 0)
+
+        asyncio.run(scenario())
+
+    def test_result_and_release(self):
+        async def scenario():
+            self.assertEqual(await web_app.run_in_pool((10, 0.01), abs, -3), 3)
+            await asyncio.sleep(0.01)
+            self.assertEqual(self.admission.stats()["running"], 0)
+
+        asyncio.run(scenario())
+
+
+class WebAppTestCase(unittest.TestCase):
+    """Runs the routes with a thread pool and empty caches and run registry."""
+
+    def setUp(self):
+        pool = ThreadPoolExecutor(max_workers=2)
+        admission = AdmissionController(
+            workers=2, memory_budget=2**40, max_queued=16, timeout=60
+        )
+        patches = [
+            mock.patch.object(web_app, "worker_pool", web_app.WorkerPool(lambda: pool)),
+            mock.patch.object(web_app, "admission", admission),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(pool.shutdown)
+        for cache in (web_app.image_cache, web_app.history_cache):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        web_app.runs.clear()
+        self.addCleanup(web_app.runs.clear)
+        self.client = TestClient(web_app.app)
+
+
+def decode_png(content):
+    return cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+def data_url(image):
+    _, buffer = cv2.imencode(".png", image)
+    return "data:image/png;base64," + base64.b64encode(buffer.tobytes()).decode()
+
+
+def form_parts(response):
+    """Return the parts of a multipart/form-data response by name."""
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f"Content-Type: {response.headers['content-type']}\r\n\r\n".encode() + response.content
+    )
+    return {
+        part.get_param("name", header="content-disposition"): part
+        for part in message.iter_parts()
+    }
+
+
+class TestMorphologyBatch(WebAppTestCase):
+    def setUp(self):
+        super().setUp()
+        image = np.random.default_rng(37).random((40, 53)) < DENSITY
+        self.image_data = data_url(np.where(image, 0, 255).astype(np.uint8))
+
+    def test_parts_match_single_operations(self):
+        specs = [
+            {"operation": "dilation", "kernel": "small", "iterations": 1},
+            {"operation": "erosion", "kernel": "small", "iterations": 1},
+            {"operation": "gradation", "kernel": "large", "iterations": 2},
+            {"operation": "blackhat", "kernel": "hollow", "iterations": 1},
+            {"operation": "dilation", "kernel": "small", "custom_kernel": "0,1,0;1,1,1"},
+            # Repeated spec, both parts are the shared result
+            {"operation": "dilation", "kernel": "small", "iterations": 1},
+        ]
+        response = self.client.post(
+            "/generate_morphological_batch", json={"image_data": self.image_data, "specs": specs}
+        )
+        self.assertEqual(response.status_code, 200)
+        parts = form_parts(response)
+        self.assertEqual(list(parts), ["results", *map(str, range(len(specs)))])
+
+        results = json.loads(parts["results"].get_content())
+        self.assertEqual(len(results), len(specs))
+        for index, spec in enumerate(specs):
+            with self.subTest(spec=spec):
+                kernel = "custom" if "custom_kernel" in spec else spec["kernel"]
+                self.assertEqual(
+                    results[index],
+                    {
+                        "operation": spec["operation"],
+                        "kernel": kernel,
+                        "iterations": spec.get("iterations", 1),
+                    },
+                )
+                part = parts[str(index)]
+                self.assertEqual(part.get_content_type(), "image/png")
+                self.assertEqual(part.get_filename(), f"{index}.png")
+                single = self.client.post(
+                    "/generate_morphological", json={"image_data": self.image_data, **spec}
+                )
+                self.assertEqual(single.status_code, 200)
+                np.testing.assert_array_equal(
+                    decode_png(part.get_content()), decode_png(single.content)
+                )
+
+    def test_invalid_specs(self):
+        for specs in ([], [{"operation": "opening"}]):
+            response = self.client.post(
+                "/generate_morphological_batch",
+                json={"image_data": self.image_data, "specs": specs},
+            )
+            self.assertEqual(response.status_code, 400)
+
+
+class TestTiles(WebAppTestCase):
+    def setUp(self):
+        super().setUp()
+        # 16 pixel tiles split the 37 x 45 run in 3 x 3 tiles, with partial ones at the edges
+        patch = mock.patch.object(web_app.AppSettings, "TILE_SIZE", 16)
+        patch.start()
+        self.addCleanup(patch.stop)
+        packed, rows, _ = web_tasks.generate_packed(RUN_PARAMS)
+        self.packed = np.frombuffer(packed, np.uint8).reshape(rows, -1)
+
+    def test_levels_stitch_to_the_whole_run(self):
+        run = self.client.post("/runs", json=RUN_PARAMS).json()
+        self.assertEqual(
+            {key: run[key] for key in ("rows", "cols", "tile_size", "max_zoom")},
+            {"rows": 37, "cols": 45, "tile_size": 16, "max_zoom": 2},
+        )
+        for z in range(run["max_zoom"] + 1):
+            scale = 2 ** (run["max_zoom"] - z)
+            span = 16 * scale
+            with self.subTest(z=z):
+                bands = []
+                for y in range(-(-37 // span)):
+                    tiles = []
+                    for x in range(-(-45 // span)):
+                        response = self.client.get(f"/tiles/{run['run']}/{z}/{x}/{y}.png")
+                        self.assertEqual(response.status_code, 200)
+                        tiles.append(decode_png(response.content))
+                    bands.append(np.hstack(tiles))
+                # Spans are whole blocks, the tiles are the run rendered in one piece
+                expected = decode_png(web_tasks.render_tile(self.packed, 45, scale))
+                np.testing.assert_array_equal(np.vstack(bands), expected)
+
+    def test_cached_and_missing_tiles(self):
+        run = self.client.post("/runs", json=RUN_PARAMS).json()["run"]
+        response = self.client.get(f"/tiles/{run}/0/0/0.png")
+        etag = response.headers["etag"]
+        cached = self.client.get(f"/tiles/{run}/0/0/0.png", headers={"If-None-Match": etag})
+        self.assertEqual(cached.status_code, 304)
+        for path in (f"{run}/3/0/0", f"{run}/2/3/0", f"{run}/2/0/3", f"{run}/-1/0/0"):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(f"/tiles/{path}.png").status_code, 404)
+        self.assertEqual(self.client.get("/tiles/unknown/0/0/0.png").status_code, 404)
+
+
+class TestStreamImage(WebAppTestCase):
+    def stream(self, params):
+        """Return the header, the blocks by first row and the last message of a stream."""
+        blocks = {}
+        with self.client.websocket_connect("/ws/generate_image") as websocket:
+            websocket.send_json(params)
+            header = websocket.receive_json()
+            while True:
+                message = websocket.receive()
+                if message.get("bytes") is None:
+                    return header, blocks, json.loads(message["text"])
+                (first_row,) = struct.unpack("<I", message["bytes"][:4])
+                blocks[first_row] = message["bytes"][4:]
+
+    def test_blocks_join_to_the_packed_evolution(self):
+        packed, rows, cols = web_tasks.generate_packed(RUN_PARAMS)
+        row_bytes = (cols + 7) // 8
+        # Blocks of 1, 2, 4... rows, or of at most 3 rows, end at every kind of boundary
+        for max_block_bytes in (AppSettings.STREAM_MAX_BLOCK_BYTES, 3 * row_bytes):
+            with self.subTest(max_block_bytes=max_block_bytes), mock.patch.multiple(
+                AppSettings,
+                STREAM_FIRST_BLOCK_ROWS=1,
+                STREAM_BLOCK_SECONDS=60,
+                STREAM_MAX_BLOCK_BYTES=max_block_bytes,
+            ):
+                header, blocks, done = self.stream(RUN_PARAMS)
+                self.assertEqual((header["rows"], header["cols"]), (rows, cols))
+                self.assertIn(header["run"], web_app.runs)
+                self.assertEqual(done, {"done": True})
+                first_rows = sorted(blocks)
+                self.assertEqual(first_rows[0], 0)
+                self.assertGreater(len(first_rows), 2)
+                for first_row, next_row in zip(first_rows, [*first_rows[1:], rows], strict=True):
+                    self.assertEqual(len(blocks[first_row]), (next_row - first_row) * row_bytes)
+                self.assertEqual(b"".join(blocks[row] for row in first_rows), packed)
+
+    def test_invalid_params(self):
+        with self.client.websocket_connect("/ws/generate_image") as websocket:
+            websocket.send_json({"rule": "30"})
+            message = websocket.receive()
+        self.assertEqual(message["type"], "websocket.close")
+        self.assertEqual(message["code"], 1008)
+
+
+class TestRunSource(WebAppTestCase):
+    def setUp(self):
+        super().setUp()
+        response = self.client.post("/generate_image", json=RUN_PARAMS)
+        self.run = response.headers["x-run-id"]
+        self.image_data = "data:image/png;base64," + base64.b64encode(response.content).decode()
+
+    def test_run_matches_its_png(self):
+        for operation in ("dilation", "erosion", "gradation", "blackhat"):
+            for kernel, iterations in (("small", 1), ("large", 2)):
+                spec = {"operation": operation, "kernel": kernel, "iterations": iterations}
+                with self.subTest(**spec):
+                    results = [
+                        self.client.post("/generate_morphological", json={**source, **spec})
+                        for source in ({"run": self.run}, {"image_data": self.image_data})
+                    ]
+                    self.assertEqual([result.status_code for result in results], [200, 200])
+                    np.testing.assert_array_equal(
+                        decode_png(results[0].content), decode_png(results[1].content)
+                    )
+
+    def test_batch_run_matches_its_png(self):
+        specs = [{"operation": "gradation"}, {"operation": "blackhat", "kernel": "hollow"}]
+        responses = [
+            self.client.post("/generate_morphological_batch", json={**source, "specs": specs})
+            for source in ({"run": self.run}, {"image_data": self.image_data})
+        ]
+        parts = [form_parts(response) for response in responses]
+        for index in range(len(specs)):
+            np.testing.assert_array_equal(
+                *(decode_png(part[str(index)].get_content()) for part in parts)
+            )
+
+    def test_source_required_once(self):
+        spec = {"operation": "dilation", "kernel": "small"}
+        for source, status in (
+            ({}, 400),
+            ({"run": self.run, "image_data": self.image_data}, 400),
+            ({"run": "unknown"}, 404),
+        ):
+            with self.subTest(source=list(source)):
+                response = self.client.post("/generate_morphological", json={**source, **spec})
+                self.assertEqual(response.status_code, status)
+
+
+if __name__ == "__main__":
+    unittest.main()
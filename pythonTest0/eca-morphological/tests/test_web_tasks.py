@@ -0,0 +1,107 @@
+"""Checks the tiles and the packed evolutions computed by the web app workers."""
+
+import base64
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+import binary_morphology  # noqa: E402
+import web_tasks  # noqa: E402
+
+DENSITY = 0.45
+PARAMS = {
+    "rule": "110",
+    "cell_space": 43,
+    "num_evolutions": 29,
+    "init_method": "random",
+    "print_method": "png",
+    "density": 0.5,
+    "seed": 46,
+}
+
+
+def decode_png(content):
+    return cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+def downsample(cells, scale, active_color=0):
+    """Return the tile of active cells (1) by averaging every scale x scale block."""
+    rows, cols = cells.shape
+    tile = np.empty((-(-rows // scale), -(-cols // scale)), np.uint8)
+    for y in range(tile.shape[0]):
+        for x in range(tile.shape[1]):
+            fraction = cells[y * scale : (y + 1) * scale, x * scale : (x + 1) * scale].mean()
+            tile[y, x] = np.rint(255 + (active_color - 255) * fraction)
+    return tile
+
+
+class TestRenderTile(unittest.TestCase):
+    def setUp(self):
+        # Neither side is a multiple of the scales or of 8, so the last blocks are partial
+        self.cells = (np.random.default_rng(45).random((37, 45)) < DENSITY).astype(np.uint8)
+        self.packed = binary_morphology.pack_rows(self.cells)
+
+    def test_one_cell_per_pixel(self):
+        tile = decode_png(web_tasks.render_tile(self.packed, 45, 1))
+        np.testing.assert_array_equal(tile, np.where(self.cells, 0, 255))
+
+    def test_downsampled(self):
+        for scale in (2, 3, 4, 8, 64):
+            for active_color in (0, 96):
+                with self.subTest(scale=scale, active_color=active_color):
+                    tile = web_tasks.render_tile(self.packed, 45, scale, active_color)
+                    np.testing.assert_array_equal(
+                        decode_png(tile), downsample(self.cells, scale, active_color)
+                    )
+
+    def test_active_color_at_one_cell_per_pixel(self):
+        tile = decode_png(web_tasks.render_tile(self.packed, 45, 1, active_color=96))
+        np.testing.assert_array_equal(tile, np.where(self.cells, 96, 255))
+
+    def test_fewer_cells_than_packed(self):
+        # A tile at the right edge of a run reads only its first cols of each packed row
+        tile = web_tasks.render_tile(self.packed, 21, 2)
+        np.testing.assert_array_equal(decode_png(tile), downsample(self.cells[:, :21], 2))
+
+
+class TestGenerateBlock(unittest.TestCase):
+    def test_blocks_join_to_the_whole_evolution(self):
+        for params in (PARAMS, dict(PARAMS, rule="30", init_method="single_cell")):
+            packed, rows, cols = web_tasks.generate_packed(params)
+            for block_rows in (1, 3, 16, 29, 40):
+                with self.subTest(rule=params["rule"], block_rows=block_rows):
+                    blocks = []
+                    state = None
+                    while len(blocks) < rows:
+                        count = min(block_rows, rows - len(blocks))
+                        block, state = web_tasks.generate_block(params, state, count)
+                        self.assertEqual(len(block), count * ((cols + 7) // 8))
+                        blocks.extend(np.frombuffer(block, np.uint8).reshape(count, -1))
+                    self.assertEqual(b"".join(row.tobytes() for row in blocks), packed)
+
+    def test_last_state(self):
+        packed, rows, cols = web_tasks.generate_packed(PARAMS)
+        _, state = web_tasks.generate_block(PARAMS, None, rows)
+        last_row = np.frombuffer(packed, np.uint8).reshape(rows, -1)[-1:]
+        last_state = binary_morphology.unpack_rows(last_row, cols, value=1)[0]
+        np.testing.assert_array_equal(state, last_state)
+
+
+class TestSourceImage(unittest.TestCase):
+    def test_packed_history_is_its_png(self):
+        packed, rows, cols = web_tasks.generate_packed(PARAMS)
+        packed = np.frombuffer(packed, np.uint8).reshape(rows, -1)
+        png = web_tasks.generate_image(dict(PARAMS, pixel_size=1))
+        image_data = "data:image/png;base64," + base64.b64encode(png).decode()
+        self.assertEqual(web_tasks.png_shape(image_data), (rows, cols))
+        np.testing.assert_array_equal(
+            web_tasks.source_image((packed, cols)), web_tasks.source_image(image_data)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
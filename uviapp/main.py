@@ -1,6 +1,6 @@
 import uvicorn
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from PIL import Image, ImageDraw, ImageFont
@@ -10,7 +10,6 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../pythonTest0/eca-morphological/src')))
 import ca_class
 import io
-import base64
 
 # --- Application Setup ---
 app = FastAPI()
@@ -45,7 +44,7 @@ async def read_root(request: Request):
 async def generate_image(params: SimulationParams):
     """
     Receives parameters, generates a placeholder image with the data written on it,
-    and returns it as a Base64-encoded data URL.
+    and returns it as an image/png response.
     """
     eca_rule_number = params.rule
     eca_size = params.cell_space
@@ -74,12 +73,8 @@ async def generate_image(params: SimulationParams):
     # Save image to a memory buffer
     buffered = io.BytesIO()
     img.save(buffered, format="PNG")
-    
-    # Encode the image to Base64 and create a data URL
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    img_data_url = f"data:image/png;base64,{img_str}"
 
-    return {"image_data": img_data_url}
+    return Response(content=buffered.getvalue(), media_type="image/png")
 
 
 if __name__ == "__main__":